@@ -0,0 +1,187 @@
+"""
+Communication Log
+Ограниченный лог коммуникации агентов с асинхронной пакетной записью в SQLite или файл
+"""
+import abc
+import json
+import queue
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+
+# Тяжелые поля сообщений (бары, вектор признаков) - не хранятся в логе
+HEAVY_FIELDS = ("prices", "data", "features")
+# Поля сообщения, копируемые в легкую запись лога
+SUMMARY_FIELDS = ("ticker", "status", "decision", "action", "current_price", "predicted_price",
+                  "confidence", "message")
+
+# Признак остановки фонового потока записи
+_STOP = object()
+
+
+def _json_default(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+def compact_message(message: Dict) -> Dict:
+    """Копия сообщения без тяжелых полей"""
+    return {key: value for key, value in message.items() if key not in HEAVY_FIELDS}
+
+
+class LogWriter(abc.ABC):
+    """
+    Фоновый поток, записывающий записи лога пакетами
+
+    Цикл агентов только кладет запись в очередь; при переполнении очереди запись
+    отбрасывается (счетчик dropped), чтобы лог не замедлял торговлю.
+    """
+
+    def __init__(self, batch_size: int = 100, flush_interval: float = 1.0, max_queue: int = 10000):
+        """
+        Инициализация
+
+        Args:
+            batch_size: Максимальный размер пакета записи
+            flush_interval: Максимальное время накопления пакета, сек
+            max_queue: Размер очереди записей
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self.written = 0
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+        self._thread.start()
+
+    def submit(self, entry: Dict):
+        """Ставит запись в очередь записи (не блокирует)"""
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    @abc.abstractmethod
+    def write_batch(self, batch: List[Dict]):
+        """Записывает пакет (реализуется в наследниках)"""
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self.queue.get()
+            batch, n_items = [], 1
+            if item is _STOP:
+                stop = True
+            else:
+                batch.append(item)
+            # Набираем пакет, пока он не заполнится или не истечет flush_interval
+            deadline = time.monotonic() + self.flush_interval
+            while not stop and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                n_items += 1
+                if item is _STOP:
+                    stop = True
+                else:
+                    batch.append(item)
+
+            if batch:
+                try:
+                    self.write_batch(batch)
+                    self.written += len(batch)
+                except Exception as e:
+                    print(f"Error writing communication log: {e}")
+            for _ in range(n_items):
+                self.queue.task_done()
+
+    def flush(self):
+        """Ждет записи всех поставленных в очередь записей"""
+        self.queue.join()
+
+    def close(self):
+        """Записывает оставшиеся записи и останавливает поток"""
+        if self._thread.is_alive():
+            self.queue.put(_STOP)
+            self._thread.join()
+
+
+class SQLiteLogWriter(LogWriter):
+    """Запись лога в таблицу communication_log"""
+
+    def __init__(self, db_manager, user_id: Optional[int] = None, **kwargs):
+        self.db_manager = db_manager
+        self.user_id = user_id
+        super().__init__(**kwargs)
+
+    def write_batch(self, batch: List[Dict]):
+        self.db_manager.add_communication_logs(self.user_id, batch)
+
+
+class JsonlLogWriter(LogWriter):
+    """Запись лога в append-only JSONL файл"""
+
+    def __init__(self, path: str, **kwargs):
+        self.path = path
+        super().__init__(**kwargs)
+
+    def write_batch(self, batch: List[Dict]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(entry, default=_json_default) + "\n" for entry in batch)
+
+
+class CommunicationLog:
+    """Кольцевой буфер легких записей лога с опциональной фоновой записью"""
+
+    def __init__(self, maxlen: int = 1000, writer: Optional[LogWriter] = None,
+                 sample_rate: float = 0.0, seed: Optional[int] = None):
+        """
+        Инициализация
+
+        Args:
+            maxlen: Количество последних записей в памяти
+            writer: Фоновая запись (SQLiteLogWriter, JsonlLogWriter); None - только память
+            sample_rate: Доля записей, сохраняющих сообщение целиком (без HEAVY_FIELDS)
+            seed: Seed выборки сообщений
+        """
+        self.entries: deque = deque(maxlen=maxlen)
+        self.writer = writer
+        self.sample_rate = sample_rate
+        self._random = random.Random(seed)
+
+    def log(self, from_agent: str, to_agent: str, message: Dict):
+        """Добавляет запись о сообщении между агентами"""
+        entry = {
+            "timestamp": datetime.now(),
+            "from": from_agent,
+            "to": to_agent,
+            "message_type": message.get("type", "unknown"),
+        }
+        entry.update((key, message[key]) for key in SUMMARY_FIELDS if key in message)
+        if self.sample_rate > 0 and self._random.random() < self.sample_rate:
+            entry["payload"] = compact_message(message)
+        self.entries.append(entry)
+        if self.writer is not None:
+            self.writer.submit(entry)
+
+    def to_list(self) -> List[Dict]:
+        return list(self.entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def clear(self):
+        """Очищает буфер в памяти (записанные записи остаются)"""
+        self.entries.clear()
+
+    def close(self):
+        """Дописывает очередь и останавливает фоновую запись"""
+        if self.writer is not None:
+            self.writer.close()
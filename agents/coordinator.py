@@ -2,18 +2,26 @@
 Agent Coordinator
 Координирует коммуникацию между агентами
 """
+import time
+import pandas as pd
 from typing import Dict, List, Optional
 from datetime import datetime
 from .market_monitor import MarketMonitoringAgent
 from .decision_agent import DecisionMakingAgent
 from .execution_agent import ExecutionAgent
+from .comm_log import CommunicationLog
+from .instrumentation import LatencyRecorder, timed
 
 
 class AgentCoordinator:
     """Координатор для управления взаимодействием агентов"""
     
     def __init__(self, ticker: str = "AAPL", initial_balance: float = 10000.0, 
-                 user_id: Optional[int] = None, use_db: bool = True):
+                 user_id: Optional[int] = None, use_db: bool = True,
+                 online_learning: bool = False, dtype: str = "float64",
+                 db_manager=None, verbose: bool = True,
+                 decision_agent: Optional[DecisionMakingAgent] = None,
+                 communication_log: Optional[CommunicationLog] = None):
         """
         Инициализация координатора
         
@@ -22,11 +30,18 @@ class AgentCoordinator:
             initial_balance: Начальный баланс портфеля
             user_id: ID пользователя (обязательно если use_db=True)
             use_db: Использовать ли БД вместо CSV
+            online_learning: Дообучать модель инкрементально на новых барах
+            dtype: Тип данных индикаторов и признаков ("float64" или "float32")
+            db_manager: Менеджер БД (например, изолированная БД воспроизведения)
+            verbose: Печатать отладочную информацию агентов
+            decision_agent: Готовый агент решений (например, с моделью и реестром воспроизведения)
+            communication_log: Лог коммуникации (например, с записью в БД); по умолчанию - только память
         """
         self.ticker = ticker
         self.user_id = user_id
-        self.market_agent = MarketMonitoringAgent(ticker)
-        self.decision_agent = DecisionMakingAgent()
+        self.market_agent = MarketMonitoringAgent(ticker, dtype=dtype if dtype != "float64" else None)
+        self.decision_agent = decision_agent or DecisionMakingAgent(online=online_learning, dtype=dtype,
+                                                                    verbose=verbose)
         
         # Если user_id не указан, используем старый способ (CSV)
         if user_id is None:
@@ -35,35 +50,59 @@ class AgentCoordinator:
         self.execution_agent = ExecutionAgent(
             user_id=user_id if user_id else 0,
             initial_balance=initial_balance,
-            use_db=use_db
+            use_db=use_db,
+            db_manager=db_manager
         )
-        self.communication_log = []
+        # Последние известные цены тикеров: остальные позиции портфеля оцениваются по ним
+        # (без цены - по средней цене покупки), а не по цене тикера текущего цикла
+        self.last_prices: Dict[str, float] = {}
+        # Последние записи в памяти (без баров и признаков)
+        self.communication_log = communication_log if communication_log is not None else CommunicationLog()
+        # Скользящие распределения задержек этапов цикла
+        self.latency = LatencyRecorder()
     
     def log_communication(self, from_agent: str, to_agent: str, message: Dict):
         """Логирует коммуникацию между агентами"""
-        log_entry = {
-            "timestamp": datetime.now(),
-            "from": from_agent,
-            "to": to_agent,
-            "message_type": message.get("type", "unknown"),
-            "message": message
-        }
-        self.communication_log.append(log_entry)
+        self.communication_log.log(from_agent, to_agent, message)
     
-    def run_cycle(self) -> Dict:
+    def run_cycle(self, market_data: Optional[Dict] = None) -> Dict:
         """
         Выполняет один цикл работы системы:
         1. Market Agent получает данные
         2. Decision Agent принимает решение
         3. Execution Agent выполняет сделку
         
+        Args:
+            market_data: Готовое сообщение market_update (при воспроизведении);
+                         если None, данные запрашиваются у рынка
+        
         Returns:
-            Результат выполнения цикла
+            Результат выполнения цикла; result["timings"] - время этапов в мс
+            ("market.fetch", "decision.predict", "execution.persist", ..., "total")
         """
+        timings: Dict[str, float] = {}
+        with timed(timings, "total"):
+            result = self._run_cycle(market_data, timings)
+        result["timings"] = timings
+        self.latency.record(self.ticker, timings)
+        return result
+    
+    @staticmethod
+    def _add_stage_timings(timings: Dict[str, float], stage: str, agent_timings: Dict[str, float]):
+        """Добавляет время подэтапов агента с префиксом этапа"""
+        for step, value in agent_timings.items():
+            timings[f"{stage}.{step}"] = value
+    
+    def _run_cycle(self, market_data: Optional[Dict], timings: Dict[str, float]) -> Dict:
+        """Шаги run_cycle с замером времени каждого этапа"""
         try:
             # Шаг 1: Market Monitoring Agent получает данные
-            market_data = self.market_agent.get_market_data(period="1mo", interval="1d")
-            self.log_communication("MarketAgent", "DecisionAgent", market_data)
+            # (при воспроизведении подэтапы - от build_market_update, вызванного в replay)
+            with timed(timings, "market"):
+                if market_data is None:
+                    market_data = self.market_agent.get_market_data(period="1mo", interval="1d")
+                self.log_communication("MarketAgent", "DecisionAgent", market_data)
+            self._add_stage_timings(timings, "market", self.market_agent.last_timings)
             
             if market_data.get("type") == "error":
                 return {
@@ -74,8 +113,10 @@ class AgentCoordinator:
                 }
             
             # Шаг 2: Decision-Making Agent обрабатывает данные и принимает решение
-            decision = self.decision_agent.process_market_update(market_data)
-            self.log_communication("DecisionAgent", "ExecutionAgent", decision)
+            with timed(timings, "decision"):
+                decision = self.decision_agent.process_market_update(market_data)
+                self.log_communication("DecisionAgent", "ExecutionAgent", decision)
+            self._add_stage_timings(timings, "decision", self.decision_agent.last_timings)
             
             if decision.get("type") == "error":
                 return {
@@ -86,12 +127,16 @@ class AgentCoordinator:
                 }
             
             # Шаг 3: Execution Agent выполняет сделку
-            execution_result = self.execution_agent.execute_trade(decision)
-            self.log_communication("ExecutionAgent", "UI", execution_result)
+            with timed(timings, "execution"):
+                execution_result = self.execution_agent.execute_trade(decision)
+                self.log_communication("ExecutionAgent", "UI", execution_result)
+            self._add_stage_timings(timings, "execution", self.execution_agent.last_timings)
             
             # Формируем итоговый результат
-            current_price = market_data.get("current_price", 0)
-            portfolio_summary = self.execution_agent.get_portfolio_summary(current_price)
+            self.last_prices[market_data.get("ticker") or self.ticker] = market_data.get("current_price", 0)
+            with timed(timings, "portfolio"):
+                portfolio_summary = self.execution_agent.get_portfolio_summary(self.last_prices)
+                self.execution_agent.record_equity_snapshot(self.last_prices)
             
             return {
                 "status": "success",
@@ -122,13 +167,67 @@ class AgentCoordinator:
                 "timestamp": datetime.now().isoformat()
             }
     
+    def replay(self, feed, keep_results: bool = False) -> Dict:
+        """
+        Прогоняет записанные бары через агентов без ожидания реального времени
+        
+        Каждый бар проходит тот же путь, что и в run_cycle; время сделок берется из бара.
+        
+        Args:
+            feed: Итерируемый источник пар (время бара, окно OHLCV), например ReplayFeed
+            keep_results: Сохранять результаты всех циклов
+        
+        Returns:
+            Сводка: количество циклов, сделок и ошибок, решения, пропускная способность, портфель,
+            процентили задержек этапов
+        """
+        results = []
+        decisions = {"BUY": 0, "SELL": 0, "HOLD": 0}
+        n_cycles = n_trades = n_errors = 0
+        original_clock = self.execution_agent.clock
+        
+        started = time.perf_counter()
+        try:
+            for bar_time, window in feed:
+                bar_datetime = pd.Timestamp(bar_time).to_pydatetime()
+                self.execution_agent.clock = lambda bar_datetime=bar_datetime: bar_datetime
+                market_data = self.market_agent.build_market_update(window)
+                result = self.run_cycle(market_data)
+                
+                n_cycles += 1
+                if result.get("status") == "success":
+                    action = result["decision"].get("action")
+                    decisions[action] = decisions.get(action, 0) + 1
+                    if result["execution"].get("status") == "success":
+                        n_trades += 1
+                else:
+                    n_errors += 1
+                if keep_results:
+                    results.append(result)
+        finally:
+            self.execution_agent.clock = original_clock
+        elapsed = time.perf_counter() - started
+        
+        return {
+            "ticker": self.ticker,
+            "n_cycles": n_cycles,
+            "n_trades": n_trades,
+            "n_errors": n_errors,
+            "decisions": decisions,
+            "elapsed": elapsed,
+            "cycles_per_sec": n_cycles / elapsed if elapsed > 0 else 0.0,
+            "portfolio": self.execution_agent.get_portfolio_summary(self.last_prices),
+            "latency": self.latency.summary(self.ticker),
+            "results": results
+        }
+    
     def get_market_dataframe(self, period: str = "1mo", interval: str = "1d", force_refresh: bool = False):
         """Получает данные рынка в виде DataFrame"""
         return self.market_agent.get_dataframe(period, interval, force_refresh=force_refresh)
     
     def get_communication_log(self) -> List[Dict]:
-        """Возвращает лог коммуникации"""
-        return self.communication_log
+        """Возвращает лог коммуникации (последние записи)"""
+        return self.communication_log.to_list()
     
     def get_decision_history(self):
         """Возвращает историю решений"""
@@ -141,6 +240,10 @@ class AgentCoordinator:
     def reset_system(self):
         """Сбрасывает систему к начальному состоянию"""
         self.execution_agent.reset_portfolio()
-        self.communication_log = []
+        self.communication_log.clear()
         self.decision_agent.decision_history = []
-
+        self.latency.reset()
+    
+    def close(self):
+        """Дописывает лог коммуникации и останавливает его фоновую запись"""
+        self.communication_log.close()
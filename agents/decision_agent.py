@@ -4,25 +4,64 @@ AI-модель предсказывает движение цены и прин
 """
 import pandas as pd
 import numpy as np
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 import joblib
 import os
 from datetime import datetime
 
+from .instrumentation import timed
+from .market_monitor import CLOSE_INDEX
+
+
+# Коды действий для векторизованных решений
+HOLD, BUY, SELL = 0, 1, -1
+ACTION_NAMES = {HOLD: "HOLD", BUY: "BUY", SELL: "SELL"}
+
 
 class DecisionMakingAgent:
     """Агент для принятия торговых решений на основе ML-модели"""
     
-    def __init__(self, model_path: Optional[str] = None):
+    # Рабочая модель (обучается models/train_model.py)
+    DEFAULT_MODEL_PATH = "models/model.pkl"
+    
+    def __init__(self, model_path: Optional[str] = None, online: bool = False,
+                 checkpoint_every: int = 50, registry=None, dtype: str = "float64",
+                 threshold: float = 0.02, low_confidence_multiplier: float = 1.5,
+                 high_confidence_multiplier: float = 0.8, min_abs_move: float = 0.01,
+                 verbose: bool = True):
         """
         Инициализация агента
         
         Args:
             model_path: Путь к обученной модели (если None, создаст новую)
+            online: Дообучать модель инкрементально на каждом новом размеченном баре
+            checkpoint_every: Через сколько обновлений сохранять чекпоинт модели в реестр
+            registry: Реестр моделей для чекпоинтов (если None, создается ModelRegistry)
+            dtype: Тип данных вектора признаков (float32 - как у модели, обученной на float32)
+            threshold: Базовый порог изменения цены для BUY/SELL
+            low_confidence_multiplier: Множитель порога при низкой уверенности (< 0.5)
+            high_confidence_multiplier: Множитель порога при высокой уверенности (> 0.8)
+            min_abs_move: Минимальное абсолютное изменение как доля цены
+            verbose: Печатать отладочную информацию о каждом предсказании
         """
         self.model = None
-        self.model_path = model_path or "models/model.pkl"
+        self.model_path = model_path or self.DEFAULT_MODEL_PATH
         self.decision_history = []
+        self.online = online
+        self.checkpoint_every = checkpoint_every
+        self.registry = registry
+        # Последний бар, ожидающий разметки: {ticker: (bar_time, features, predicted_price)}
+        self.pending_bars = {}
+        self.online_updates = 0
+        self.online_abs_errors = []
+        self.dtype = np.dtype(dtype)
+        self.threshold = threshold
+        self.low_confidence_multiplier = low_confidence_multiplier
+        self.high_confidence_multiplier = high_confidence_multiplier
+        self.min_abs_move = min_abs_move
+        self.verbose = verbose
+        # Время этапов последнего вызова process_market_update(s), мс
+        self.last_timings: Dict[str, float] = {}
         self.load_model()
     
     def load_model(self):
@@ -38,6 +77,87 @@ class DecisionMakingAgent:
             print(f"Model not found at {self.model_path}. Please train the model first.")
             self.model = None
     
+    def supports_online_learning(self) -> bool:
+        """Поддерживает ли загруженная модель инкрементальное обучение"""
+        return self.model is not None and hasattr(self.model, "partial_fit")
+    
+    def update_online(self, market_data: Dict, features: np.ndarray, predicted_price: float) -> Optional[Dict]:
+        """
+        Дообучает модель на предыдущем баре тикера, когда пришел новый бар
+        
+        Целевая переменная - следующая цена закрытия, поэтому бар размечается ценой
+        закрытия следующего наблюдаемого бара.
+        
+        Args:
+            market_data: Данные от Market Monitoring Agent
+            features: Признаки текущего бара
+            predicted_price: Предсказание для текущего бара (для оценки ошибки после разметки)
+        
+        Returns:
+            Информация об обновлении или None, если обновления не было
+        """
+        if not self.online or not self.supports_online_learning():
+            return None
+        
+        ticker = market_data.get("ticker")
+        bar_time = market_data.get("bar_time")
+        current_price = market_data.get("current_price", 0)
+        if bar_time is None or current_price <= 0:
+            return None
+        
+        update = None
+        pending = self.pending_bars.get(ticker)
+        if pending is not None and pending[0] != bar_time:
+            pending_time, pending_features, pending_prediction = pending
+            started = datetime.now()
+            self.model.partial_fit(pending_features, np.array([current_price]))
+            self.online_updates += 1
+            # Ошибка предсказания, сделанного до того, как бар был размечен
+            self.online_abs_errors.append(abs(pending_prediction - current_price))
+            self.online_abs_errors = self.online_abs_errors[-500:]
+            update = {
+                "bar_time": pending_time,
+                "label": current_price,
+                "update_ms": (datetime.now() - started).total_seconds() * 1000,
+                "n_updates": self.online_updates
+            }
+            if self.checkpoint_every and self.online_updates % self.checkpoint_every == 0:
+                self.checkpoint_model(ticker)
+        
+        if pending is None or pending[0] != bar_time:
+            self.pending_bars[ticker] = (bar_time, features.copy(), predicted_price)
+        return update
+    
+    def checkpoint_model(self, ticker: Optional[str] = None) -> Optional[str]:
+        """
+        Сохраняет текущую онлайн-модель на диск и в реестр моделей
+        
+        Returns:
+            ID записи реестра или None
+        """
+        if self.model is None:
+            return None
+        try:
+            joblib.dump(self.model, self.model_path)
+            if self.registry is None:
+                from models.registry import ModelRegistry
+                self.registry = ModelRegistry()
+            recent_errors = self.online_abs_errors[-self.checkpoint_every:] if self.checkpoint_every else []
+            return self.registry.register(
+                kind="online_checkpoint",
+                ticker=ticker or "",
+                model_type=type(self.model).__name__,
+                metrics={
+                    "n_updates": self.online_updates,
+                    "model_updates_total": getattr(self.model, "n_updates", None),
+                    "recent_mae": float(np.mean(recent_errors)) if recent_errors else None
+                },
+                model=self.model
+            )
+        except Exception as e:
+            print(f"Error saving model checkpoint: {e}")
+            return None
+    
     def extract_features(self, market_data: Dict) -> Optional[np.ndarray]:
         """
         Извлекает признаки из данных рынка для ML-модели
@@ -105,7 +225,7 @@ class DecisionMakingAgent:
             else:
                 features.extend([0.0] * 5)
             
-            return np.array(features).reshape(1, -1)
+            return np.array(features, dtype=self.dtype).reshape(1, -1)
             
         except Exception as e:
             print(f"Error extracting features: {e}")
@@ -121,11 +241,10 @@ class DecisionMakingAgent:
         Returns:
             Предсказанная цена
         """
-        # Текущая цена (Close) всегда находится на индексе 14 в массиве признаков
-        # Порядок признаков: MA5, MA20, Volatility, Returns, Returns_5, Returns_20,
-        # MA5_MA20_ratio, Price_MA20_ratio, Price_MA50_ratio, Trend, Momentum,
-        # Volume_ratio, HL_spread, RSI, Close (index 14), Return_lag_1-5
-        current_price_from_features = float(features[0, 14]) if features.shape[1] > 14 else float(features[0, -1])
+        # Текущая цена (Close) находится на индексе CLOSE_INDEX в массиве признаков
+        # (порядок - FEATURE_COLUMNS)
+        current_price_from_features = (float(features[0, CLOSE_INDEX]) if features.shape[1] > CLOSE_INDEX
+                                       else float(features[0, -1]))
         
         # Используем current_price_from_market если доступен, иначе из features
         # Это более надежно, так как market_data содержит актуальную цену
@@ -147,9 +266,11 @@ class DecisionMakingAgent:
             raw_prediction = self.model.predict(features)[0]
             
             # ОТЛАДКА: Выводим информацию о предсказании
-            print(f"DEBUG Prediction: raw={raw_prediction}, current_price={current_price}, features_shape={features.shape}")
-            print(f"DEBUG Features sample (first 5): {features[0, :5]}")
-            print(f"DEBUG Close price from features[0, 14]: {features[0, 14] if features.shape[1] > 14 else 'N/A'}")
+            if self.verbose:
+                print(f"DEBUG Prediction: raw={raw_prediction}, current_price={current_price}, features_shape={features.shape}")
+                print(f"DEBUG Features sample (first 5): {features[0, :5]}")
+                print(f"DEBUG Close price from features: "
+                      f"{features[0, CLOSE_INDEX] if features.shape[1] > CLOSE_INDEX else 'N/A'}")
             
             # Проверяем, что предсказание разумное
             if raw_prediction <= 0:
@@ -187,47 +308,100 @@ class DecisionMakingAgent:
             # Используем уже вычисленную current_price из начала метода
             return float(current_price)  # Возвращаем текущую цену как fallback
     
+    def sanitize_predictions(self, raw_predictions: np.ndarray, current_prices: np.ndarray) -> np.ndarray:
+        """
+        Векторизованная постобработка сырых предсказаний модели (те же правила, что в predict)
+        
+        Args:
+            raw_predictions: Сырые предсказания модели
+            current_prices: Текущие цены
+        
+        Returns:
+            Скорректированные предсказания
+        """
+        raw = np.asarray(raw_predictions, dtype=np.float64)
+        current = np.asarray(current_prices, dtype=np.float64)
+        
+        # Отрицательные и нереалистично маленькие предсказания заменяем текущей ценой
+        unrealistic = (raw <= 0) | (raw < current * 0.01) | (raw < 1.0)
+        # Ограничиваем только экстремальные изменения (>20%)
+        safe_current = np.where(current > 0, current, 1.0)
+        change = np.where(current > 0, (raw - current) / safe_current, 0.0)
+        clipped = np.where(np.abs(change) > 0.20, current * (1 + np.sign(change) * 0.20), raw)
+        return np.where(unrealistic, current, clipped)
+    
+    def confidence_batch(self, current_prices: np.ndarray, predicted_prices: np.ndarray) -> np.ndarray:
+        """
+        Векторизованная оценка уверенности (те же правила, что в process_market_update)
+        
+        Returns:
+            Массив уверенности (0-1)
+        """
+        current = np.asarray(current_prices, dtype=np.float64)
+        predicted = np.asarray(predicted_prices, dtype=np.float64)
+        if self.model is None:
+            return np.full(np.broadcast(current, predicted).shape, 0.5)
+        
+        safe_current = np.where(current > 0, current, 1.0)
+        price_diff_pct = np.where(current > 0, np.abs((predicted - current) / safe_current), 0.0)
+        return np.where(price_diff_pct < 0.01, 0.3, np.where(price_diff_pct > 0.05, 0.9, 0.7))
+    
+    def decide_batch(self, current_prices: np.ndarray, predicted_prices: np.ndarray,
+                     confidence: np.ndarray, threshold=None, low_confidence_multiplier=None,
+                     high_confidence_multiplier=None, min_abs_move=None) -> np.ndarray:
+        """
+        Векторизованная версия decide
+        
+        Параметры правил (threshold, множители, min_abs_move) могут быть массивами,
+        которые транслируются (broadcast) с ценами - так одна матрица предсказаний
+        оценивается сразу для многих наборов параметров.
+        
+        Returns:
+            Массив кодов действий: BUY (1), SELL (-1), HOLD (0)
+        """
+        threshold = self.threshold if threshold is None else threshold
+        low_mult = self.low_confidence_multiplier if low_confidence_multiplier is None else low_confidence_multiplier
+        high_mult = self.high_confidence_multiplier if high_confidence_multiplier is None else high_confidence_multiplier
+        min_abs_move = self.min_abs_move if min_abs_move is None else min_abs_move
+        
+        current = np.asarray(current_prices, dtype=np.float64)
+        predicted = np.asarray(predicted_prices, dtype=np.float64)
+        confidence = np.asarray(confidence, dtype=np.float64)
+        
+        safe_current = np.where(current != 0, current, 1.0)
+        price_change_pct = (predicted - current) / safe_current
+        
+        # Адаптивный порог: низкая уверенность - больший порог, высокая - меньший
+        adaptive_threshold = np.where(
+            confidence < 0.5, threshold * low_mult,
+            np.where(confidence > 0.8, threshold * high_mult, threshold)
+        )
+        
+        # Учитываем не только процент, но и абсолютную разницу
+        absolute_diff = np.abs(predicted - current)
+        big_enough = absolute_diff > current * min_abs_move
+        
+        actions = np.where((price_change_pct > adaptive_threshold) & big_enough, BUY,
+                           np.where((price_change_pct < -adaptive_threshold) & big_enough, SELL, HOLD))
+        return np.where(current == 0, HOLD, actions).astype(np.int8)
+    
     def decide(self, current_price: float, predicted_price: float, 
-               threshold: float = 0.02, confidence: float = 0.0) -> str:
+               threshold: Optional[float] = None, confidence: float = 0.0) -> str:
         """
         Принимает решение на основе предсказания с улучшенной логикой
         
         Args:
             current_price: Текущая цена
             predicted_price: Предсказанная цена
-            threshold: Базовый порог для принятия решения (2% по умолчанию)
+            threshold: Базовый порог для принятия решения (по умолчанию self.threshold, 2%)
             confidence: Уверенность модели (0-1)
         
         Returns:
             "BUY", "SELL" или "HOLD"
         """
-        if current_price == 0:
-            return "HOLD"
-        
-        price_change_pct = (predicted_price - current_price) / current_price
-        
-        # Адаптивный порог: если уверенность низкая, увеличиваем порог
-        # Если уверенность высокая, можем снизить порог
-        if confidence < 0.5:
-            # Низкая уверенность - нужен больший порог для действия
-            adaptive_threshold = threshold * 1.5
-        elif confidence > 0.8:
-            # Высокая уверенность - можем действовать при меньшем пороге
-            adaptive_threshold = threshold * 0.8
-        else:
-            adaptive_threshold = threshold
-        
-        # Улучшенная логика: учитываем не только процент, но и абсолютную разницу
-        # Если разница очень маленькая, даже при большом проценте - HOLD
-        absolute_diff = abs(predicted_price - current_price)
-        min_absolute_threshold = current_price * 0.01  # Минимум 1% от цены
-        
-        if price_change_pct > adaptive_threshold and absolute_diff > min_absolute_threshold:
-            return "BUY"
-        elif price_change_pct < -adaptive_threshold and absolute_diff > min_absolute_threshold:
-            return "SELL"
-        else:
-            return "HOLD"
+        # Те же правила, что и в векторизованной версии (используется в бэктесте)
+        action = self.decide_batch(current_price, predicted_price, confidence, threshold=threshold)
+        return ACTION_NAMES[int(action)]
     
     def process_market_update(self, market_data: Dict) -> Dict:
         """
@@ -239,6 +413,7 @@ class DecisionMakingAgent:
         Returns:
             Сообщение для Execution Agent
         """
+        self.last_timings = {}
         try:
             if market_data.get("type") != "market_update":
                 return {
@@ -248,7 +423,8 @@ class DecisionMakingAgent:
                 }
             
             # Извлекаем признаки
-            features = self.extract_features(market_data)
+            with timed(self.last_timings, "features"):
+                features = self.extract_features(market_data)
             if features is None:
                 return {
                     "type": "error",
@@ -259,48 +435,19 @@ class DecisionMakingAgent:
             # Делаем предсказание
             current_price = market_data.get("current_price", 0)
             # Передаем current_price в predict для дополнительной проверки
-            predicted_price = self.predict(features, current_price_from_market=current_price)
-            
-            # Вычисляем уверенность на основе истории предсказаний
-            # Если модель загружена и есть история, используем её для оценки уверенности
-            confidence = 0.5  # Базовая уверенность
-            if self.model is not None:
-                # Если модель загружена, увеличиваем уверенность
-                confidence = 0.7
-                # Если предсказание близко к текущей цене, снижаем уверенность
-                price_diff_pct = abs((predicted_price - current_price) / current_price) if current_price > 0 else 0
-                if price_diff_pct < 0.01:  # Разница меньше 1%
-                    confidence = 0.3
-                elif price_diff_pct > 0.05:  # Разница больше 5%
-                    confidence = 0.9
+            with timed(self.last_timings, "predict"):
+                predicted_price = self.predict(features, current_price_from_market=current_price)
             
-            # Принимаем решение с учетом уверенности
-            decision = self.decide(current_price, predicted_price, confidence=confidence)
+            with timed(self.last_timings, "decide"):
+                # Вычисляем уверенность на основе истории предсказаний
+                # Если модель загружена и есть история, используем её для оценки уверенности
+                # (0.5 без модели; с моделью 0.7, 0.3 если разница < 1%, 0.9 если > 5%)
+                confidence = float(self.confidence_batch(current_price, predicted_price))
+                
+                # Принимаем решение с учетом уверенности
+                decision = self.decide(current_price, predicted_price, confidence=confidence)
             
-            # Сохраняем в историю
-            decision_record = {
-                "timestamp": datetime.now(),
-                "ticker": market_data.get("ticker"),
-                "current_price": current_price,
-                "predicted_price": predicted_price,
-                "decision": decision,
-                "confidence": confidence
-            }
-            self.decision_history.append(decision_record)
-            
-            # Формируем сообщение для Execution Agent
-            message = {
-                "type": "trading_decision",
-                "ticker": market_data.get("ticker"),
-                "timestamp": datetime.now().isoformat(),
-                "decision": decision,
-                "current_price": current_price,
-                "predicted_price": predicted_price,
-                "confidence": decision_record["confidence"],
-                "features": features.tolist()[0] if features is not None else []
-            }
-            
-            return message
+            return self._decision_message(market_data, features, predicted_price, confidence, decision)
             
         except Exception as e:
             return {
@@ -309,6 +456,103 @@ class DecisionMakingAgent:
                 "timestamp": datetime.now().isoformat()
             }
     
+    def process_market_updates(self, market_updates: List[Dict]) -> List[Dict]:
+        """
+        Обрабатывает обновления рынка по нескольким тикерам с одним батчевым предсказанием
+        
+        Правила те же, что в process_market_update (векторизованные версии predict/decide).
+        
+        Args:
+            market_updates: Сообщения от Market Monitoring Agent (по одному на тикер)
+        
+        Returns:
+            Сообщения для Execution Agent в том же порядке
+        """
+        if self.model is None:
+            return [self.process_market_update(market_data) for market_data in market_updates]
+        
+        timings: Dict[str, float] = {}
+        self.last_timings = timings
+        messages: List[Optional[Dict]] = [None] * len(market_updates)
+        rows, features_list = [], []
+        for i, market_data in enumerate(market_updates):
+            with timed(timings, "features"):
+                features = self.extract_features(market_data) if market_data.get("type") == "market_update" else None
+            if features is None:
+                messages[i] = {
+                    "type": "error",
+                    "ticker": market_data.get("ticker"),
+                    "message": market_data.get("message") or "Failed to extract features",
+                    "timestamp": datetime.now().isoformat()
+                }
+                continue
+            rows.append(i)
+            features_list.append(features)
+        
+        if not rows:
+            return messages
+        
+        try:
+            X = np.vstack(features_list)
+            current = np.array([market_updates[i].get("current_price", 0) for i in rows], dtype=np.float64)
+            # Как в predict: при нереалистичной цене рынка берем Close из признаков
+            close_from_features = X[:, CLOSE_INDEX].astype(np.float64)
+            price_for_model = np.where(current >= 1.0, current, close_from_features)
+            
+            with timed(timings, "predict"):
+                predicted = self.sanitize_predictions(self.model.predict(X), price_for_model)
+            with timed(timings, "decide"):
+                confidence = self.confidence_batch(current, predicted)
+                actions = self.decide_batch(current, predicted, confidence)
+            
+            for k, i in enumerate(rows):
+                messages[i] = self._decision_message(
+                    market_updates[i], features_list[k], float(predicted[k]),
+                    float(confidence[k]), ACTION_NAMES[int(actions[k])]
+                )
+        except Exception as e:
+            for i in rows:
+                messages[i] = {
+                    "type": "error",
+                    "ticker": market_updates[i].get("ticker"),
+                    "message": f"Error processing decision: {str(e)}",
+                    "timestamp": datetime.now().isoformat()
+                }
+        return messages
+    
+    def _decision_message(self, market_data: Dict, features: np.ndarray, predicted_price: float,
+                          confidence: float, decision: str) -> Dict:
+        """Онлайн-обновление, запись в историю и сообщение для Execution Agent"""
+        current_price = market_data.get("current_price", 0)
+        
+        # Онлайн-дообучение на предыдущем баре (если включено)
+        with timed(self.last_timings, "online"):
+            online_update = self.update_online(market_data, features, predicted_price)
+        
+        # Сохраняем в историю
+        decision_record = {
+            "timestamp": datetime.now(),
+            "ticker": market_data.get("ticker"),
+            "current_price": current_price,
+            "predicted_price": predicted_price,
+            "decision": decision,
+            "confidence": confidence
+        }
+        self.decision_history.append(decision_record)
+        
+        # Формируем сообщение для Execution Agent
+        return {
+            "type": "trading_decision",
+            "ticker": market_data.get("ticker"),
+            "timestamp": datetime.now().isoformat(),
+            "decision": decision,
+            "current_price": current_price,
+            "predicted_price": predicted_price,
+            "confidence": decision_record["confidence"],
+            "features": features.tolist()[0] if features is not None else [],
+            "online_update": online_update
+        }
+    
     def get_decision_history(self) -> pd.DataFrame:
         """Возвращает историю решений в виде DataFrame"""
         if not self.decision_history:
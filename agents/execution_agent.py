@@ -3,16 +3,21 @@ Execution Agent
 Получает решение и "выполняет" сделку, записывает результат
 """
 import pandas as pd
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Union
 from datetime import datetime
 import os
 
+from .instrumentation import timed
+from .trade_journal import TradeJournal, reduce_holding, replay_trades
+
 
 class ExecutionAgent:
     """Агент для выполнения торговых операций"""
     
     def __init__(self, user_id: int, initial_balance: float = 10000.0, 
-                 data_dir: str = "data", use_db: bool = True):
+                 data_dir: str = "data", use_db: bool = True,
+                 trade_percentage: float = 0.1, sell_fraction: float = 0.5,
+                 db_manager=None, clock: Optional[Callable[[], datetime]] = None):
         """
         Инициализация агента
         
@@ -21,6 +26,10 @@ class ExecutionAgent:
             initial_balance: Начальный баланс портфеля
             data_dir: Директория для сохранения данных (если не используется БД)
             use_db: Использовать ли БД вместо CSV файлов
+            trade_percentage: Доля баланса на одну покупку
+            sell_fraction: Доля имеющихся акций, продаваемая за одну продажу
+            db_manager: Менеджер БД (если None, используется БД по умолчанию)
+            clock: Источник времени сделок (по умолчанию datetime.now; при воспроизведении - время бара)
         """
         # КРИТИЧЕСКИ ВАЖНО: Устанавливаем ticker ПЕРВЫМ, до любых других операций
         # Это защита от ошибок в старых версиях кода
@@ -29,19 +38,25 @@ class ExecutionAgent:
         self.user_id = user_id
         self.initial_balance = initial_balance
         self.use_db = use_db
+        self.trade_percentage = trade_percentage
+        self.sell_fraction = sell_fraction
+        self.clock = clock or datetime.now
+        # Время этапов последней сделки, мс (persist - запись в БД/CSV)
+        self.last_timings: Dict[str, float] = {}
         
         if use_db:
             # Используем БД
-            from database.db_manager import DBManager
-            self.db_manager = DBManager()
+            from database.db_manager import get_db_manager
+            self.db_manager = db_manager or get_db_manager()
             self._load_from_db()
         else:
             # Используем CSV (старый способ для обратной совместимости)
             self.balance = initial_balance
             self.portfolio = {}  # {ticker: {"shares": int, "avg_price": float}}
-            self.trade_history = []
             self.data_dir = data_dir
             self.history_file = os.path.join(data_dir, f"history_{user_id}.csv")
+            # Append-only журнал сделок со снимками состояния
+            self.journal = TradeJournal(self.history_file)
             
             # Создаем директорию если не существует
             os.makedirs(data_dir, exist_ok=True)
@@ -60,27 +75,12 @@ class ExecutionAgent:
         
         if portfolio_data:
             self.balance = portfolio_data['balance']
-            # Сохраняем начальный баланс только при первом создании
-            # Если портфель уже существует, не меняем initial_balance
-            if not hasattr(self, 'initial_balance_set'):
-                # Пытаемся вычислить начальный баланс из истории
-                trade_history = self.db_manager.get_trade_history(self.user_id)
-                if not trade_history.empty:
-                    # Если есть история, вычисляем начальный баланс
-                    first_trade = trade_history.iloc[-1]  # Первая сделка (последняя в отсортированном списке)
-                    if first_trade['action'] == 'BUY':
-                        self.initial_balance = first_trade['balance_after'] + first_trade['total']
-                    else:
-                        self.initial_balance = first_trade['balance_after'] - first_trade['total']
-                else:
-                    # Если истории нет, используем текущий баланс
-                    self.initial_balance = self.balance
-                self.initial_balance_set = True
+            # Стартовый капитал хранится в портфеле (база для P&L)
+            self.initial_balance = portfolio_data['initial_balance']
         else:
             # Создаем портфель если не существует
             self.db_manager.create_portfolio(self.user_id, self.initial_balance)
             self.balance = self.initial_balance
-            self.initial_balance_set = True
         
         # Загружаем холдинги
         holdings = self.db_manager.get_holdings(self.user_id)
@@ -92,22 +92,43 @@ class ExecutionAgent:
                 "total_cost": holding['total_cost']
             }
     
+    def refresh(self):
+        """Перечитывает баланс и холдинги из БД (если портфель меняет другой процесс, например демон)"""
+        if self.use_db:
+            self._load_from_db()
+    
     def load_history(self):
-        """Загружает историю торгов из файла (только если use_db=False)"""
+        """
+        Загружает портфель из журнала (только если use_db=False):
+        последний снимок состояния и сделки после него
+        """
         if self.use_db:
             return  # Используем БД
         
-        if os.path.exists(self.history_file):
-            try:
-                df = pd.read_csv(self.history_file)
-                self.trade_history = df.to_dict('records')
-                # Восстанавливаем баланс и портфель
-                self._reconstruct_portfolio()
-            except Exception as e:
-                print(f"Error loading history: {e}")
+        try:
+            state, tail = self.journal.load()
+            # Снимок, сделанный при другом начальном балансе, не подходит - воспроизводим весь журнал
+            if state is not None and state.get("initial_balance") != self.initial_balance:
+                state, tail = self.journal.load(use_snapshot=False)
+            if state is not None:
+                self.balance = state["balance"]
+                # Стоимость позиции - по средней цене (снимки старых версий не уменьшали ее при продажах)
+                self.portfolio = {
+                    ticker: {**holding, "total_cost": holding["avg_price"] * holding["shares"]}
+                    for ticker, holding in state["portfolio"].items()
+                }
+            else:
+                self.balance = self.initial_balance
+                self.portfolio = {}
+            # Восстанавливаем баланс и портфель
+            self._reconstruct_portfolio(tail)
+            if tail and self.journal.snapshot_due:
+                self.save_history()
+        except Exception as e:
+            print(f"Error loading history: {e}")
     
-    def _reconstruct_portfolio(self):
-        """Восстанавливает состояние портфеля из истории (только если use_db=False)"""
+    def _reconstruct_portfolio(self, trades: List[Dict]):
+        """Применяет сделки журнала к текущему состоянию портфеля (только если use_db=False)"""
         # Защита: гарантируем, что ticker установлен (на случай если метод вызывается из старого кода)
         if not hasattr(self, 'ticker') or self.ticker is None:
             self.ticker = "AAPL"
@@ -115,41 +136,7 @@ class ExecutionAgent:
         if self.use_db:
             return  # Используем БД
         
-        self.balance = self.initial_balance
-        self.portfolio = {}
-        
-        for trade in self.trade_history:
-            ticker = trade.get("ticker")
-            # Защита: если ticker не указан в trade, используем self.ticker
-            if not ticker or ticker is None:
-                ticker = self.ticker
-            action = trade.get("action")
-            shares = trade.get("shares", 0)
-            price = trade.get("price", 0)
-            
-            if action == "BUY":
-                cost = shares * price
-                if self.balance >= cost:
-                    self.balance -= cost
-                    if ticker not in self.portfolio:
-                        self.portfolio[ticker] = {"shares": 0, "avg_price": 0, "total_cost": 0}
-                    
-                    old_shares = self.portfolio[ticker]["shares"]
-                    old_cost = self.portfolio[ticker]["total_cost"]
-                    new_shares = old_shares + shares
-                    new_cost = old_cost + cost
-                    
-                    self.portfolio[ticker]["shares"] = new_shares
-                    self.portfolio[ticker]["total_cost"] = new_cost
-                    self.portfolio[ticker]["avg_price"] = new_cost / new_shares if new_shares > 0 else 0
-                    
-            elif action == "SELL":
-                if ticker in self.portfolio and self.portfolio[ticker]["shares"] >= shares:
-                    revenue = shares * price
-                    self.balance += revenue
-                    self.portfolio[ticker]["shares"] -= shares
-                    if self.portfolio[ticker]["shares"] == 0:
-                        del self.portfolio[ticker]
+        self.balance, self.portfolio = replay_trades(trades, self.balance, self.portfolio, self.ticker)
     
     def execute_trade(self, decision_data: Dict) -> Dict:
         """
@@ -161,12 +148,13 @@ class ExecutionAgent:
         Returns:
             Результат выполнения операции
         """
+        self.last_timings = {}
         try:
             if decision_data.get("type") != "trading_decision":
                 return {
                     "type": "error",
                     "message": "Invalid decision data",
-                    "timestamp": datetime.now().isoformat()
+                    "timestamp": self.clock().isoformat()
                 }
             
             decision = decision_data.get("decision")
@@ -179,14 +167,14 @@ class ExecutionAgent:
                     "status": "hold",
                     "ticker": ticker,
                     "message": "No action taken - HOLD decision",
-                    "timestamp": datetime.now().isoformat(),
+                    "timestamp": self.clock().isoformat(),
                     "portfolio_value": self.get_portfolio_value(current_price),
                     "balance": self.balance
                 }
             
             # Определяем количество акций для покупки/продажи
-            # Используем 10% баланса для каждой сделки
-            trade_percentage = 0.1
+            # Используем trade_percentage баланса для каждой сделки (10% по умолчанию)
+            trade_percentage = self.trade_percentage
             
             if decision == "BUY":
                 available_cash = self.balance * trade_percentage
@@ -211,33 +199,30 @@ class ExecutionAgent:
                     # Записываем в историю
                     confidence = decision_data.get("confidence", 0)
                     
-                    if self.use_db:
-                        # Сохраняем в БД
-                        self.db_manager.add_trade(
-                            self.user_id, ticker, "BUY", shares, current_price,
-                            cost, self.balance, confidence
-                        )
-                        # Обновляем холдинг в БД
-                        self.db_manager.update_holding(
-                            self.user_id, ticker, new_shares, 
-                            self.portfolio[ticker]["avg_price"], new_cost
-                        )
-                        # Обновляем баланс в БД
-                        self.db_manager.update_portfolio_balance(self.user_id, self.balance)
-                    else:
-                        # Сохраняем в CSV
-                        trade_record = {
-                            "timestamp": datetime.now().isoformat(),
-                            "ticker": ticker,
-                            "action": "BUY",
-                            "shares": shares,
-                            "price": current_price,
-                            "total": cost,
-                            "balance_after": self.balance,
-                            "confidence": confidence
-                        }
-                        self.trade_history.append(trade_record)
-                        self.save_history()
+                    with timed(self.last_timings, "persist"):
+                        if self.use_db:
+                            # Сделка, холдинг и баланс - одной транзакцией
+                            self.db_manager.record_trade(
+                                self.user_id, ticker, "BUY", shares, current_price,
+                                cost, self.balance, new_shares,
+                                self.portfolio[ticker]["avg_price"], new_cost,
+                                confidence, timestamp=self.clock().isoformat()
+                            )
+                        else:
+                            # Сохраняем в CSV
+                            trade_record = {
+                                "timestamp": self.clock().isoformat(),
+                                "ticker": ticker,
+                                "action": "BUY",
+                                "shares": shares,
+                                "price": current_price,
+                                "total": cost,
+                                "balance_after": self.balance,
+                                "confidence": confidence
+                            }
+                            self.journal.append(trade_record)
+                            if self.journal.snapshot_due:
+                                self.save_history()
                     
                     return {
                         "type": "execution_result",
@@ -248,7 +233,7 @@ class ExecutionAgent:
                         "price": current_price,
                         "total": cost,
                         "message": f"Bought {shares} shares of {ticker} at ${current_price:.2f}",
-                        "timestamp": datetime.now().isoformat(),
+                        "timestamp": self.clock().isoformat(),
                         "portfolio_value": self.get_portfolio_value(current_price),
                         "balance": self.balance
                     }
@@ -258,59 +243,52 @@ class ExecutionAgent:
                         "status": "insufficient_funds",
                         "ticker": ticker,
                         "message": "Insufficient funds for BUY order",
-                        "timestamp": datetime.now().isoformat(),
+                        "timestamp": self.clock().isoformat(),
                         "balance": self.balance
                     }
             
             elif decision == "SELL":
                 if ticker in self.portfolio and self.portfolio[ticker]["shares"] > 0:
                     available_shares = self.portfolio[ticker]["shares"]
-                    # Продаем 50% имеющихся акций
-                    shares_to_sell = max(1, int(available_shares * 0.5))
+                    # Продаем sell_fraction имеющихся акций (50% по умолчанию)
+                    shares_to_sell = max(1, int(available_shares * self.sell_fraction))
                     shares_to_sell = min(shares_to_sell, available_shares)
                     
                     revenue = shares_to_sell * current_price
                     self.balance += revenue
                     
-                    self.portfolio[ticker]["shares"] -= shares_to_sell
-                    if self.portfolio[ticker]["shares"] == 0:
-                        del self.portfolio[ticker]
+                    reduce_holding(self.portfolio, ticker, shares_to_sell)
                     
                     # Записываем в историю
                     confidence = decision_data.get("confidence", 0)
                     
-                    if self.use_db:
-                        # Сохраняем в БД
-                        self.db_manager.add_trade(
-                            self.user_id, ticker, "SELL", shares_to_sell, current_price,
-                            revenue, self.balance, confidence
-                        )
-                        # Обновляем или удаляем холдинг в БД
-                        remaining_shares = self.portfolio[ticker]["shares"]
-                        if remaining_shares > 0:
-                            remaining_cost = self.portfolio[ticker]["total_cost"] * (remaining_shares / (remaining_shares + shares_to_sell))
-                            self.db_manager.update_holding(
-                                self.user_id, ticker, remaining_shares,
-                                self.portfolio[ticker]["avg_price"], remaining_cost
+                    with timed(self.last_timings, "persist"):
+                        if self.use_db:
+                            # Холдинг уже удален из self.portfolio, если продали все акции
+                            holding = self.portfolio.get(ticker, {"shares": 0, "avg_price": 0.0, "total_cost": 0.0})
+                            remaining_shares = holding["shares"]
+                            remaining_cost, avg_price = holding["total_cost"], holding["avg_price"]
+                            # Сделка, холдинг (обновление или удаление) и баланс - одной транзакцией
+                            self.db_manager.record_trade(
+                                self.user_id, ticker, "SELL", shares_to_sell, current_price,
+                                revenue, self.balance, remaining_shares, avg_price, remaining_cost,
+                                confidence, timestamp=self.clock().isoformat()
                             )
                         else:
-                            self.db_manager.delete_holding(self.user_id, ticker)
-                        # Обновляем баланс в БД
-                        self.db_manager.update_portfolio_balance(self.user_id, self.balance)
-                    else:
-                        # Сохраняем в CSV
-                        trade_record = {
-                            "timestamp": datetime.now().isoformat(),
-                            "ticker": ticker,
-                            "action": "SELL",
-                            "shares": shares_to_sell,
-                            "price": current_price,
-                            "total": revenue,
-                            "balance_after": self.balance,
-                            "confidence": confidence
-                        }
-                        self.trade_history.append(trade_record)
-                        self.save_history()
+                            # Сохраняем в CSV
+                            trade_record = {
+                                "timestamp": self.clock().isoformat(),
+                                "ticker": ticker,
+                                "action": "SELL",
+                                "shares": shares_to_sell,
+                                "price": current_price,
+                                "total": revenue,
+                                "balance_after": self.balance,
+                                "confidence": confidence
+                            }
+                            self.journal.append(trade_record)
+                            if self.journal.snapshot_due:
+                                self.save_history()
                     
                     return {
                         "type": "execution_result",
@@ -321,7 +299,7 @@ class ExecutionAgent:
                         "price": current_price,
                         "total": revenue,
                         "message": f"Sold {shares_to_sell} shares of {ticker} at ${current_price:.2f}",
-                        "timestamp": datetime.now().isoformat(),
+                        "timestamp": self.clock().isoformat(),
                         "portfolio_value": self.get_portfolio_value(current_price),
                         "balance": self.balance
                     }
@@ -331,7 +309,7 @@ class ExecutionAgent:
                         "status": "no_shares",
                         "ticker": ticker,
                         "message": f"No shares of {ticker} to sell",
-                        "timestamp": datetime.now().isoformat(),
+                        "timestamp": self.clock().isoformat(),
                         "balance": self.balance
                     }
             
@@ -339,22 +317,34 @@ class ExecutionAgent:
                 "type": "execution_result",
                 "status": "unknown_decision",
                 "message": f"Unknown decision: {decision}",
-                "timestamp": datetime.now().isoformat()
+                "timestamp": self.clock().isoformat()
             }
             
         except Exception as e:
+            if self.use_db:
+                # Транзакция откатилась - возвращаем состояние в памяти к состоянию БД
+                try:
+                    self.refresh()
+                except Exception:
+                    pass
             return {
                 "type": "error",
                 "message": f"Error executing trade: {str(e)}",
-                "timestamp": datetime.now().isoformat()
+                "timestamp": self.clock().isoformat()
             }
     
-    def get_portfolio_value(self, current_price: float) -> float:
+    def _price_for(self, ticker: str, current_price: Union[float, Dict[str, float]]) -> float:
+        """Цена тикера: из словаря цен (иначе средняя цена покупки) или общая цена"""
+        if isinstance(current_price, dict):
+            return current_price.get(ticker, self.portfolio[ticker]["avg_price"])
+        return current_price
+    
+    def get_portfolio_value(self, current_price: Union[float, Dict[str, float]]) -> float:
         """
         Вычисляет текущую стоимость портфеля
         
         Args:
-            current_price: Текущая цена акции
+            current_price: Текущая цена акции или словарь цен {ticker: price}
         
         Returns:
             Общая стоимость портфеля
@@ -362,15 +352,15 @@ class ExecutionAgent:
         portfolio_value = self.balance
         for ticker, holdings in self.portfolio.items():
             # Используем текущую цену для оценки
-            portfolio_value += holdings["shares"] * current_price
+            portfolio_value += holdings["shares"] * self._price_for(ticker, current_price)
         return portfolio_value
     
-    def get_portfolio_summary(self, current_price: float) -> Dict:
+    def get_portfolio_summary(self, current_price: Union[float, Dict[str, float]]) -> Dict:
         """
         Возвращает сводку портфеля
         
         Args:
-            current_price: Текущая цена акции
+            current_price: Текущая цена акции или словарь цен {ticker: price}
         
         Returns:
             Словарь с информацией о портфеле
@@ -387,44 +377,62 @@ class ExecutionAgent:
             "holdings": {ticker: {
                 "shares": holdings["shares"],
                 "avg_price": holdings["avg_price"],
-                "current_value": holdings["shares"] * current_price,
-                "unrealized_pnl": (current_price - holdings["avg_price"]) * holdings["shares"]
+                "current_value": holdings["shares"] * self._price_for(ticker, current_price),
+                "unrealized_pnl": (self._price_for(ticker, current_price) - holdings["avg_price"]) * holdings["shares"]
             } for ticker, holdings in self.portfolio.items()}
         }
     
+    def record_equity_snapshot(self, current_price: Union[float, Dict[str, float]]):
+        """
+        Сохраняет снимок капитала по текущим ценам (кривая капитала в equity_snapshots)
+        
+        Args:
+            current_price: Текущая цена акции или словарь цен {ticker: price}
+        """
+        if not self.use_db:
+            return
+        
+        try:
+            holdings_value = self.get_portfolio_value(current_price) - self.balance
+            self.db_manager.record_equity_snapshot(
+                self.user_id, self.balance, holdings_value,
+                self.balance + holdings_value - self.initial_balance,
+                timestamp=self.clock()
+            )
+        except Exception as e:
+            # Снимок капитала не должен прерывать торговый цикл
+            print(f"Error recording equity snapshot: {e}")
+    
     def save_history(self):
-        """Сохраняет историю торгов в CSV файл (только если use_db=False)"""
+        """
+        Сохраняет снимок баланса и позиций на текущий конец журнала (только если use_db=False);
+        сами сделки дописываются в журнал при исполнении
+        """
         if self.use_db:
             return  # Используем БД
         
-        if self.trade_history:
-            df = pd.DataFrame(self.trade_history)
-            df.to_csv(self.history_file, index=False)
+        self.journal.write_snapshot({
+            "initial_balance": self.initial_balance,
+            "balance": self.balance,
+            "portfolio": self.portfolio
+        })
     
     def get_trade_history(self) -> pd.DataFrame:
         """Возвращает историю торгов в виде DataFrame"""
         if self.use_db:
             return self.db_manager.get_trade_history(self.user_id)
         else:
-            if not self.trade_history:
-                return pd.DataFrame()
-            return pd.DataFrame(self.trade_history)
+            return self.journal.read()
     
     def reset_portfolio(self):
         """Сбрасывает портфель к начальному состоянию"""
         if self.use_db:
-            # Сбрасываем в БД
-            self.db_manager.update_portfolio_balance(self.user_id, self.initial_balance)
-            # Удаляем все холдинги
-            holdings = self.db_manager.get_holdings(self.user_id)
-            for holding in holdings:
-                self.db_manager.delete_holding(self.user_id, holding['ticker'])
+            # Баланс и все холдинги сбрасываются в БД одной транзакцией
+            self.db_manager.reset_portfolio(self.user_id, self.initial_balance)
             # Перезагружаем из БД
             self._load_from_db()
         else:
             self.balance = self.initial_balance
             self.portfolio = {}
-            self.trade_history = []
-            if os.path.exists(self.history_file):
-                os.remove(self.history_file)
+            self.journal.clear()
 
@@ -0,0 +1,88 @@
+"""
+Instrumentation
+Таймеры этапов цикла агентов и скользящие распределения задержек (p50/p95/p99)
+"""
+import time
+import numpy as np
+import pandas as pd
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+
+@contextmanager
+def timed(timings: Dict[str, float], key: str):
+    """
+    Замеряет время блока в миллисекундах (perf_counter) и добавляет его к timings[key]
+
+    Пример:
+        with timed(self.last_timings, "predict"):
+            prediction = self.model.predict(features)
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[key] = timings.get(key, 0.0) + (time.perf_counter() - started) * 1000
+
+
+class LatencyRecorder:
+    """Скользящие окна задержек по этапам и тикерам"""
+
+    def __init__(self, window: int = 1000):
+        """
+        Инициализация
+
+        Args:
+            window: Количество последних замеров, хранимых для каждой пары (этап, тикер)
+        """
+        self.window = window
+        self.samples: Dict[Tuple[str, str], deque] = defaultdict(lambda: deque(maxlen=window))
+        # Сырые замеры по циклам (для экспорта)
+        self.history: deque = deque(maxlen=window)
+
+    def record(self, ticker: str, timings: Dict[str, float]):
+        """Добавляет замеры одного цикла"""
+        for stage, value in timings.items():
+            # Счетчики (n_batches, n_shards) - int, в распределения не попадают
+            if isinstance(value, float):
+                self.samples[(stage, ticker)].append(float(value))
+        self.history.append({"timestamp": datetime.now().isoformat(), "ticker": ticker, **timings})
+
+    def summary(self, ticker: Optional[str] = None) -> pd.DataFrame:
+        """
+        Процентили задержек по этапам
+
+        Returns:
+            DataFrame: stage, ticker, count, mean_ms, p50_ms, p95_ms, p99_ms, max_ms
+        """
+        rows = []
+        for (stage, stage_ticker), values in sorted(self.samples.items()):
+            if (ticker is not None and stage_ticker != ticker) or not values:
+                continue
+            array = np.fromiter(values, dtype=np.float64, count=len(values))
+            p50, p95, p99 = np.percentile(array, [50, 95, 99])
+            rows.append({
+                "stage": stage,
+                "ticker": stage_ticker,
+                "count": len(array),
+                "mean_ms": float(array.mean()),
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "p99_ms": float(p99),
+                "max_ms": float(array.max()),
+            })
+        return pd.DataFrame(rows)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Сырые замеры по циклам"""
+        return pd.DataFrame(list(self.history))
+
+    def export_csv(self, path: str):
+        """Сохраняет сырые замеры в CSV для офлайн-анализа"""
+        self.to_dataframe().to_csv(path, index=False)
+
+    def reset(self):
+        self.samples.clear()
+        self.history.clear()
@@ -2,25 +2,99 @@
 Market Monitoring Agent
 Получает реальные данные рынка и отправляет их другим агентам
 """
+import time
 import yfinance as yf
 import pandas as pd
+import numpy as np
 from datetime import datetime, timedelta
 from typing import Dict, Optional
 
+from .instrumentation import timed
+
+
+# Порядок признаков модели (должен совпадать с DecisionMakingAgent.extract_features)
+FEATURE_COLUMNS = [
+    'MA5', 'MA20', 'Volatility',
+    'Returns', 'Returns_5', 'Returns_20',
+    'MA5_MA20_ratio', 'Price_MA20_ratio', 'Price_MA50_ratio',
+    'Trend', 'Momentum',  # Добавлены тренд и импульс
+    'Volume_ratio', 'HL_spread',
+    'RSI',  # Добавлен RSI
+    'Close'
+] + [f'Return_lag_{i+1}' for i in range(5)]
+
+# Индекс цены закрытия в векторе признаков (онлайн-модель и проверки цены считают от нее)
+CLOSE_INDEX = FEATURE_COLUMNS.index('Close')
+
+
+def _rolling(series: pd.Series, window: int, how: str = "mean") -> pd.Series:
+    """Скользящая статистика; для float32 результат остается float32 (pandas возвращает float64)"""
+    result = getattr(series.rolling(window=window), how)()
+    if isinstance(series, pd.Series) and series.dtype == np.float32:
+        result = result.astype(np.float32, copy=False)
+    return result
+
+
+def add_indicators(df: pd.DataFrame, dtype: Optional[str] = None) -> pd.DataFrame:
+    """
+    Добавляет технические индикаторы к OHLCV данным
+    
+    Args:
+        df: DataFrame с колонками Open, High, Low, Close, Volume
+            (или словарь панелей {колонка: DataFrame T x P} - индикаторы считаются
+            сразу для всех траекторий, как в Monte Carlo симуляции)
+        dtype: Тип данных для вычислений (например, "float32"); None - без приведения
+    
+    Returns:
+        Тот же DataFrame с колонками индикаторов
+    """
+    if dtype is not None:
+        price_columns = [c for c in ['Open', 'High', 'Low', 'Close', 'Volume'] if c in df.columns]
+        df[price_columns] = df[price_columns].astype(dtype)
+    
+    df['MA5'] = _rolling(df['Close'], 5)
+    df['MA20'] = _rolling(df['Close'], 20)
+    df['MA50'] = _rolling(df['Close'], 50)
+    df['Returns'] = df['Close'].pct_change()
+    df['Returns_5'] = _rolling(df['Returns'], 5)
+    df['Returns_20'] = _rolling(df['Returns'], 20)
+    df['Volatility'] = _rolling(df['Returns'], 20, "std")
+    
+    # Тренд и импульс (важно для предсказания роста)
+    df['Trend'] = (df['Close'] - df['Close'].shift(5)) / df['Close'].shift(5)  # 5-дневный тренд
+    df['Momentum'] = df['Close'] / df['Close'].shift(10) - 1  # 10-дневный импульс
+    
+    df['Volume_MA'] = _rolling(df['Volume'], 20)
+    df['Volume_ratio'] = df['Volume'] / df['Volume_MA']
+    df['HL_spread'] = (df['High'] - df['Low']) / df['Close']
+    
+    # RSI (Relative Strength Index)
+    delta = df['Close'].diff()
+    gain = _rolling(delta.where(delta > 0, 0), 14)
+    loss = _rolling(-delta.where(delta < 0, 0), 14)
+    rs = gain / loss
+    df['RSI'] = 100 - (100 / (1 + rs))
+    
+    return df
+
 
 class MarketMonitoringAgent:
     """Агент для мониторинга рынка и получения данных"""
     
-    def __init__(self, ticker: str = "AAPL"):
+    def __init__(self, ticker: str = "AAPL", dtype: Optional[str] = None):
         """
         Инициализация агента
         
         Args:
             ticker: Тикер акции (по умолчанию AAPL)
+            dtype: Тип данных для расчета индикаторов (например, "float32")
         """
         self.ticker = ticker
+        self.dtype = dtype
         self.last_update = None
         self.data_history = []
+        # Время этапов последнего обновления, мс
+        self.last_timings: Dict[str, float] = {}
         
     def get_market_data(self, period: str = "1mo", interval: str = "1d") -> Dict:
         """
@@ -33,11 +107,14 @@ class MarketMonitoringAgent:
         Returns:
             Словарь с данными рынка
         """
+        timings: Dict[str, float] = {}
         try:
             stock = yf.Ticker(self.ticker)
-            df = stock.history(period=period, interval=interval)
+            with timed(timings, "fetch"):
+                df = stock.history(period=period, interval=interval)
             
             if df.empty:
+                self.last_timings = timings
                 return {
                     "type": "error",
                     "message": f"No data available for {self.ticker}",
@@ -45,85 +122,90 @@ class MarketMonitoringAgent:
                 }
             
             # Получаем дополнительную информацию
-            info = stock.info
-            current_price = df['Close'].iloc[-1]
-            
-            # Вычисляем технические индикаторы (как в train_model.py)
-            df['MA5'] = df['Close'].rolling(window=5).mean()
-            df['MA20'] = df['Close'].rolling(window=20).mean()
-            df['MA50'] = df['Close'].rolling(window=50).mean()
-            df['Returns'] = df['Close'].pct_change()
-            df['Returns_5'] = df['Returns'].rolling(window=5).mean()
-            df['Returns_20'] = df['Returns'].rolling(window=20).mean()
-            df['Volatility'] = df['Returns'].rolling(window=20).std()
-            
-            # Тренд и импульс (важно для предсказания роста)
-            df['Trend'] = (df['Close'] - df['Close'].shift(5)) / df['Close'].shift(5)  # 5-дневный тренд
-            df['Momentum'] = df['Close'] / df['Close'].shift(10) - 1  # 10-дневный импульс
-            
-            df['Volume_MA'] = df['Volume'].rolling(window=20).mean()
-            df['Volume_ratio'] = df['Volume'] / df['Volume_MA']
-            df['HL_spread'] = (df['High'] - df['Low']) / df['Close']
-            
-            # RSI (Relative Strength Index)
-            delta = df['Close'].diff()
-            gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-            loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-            rs = gain / loss
-            df['RSI'] = 100 - (100 / (1 + rs))
-            
-            self.last_update = datetime.now()
-            
-            # Получаем последние значения для признаков
-            last_row = df.iloc[-1]
-            
-            # Формируем сообщение для других агентов
-            message = {
-                "type": "market_update",
-                "ticker": self.ticker,
-                "timestamp": self.last_update.isoformat(),
-                "current_price": float(current_price),
-                "data": {
-                    "prices": df[['Open', 'High', 'Low', 'Close', 'Volume']].to_dict('records'),
-                    "indicators": {
-                        "MA5": float(last_row['MA5']) if not pd.isna(last_row['MA5']) else None,
-                        "MA20": float(last_row['MA20']) if not pd.isna(last_row['MA20']) else None,
-                        "MA50": float(last_row['MA50']) if not pd.isna(last_row['MA50']) else None,
-                        "volatility": float(last_row['Volatility']) if not pd.isna(last_row['Volatility']) else None,
-                        "returns": float(last_row['Returns']) if not pd.isna(last_row['Returns']) else None,
-                        "returns_5": float(last_row['Returns_5']) if not pd.isna(last_row['Returns_5']) else None,
-                        "returns_20": float(last_row['Returns_20']) if not pd.isna(last_row['Returns_20']) else None,
-                        "trend": float(last_row['Trend']) if not pd.isna(last_row['Trend']) else None,
-                        "momentum": float(last_row['Momentum']) if not pd.isna(last_row['Momentum']) else None,
-                        "volume_ratio": float(last_row['Volume_ratio']) if not pd.isna(last_row['Volume_ratio']) else None,
-                        "hl_spread": float(last_row['HL_spread']) if not pd.isna(last_row['HL_spread']) else None,
-                        "RSI": float(last_row['RSI']) if not pd.isna(last_row['RSI']) else None,
-                    },
-                    "returns": df['Returns'].tolist()[-20:]  # Последние 20 значений для lag features
-                },
-                "info": {
-                    "company_name": info.get('longName', 'N/A'),
-                    "sector": info.get('sector', 'N/A'),
-                    "market_cap": info.get('marketCap', 0)
-                }
-            }
-            
-            # Сохраняем в историю
-            self.data_history.append({
-                "timestamp": self.last_update,
-                "price": current_price,
-                "volume": df['Volume'].iloc[-1]
-            })
-            
+            with timed(timings, "info"):
+                info = stock.info
+            message = self.build_market_update(df, info)
+            self.last_timings = {**timings, **self.last_timings}
             return message
             
         except Exception as e:
+            self.last_timings = timings
             return {
                 "type": "error",
                 "message": f"Error fetching data: {str(e)}",
                 "timestamp": datetime.now().isoformat()
             }
     
+    def build_market_update(self, df: pd.DataFrame, info: Optional[Dict] = None) -> Dict:
+        """
+        Формирует сообщение market_update из окна OHLCV баров
+        
+        Используется и для живых данных (get_market_data), и для воспроизведения
+        записанных баров (ReplayFeed) - агентам передается одинаковое сообщение.
+        
+        Args:
+            df: OHLCV бары, последний бар - текущий
+            info: Информация о компании (yfinance info)
+        
+        Returns:
+            Словарь с данными рынка
+        """
+        info = info or {}
+        self.last_timings = {}
+        current_price = df['Close'].iloc[-1]
+        
+        # Вычисляем технические индикаторы (как в train_model.py)
+        with timed(self.last_timings, "indicators"):
+            df = add_indicators(df, self.dtype)
+        message_started = time.perf_counter()
+        
+        self.last_update = datetime.now()
+        
+        # Получаем последние значения для признаков
+        last_row = df.iloc[-1]
+        
+        # Формируем сообщение для других агентов
+        message = {
+            "type": "market_update",
+            "ticker": self.ticker,
+            "timestamp": self.last_update.isoformat(),
+            "bar_time": df.index[-1].isoformat(),  # Время последнего бара (для онлайн-обучения)
+            "current_price": float(current_price),
+            "data": {
+                "prices": df[['Open', 'High', 'Low', 'Close', 'Volume']].to_dict('records'),
+                "indicators": {
+                    "MA5": float(last_row['MA5']) if not pd.isna(last_row['MA5']) else None,
+                    "MA20": float(last_row['MA20']) if not pd.isna(last_row['MA20']) else None,
+                    "MA50": float(last_row['MA50']) if not pd.isna(last_row['MA50']) else None,
+                    "volatility": float(last_row['Volatility']) if not pd.isna(last_row['Volatility']) else None,
+                    "returns": float(last_row['Returns']) if not pd.isna(last_row['Returns']) else None,
+                    "returns_5": float(last_row['Returns_5']) if not pd.isna(last_row['Returns_5']) else None,
+                    "returns_20": float(last_row['Returns_20']) if not pd.isna(last_row['Returns_20']) else None,
+                    "trend": float(last_row['Trend']) if not pd.isna(last_row['Trend']) else None,
+                    "momentum": float(last_row['Momentum']) if not pd.isna(last_row['Momentum']) else None,
+                    "volume_ratio": float(last_row['Volume_ratio']) if not pd.isna(last_row['Volume_ratio']) else None,
+                    "hl_spread": float(last_row['HL_spread']) if not pd.isna(last_row['HL_spread']) else None,
+                    "RSI": float(last_row['RSI']) if not pd.isna(last_row['RSI']) else None,
+                },
+                "returns": df['Returns'].tolist()[-20:]  # Последние 20 значений для lag features
+            },
+            "info": {
+                "company_name": info.get('longName', 'N/A'),
+                "sector": info.get('sector', 'N/A'),
+                "market_cap": info.get('marketCap', 0)
+            }
+        }
+        
+        # Сохраняем в историю
+        self.data_history.append({
+            "timestamp": self.last_update,
+            "price": current_price,
+            "volume": df['Volume'].iloc[-1]
+        })
+        
+        self.last_timings["message"] = (time.perf_counter() - message_started) * 1000
+        return message
+    
     def get_latest_price(self) -> Optional[float]:
         """Получает последнюю цену"""
         try:
@@ -158,24 +240,7 @@ class MarketMonitoringAgent:
                 df = stock.history(period=period, interval=interval)
             
             if not df.empty:
-                df['MA5'] = df['Close'].rolling(window=5).mean()
-                df['MA20'] = df['Close'].rolling(window=20).mean()
-                df['MA50'] = df['Close'].rolling(window=50).mean()
-                df['Returns'] = df['Close'].pct_change()
-                df['Returns_5'] = df['Returns'].rolling(window=5).mean()
-                df['Returns_20'] = df['Returns'].rolling(window=20).mean()
-                df['Volatility'] = df['Returns'].rolling(window=20).std()
-                df['Trend'] = (df['Close'] - df['Close'].shift(5)) / df['Close'].shift(5)
-                df['Momentum'] = df['Close'] / df['Close'].shift(10) - 1
-                df['Volume_MA'] = df['Volume'].rolling(window=20).mean()
-                df['Volume_ratio'] = df['Volume'] / df['Volume_MA']
-                df['HL_spread'] = (df['High'] - df['Low']) / df['Close']
-                # RSI
-                delta = df['Close'].diff()
-                gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-                loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-                rs = gain / loss
-                df['RSI'] = 100 - (100 / (1 + rs))
+                df = add_indicators(df, self.dtype)
             
             return df
         except Exception as e:
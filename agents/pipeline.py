@@ -0,0 +1,170 @@
+"""
+Agent Pipeline
+Асинхронный конвейер агентов: загрузка -> решения -> исполнение через ограниченные очереди
+"""
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional
+
+from .portfolio_coordinator import PortfolioCoordinator
+
+
+# Признак конца потока в очереди
+_DONE = object()
+
+
+class AgentPipeline:
+    """
+    Конвейер поверх PortfolioCoordinator
+
+    Три стадии работают одновременно: пока загружаются данные тикера N+1, модель
+    обрабатывает тикер N, а исполнение записывает сделку по тикеру N-1. Стадии
+    связаны очередями ограниченного размера: если исполнение или запись в БД
+    отстают, предыдущие стадии блокируются на put() (backpressure), а не копят
+    сообщения в памяти.
+
+    В отличие от PortfolioCoordinator.run_cycle, решения исполняются в порядке
+    готовности, без переупорядочивания продаж перед покупками.
+    """
+
+    def __init__(self, coordinator: PortfolioCoordinator, queue_size: int = 32,
+                 fetch_concurrency: int = 8, batch_size: int = 16,
+                 fetch: Optional[Callable[[str], Dict]] = None):
+        """
+        Инициализация конвейера
+
+        Args:
+            coordinator: Координатор с watchlist, агентом решений и общим портфелем
+            queue_size: Размер очередей между стадиями
+            fetch_concurrency: Количество одновременных загрузок данных
+            batch_size: Максимальный размер батча для модели (набирается из уже готовых сообщений)
+            fetch: Функция загрузки market_update по тикеру (по умолчанию MarketMonitoringAgent.get_market_data)
+        """
+        self.coordinator = coordinator
+        self.queue_size = queue_size
+        self.fetch_concurrency = fetch_concurrency
+        self.batch_size = batch_size
+        self.fetch = fetch or self._fetch_market_data
+
+    def _fetch_market_data(self, ticker: str) -> Dict:
+        return self.coordinator.market_agents[ticker].get_market_data(period="1mo", interval="1d")
+
+    async def _fetch_stage(self, tickers: asyncio.Queue, decision_queue: asyncio.Queue,
+                           market_updates: Dict[str, Dict]):
+        """Загрузка данных (I/O в пуле потоков)"""
+        while True:
+            ticker = await tickers.get()
+            if ticker is _DONE:
+                return
+            try:
+                market_data = await asyncio.to_thread(self.fetch, ticker)
+            except Exception as e:
+                market_data = {"type": "error", "ticker": ticker, "message": f"Error fetching data: {str(e)}"}
+            market_updates[ticker] = market_data
+            self.coordinator.log_communication("MarketAgent", "DecisionAgent", market_data)
+            await decision_queue.put((ticker, market_data))
+
+    async def _decision_stage(self, decision_queue: asyncio.Queue, execution_queue: asyncio.Queue,
+                              decisions: Dict[str, Dict], stats: Dict):
+        """Решения: батчи из уже готовых сообщений, одно предсказание модели на батч"""
+        done = False
+        while not done:
+            batch = [await decision_queue.get()]
+            while len(batch) < self.batch_size and not decision_queue.empty():
+                batch.append(decision_queue.get_nowait())
+            if batch[-1] is _DONE:
+                batch.pop()
+                done = True
+            if not batch:
+                continue
+
+            tickers = [ticker for ticker, _ in batch]
+            started = time.perf_counter()
+            messages = await asyncio.to_thread(
+                self.coordinator.decision_agent.process_market_updates, [m for _, m in batch]
+            )
+            stats["decision_time"] += time.perf_counter() - started
+            stats["n_batches"] += 1
+
+            for ticker, (_, market_data), decision in zip(tickers, batch, messages):
+                decisions[ticker] = decision
+                if market_data.get("type") == "market_update":
+                    self.coordinator.last_prices[ticker] = market_data["current_price"]
+                if decision.get("type") == "trading_decision":
+                    self.coordinator.log_communication("DecisionAgent", "ExecutionAgent", decision)
+                    await execution_queue.put((ticker, decision))
+                    stats["max_execution_queue"] = max(stats["max_execution_queue"], execution_queue.qsize())
+        await execution_queue.put(_DONE)
+
+    async def _execution_stage(self, execution_queue: asyncio.Queue, executions: Dict[str, Dict], stats: Dict):
+        """Исполнение: один потребитель, т.к. портфель общий"""
+        while True:
+            item = await execution_queue.get()
+            if item is _DONE:
+                return
+            ticker, decision = item
+            started = time.perf_counter()
+            executions[ticker] = await asyncio.to_thread(self.coordinator.execution_agent.execute_trade, decision)
+            stats["execution_time"] += time.perf_counter() - started
+            self.coordinator.log_communication("ExecutionAgent", "UI", executions[ticker])
+
+    async def run_cycle_async(self, tickers: Optional[List[str]] = None) -> Dict:
+        """
+        Выполняет один цикл конвейера по всем тикерам
+
+        Args:
+            tickers: Тикеры (по умолчанию watchlist координатора)
+
+        Returns:
+            Результат цикла в формате PortfolioCoordinator.run_cycle
+        """
+        tickers = tickers or self.coordinator.tickers
+        ticker_queue: asyncio.Queue = asyncio.Queue()
+        decision_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        execution_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        for ticker in tickers:
+            ticker_queue.put_nowait(ticker)
+
+        market_updates, decisions, executions = {}, {}, {}
+        stats = {"decision_time": 0.0, "execution_time": 0.0, "n_batches": 0, "max_execution_queue": 0}
+        n_fetchers = max(1, min(self.fetch_concurrency, len(tickers)))
+        for _ in range(n_fetchers):
+            ticker_queue.put_nowait(_DONE)
+
+        started = time.perf_counter()
+        fetchers = [
+            asyncio.create_task(self._fetch_stage(ticker_queue, decision_queue, market_updates))
+            for _ in range(n_fetchers)
+        ]
+        decision_task = asyncio.create_task(
+            self._decision_stage(decision_queue, execution_queue, decisions, stats)
+        )
+        execution_task = asyncio.create_task(self._execution_stage(execution_queue, executions, stats))
+
+        await asyncio.gather(*fetchers)
+        fetched = time.perf_counter()
+        await decision_queue.put(_DONE)
+        await decision_task
+        await execution_task
+        finished = time.perf_counter()
+
+        results = {
+            ticker: self.coordinator.ticker_result(ticker, market_updates[ticker], decisions.get(ticker),
+                                                   executions.get(ticker))
+            for ticker in tickers
+        }
+        return self.coordinator.cycle_result(results, {
+            "fetch": (fetched - started) * 1000,
+            "decision": stats["decision_time"] * 1000,
+            "execution": stats["execution_time"] * 1000,
+            "total": (finished - started) * 1000,
+            "n_batches": stats["n_batches"],
+            "max_execution_queue": stats["max_execution_queue"]
+        })
+
+    def run_cycle(self, tickers: Optional[List[str]] = None) -> Dict:
+        """Синхронная обертка над run_cycle_async (для UI и скриптов)"""
+        try:
+            return asyncio.run(self.run_cycle_async(tickers))
+        except Exception as e:
+            return {"status": "error", "message": f"Error in pipeline cycle: {str(e)}"}
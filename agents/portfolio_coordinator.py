@@ -0,0 +1,283 @@
+"""
+Portfolio Coordinator
+Координирует агентов для списка тикеров (watchlist) с одним общим портфелем
+"""
+import time
+import yfinance as yf
+import pandas as pd
+from typing import Dict, List, Optional
+from datetime import datetime
+from .market_monitor import MarketMonitoringAgent
+from .decision_agent import DecisionMakingAgent
+from .execution_agent import ExecutionAgent
+from .comm_log import CommunicationLog
+from .instrumentation import LatencyRecorder
+
+
+def split_batch(data: pd.DataFrame, tickers: List[str]) -> Dict[str, pd.DataFrame]:
+    """
+    Разбивает результат yf.download по тикерам
+
+    Args:
+        data: Результат yf.download(..., group_by="ticker")
+        tickers: Запрошенные тикеры
+
+    Returns:
+        Словарь {ticker: OHLCV DataFrame}; тикеры без данных пропускаются
+    """
+    frames = {}
+    if data is None or data.empty:
+        return frames
+    for ticker in tickers:
+        if isinstance(data.columns, pd.MultiIndex):
+            if ticker not in data.columns.get_level_values(0):
+                continue
+            frame = data[ticker]
+        else:
+            frame = data
+        frame = frame.dropna(subset=['Close'])
+        if not frame.empty:
+            frames[ticker] = frame.copy()
+    return frames
+
+
+class PortfolioCoordinator:
+    """Координатор для нескольких тикеров: пакетная загрузка, батчевый инференс, общий портфель"""
+
+    def __init__(self, tickers: List[str], initial_balance: float = 10000.0,
+                 user_id: Optional[int] = None, use_db: bool = True,
+                 online_learning: bool = False, dtype: str = "float64",
+                 db_manager=None, verbose: bool = True,
+                 decision_agent: Optional[DecisionMakingAgent] = None,
+                 execution_agent: Optional[ExecutionAgent] = None,
+                 communication_log: Optional[CommunicationLog] = None):
+        """
+        Инициализация координатора
+
+        Args:
+            tickers: Список тикеров (watchlist)
+            initial_balance: Начальный баланс портфеля
+            user_id: ID пользователя (обязательно если use_db=True)
+            use_db: Использовать ли БД вместо CSV
+            online_learning: Дообучать модель инкрементально на новых барах
+            dtype: Тип данных индикаторов и признаков ("float64" или "float32")
+            db_manager: Менеджер БД
+            verbose: Печатать отладочную информацию агентов
+            decision_agent: Готовый агент решений (например, общий с AgentCoordinator)
+            execution_agent: Готовый агент исполнения (общий портфель с AgentCoordinator)
+            communication_log: Лог коммуникации (например, с записью в БД); по умолчанию - только память
+        """
+        self.user_id = user_id
+        self.dtype = dtype
+        self.market_agents: Dict[str, MarketMonitoringAgent] = {}
+        self.set_watchlist(tickers)
+        self.decision_agent = decision_agent or DecisionMakingAgent(online=online_learning, dtype=dtype,
+                                                                    verbose=verbose)
+
+        # Если user_id не указан, используем старый способ (CSV)
+        if user_id is None:
+            use_db = False
+
+        self.execution_agent = execution_agent or ExecutionAgent(
+            user_id=user_id if user_id else 0,
+            initial_balance=initial_balance,
+            use_db=use_db,
+            db_manager=db_manager
+        )
+        self.last_prices: Dict[str, float] = {}
+        # Последние записи в памяти (без баров и признаков)
+        self.communication_log = communication_log if communication_log is not None else CommunicationLog()
+        # Задержки этапов циклов watchlist (тикер "*" - цикл целиком)
+        self.latency = LatencyRecorder()
+
+    @property
+    def tickers(self) -> List[str]:
+        return list(self.market_agents)
+
+    def set_watchlist(self, tickers: List[str]):
+        """Обновляет список тикеров без пересоздания агентов решений и исполнения"""
+        tickers = list(dict.fromkeys(t.strip().upper() for t in tickers if t and t.strip()))
+        if not tickers:
+            raise ValueError("Watchlist is empty")
+        dtype = self.dtype if self.dtype != "float64" else None
+        self.market_agents = {
+            ticker: self.market_agents.get(ticker) or MarketMonitoringAgent(ticker, dtype=dtype)
+            for ticker in tickers
+        }
+
+    def add_ticker(self, ticker: str):
+        """Добавляет тикер в watchlist"""
+        self.set_watchlist(self.tickers + [ticker])
+
+    def remove_ticker(self, ticker: str):
+        """Удаляет тикер из watchlist"""
+        self.set_watchlist([t for t in self.tickers if t != ticker.strip().upper()])
+
+    def log_communication(self, from_agent: str, to_agent: str, message: Dict):
+        """Логирует коммуникацию между агентами"""
+        self.communication_log.log(from_agent, to_agent, message)
+
+    def fetch_market_data(self, period: str = "1mo", interval: str = "1d") -> Dict[str, Dict]:
+        """
+        Загружает данные всех тикеров одним запросом и формирует сообщения market_update
+
+        Returns:
+            Словарь {ticker: market_update или error}
+        """
+        try:
+            data = yf.download(self.tickers, period=period, interval=interval, group_by="ticker",
+                               auto_adjust=True, progress=False, threads=True)
+            frames = split_batch(data, self.tickers)
+        except Exception as e:
+            frames = {}
+            print(f"Error fetching batch data: {e}")
+
+        updates = {}
+        for ticker, agent in self.market_agents.items():
+            if ticker not in frames:
+                updates[ticker] = {
+                    "type": "error",
+                    "ticker": ticker,
+                    "message": f"No data available for {ticker}",
+                    "timestamp": datetime.now().isoformat()
+                }
+                continue
+            try:
+                updates[ticker] = agent.build_market_update(frames[ticker])
+            except Exception as e:
+                updates[ticker] = {
+                    "type": "error",
+                    "ticker": ticker,
+                    "message": f"Error building market update: {str(e)}",
+                    "timestamp": datetime.now().isoformat()
+                }
+        return updates
+
+    def run_cycle(self, market_updates: Optional[Dict[str, Dict]] = None) -> Dict:
+        """
+        Выполняет один цикл для всего watchlist:
+        1. Пакетная загрузка данных всех тикеров
+        2. Одно батчевое предсказание модели для всех тикеров
+        3. Исполнение решений на общем портфеле (сначала продажи, затем покупки)
+
+        Args:
+            market_updates: Готовые сообщения {ticker: market_update} (иначе загружаются)
+
+        Returns:
+            Результат цикла с результатами по каждому тикеру
+        """
+        try:
+            started = time.perf_counter()
+            if market_updates is None:
+                market_updates = self.fetch_market_data(period="1mo", interval="1d")
+            fetched = time.perf_counter()
+
+            tickers = list(market_updates)
+            for ticker in tickers:
+                self.log_communication("MarketAgent", "DecisionAgent", market_updates[ticker])
+                if market_updates[ticker].get("type") == "market_update":
+                    self.last_prices[ticker] = market_updates[ticker]["current_price"]
+
+            decisions = dict(zip(tickers, self.decision_agent.process_market_updates(
+                [market_updates[ticker] for ticker in tickers]
+            )))
+            decided = time.perf_counter()
+
+            # Продажи исполняются первыми, чтобы освободить средства для покупок в этом же цикле
+            order = sorted(tickers, key=lambda t: 0 if decisions[t].get("decision") == "SELL" else 1)
+            executions = {}
+            for ticker in order:
+                decision = decisions[ticker]
+                if decision.get("type") != "trading_decision":
+                    continue
+                self.log_communication("DecisionAgent", "ExecutionAgent", decision)
+                executions[ticker] = self.execution_agent.execute_trade(decision)
+                self.log_communication("ExecutionAgent", "UI", executions[ticker])
+            executed = time.perf_counter()
+
+            results = {
+                ticker: self.ticker_result(ticker, market_updates[ticker], decisions[ticker], executions.get(ticker))
+                for ticker in tickers
+            }
+            return self.cycle_result(results, {
+                "fetch": (fetched - started) * 1000,
+                "decision": (decided - fetched) * 1000,
+                "execution": (executed - decided) * 1000
+            })
+
+        except Exception as e:
+            return {
+                "status": "error",
+                "message": f"Error in cycle execution: {str(e)}",
+                "timestamp": datetime.now().isoformat()
+            }
+
+    @staticmethod
+    def ticker_result(ticker: str, market_data: Dict, decision: Optional[Dict],
+                      execution_result: Optional[Dict]) -> Dict:
+        """Результат цикла для одного тикера (формат как у AgentCoordinator.run_cycle)"""
+        if execution_result is None:
+            failed_step = "market_data" if market_data.get("type") == "error" else "decision"
+            return {
+                "status": "error",
+                "step": failed_step,
+                "message": (market_data if failed_step == "market_data" else decision or {}).get("message")
+            }
+        return {
+            "status": "success",
+            "market_data": {
+                "ticker": ticker,
+                "current_price": market_data.get("current_price"),
+                "timestamp": market_data.get("timestamp")
+            },
+            "decision": {
+                "action": decision.get("decision"),
+                "current_price": decision.get("current_price"),
+                "predicted_price": decision.get("predicted_price"),
+                "confidence": decision.get("confidence")
+            },
+            "execution": {
+                "status": execution_result.get("status"),
+                "action": execution_result.get("action"),
+                "message": execution_result.get("message")
+            }
+        }
+
+    def cycle_result(self, results: Dict[str, Dict], timings: Dict[str, float]) -> Dict:
+        """Итог цикла по всем тикерам (timings - время этапов в мс)"""
+        n_errors = sum(1 for r in results.values() if r["status"] == "error")
+        started = time.perf_counter()
+        self.execution_agent.record_equity_snapshot(self.last_prices)
+        timings["snapshot"] = (time.perf_counter() - started) * 1000
+        self.latency.record("*", timings)
+        return {
+            "status": "success" if n_errors < len(results) else "error",
+            "timestamp": datetime.now().isoformat(),
+            "tickers": results,
+            "n_errors": n_errors,
+            "portfolio": self.execution_agent.get_portfolio_summary(self.last_prices),
+            "timings": timings
+        }
+
+    def get_communication_log(self) -> List[Dict]:
+        """Возвращает лог коммуникации (последние записи)"""
+        return self.communication_log.to_list()
+
+    def get_decision_history(self):
+        """Возвращает историю решений"""
+        return self.decision_agent.get_decision_history()
+
+    def get_trade_history(self):
+        """Возвращает историю торгов"""
+        return self.execution_agent.get_trade_history()
+
+    def reset_system(self):
+        """Сбрасывает систему к начальному состоянию"""
+        self.execution_agent.reset_portfolio()
+        self.communication_log.clear()
+        self.decision_agent.decision_history = []
+        self.latency.reset()
+    
+    def close(self):
+        """Дописывает лог коммуникации и останавливает его фоновую запись"""
+        self.communication_log.close()
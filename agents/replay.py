@@ -0,0 +1,126 @@
+"""
+Replay
+Воспроизведение исторических/записанных баров через реальный конвейер агентов
+"""
+import os
+import shutil
+import tempfile
+import pandas as pd
+from typing import Dict, Iterator, Optional, Tuple, Union
+
+from database.db_manager import DBManager, get_db_manager
+
+
+# Окно баров в одном сообщении (как period="1mo" в AgentCoordinator.run_cycle)
+REPLAY_WINDOW = 21
+
+REPLAY_USERNAME = "replay"
+
+
+class ReplayFeed:
+    """Источник баров для воспроизведения: скользящее окно по OHLCV истории"""
+
+    def __init__(self, df: pd.DataFrame, window: int = REPLAY_WINDOW,
+                 start: Optional[int] = None, max_bars: Optional[int] = None):
+        """
+        Инициализация источника
+
+        Args:
+            df: OHLCV бары (упорядочены по времени)
+            window: Количество баров в каждом сообщении (последний - текущий бар)
+            start: Индекс первого воспроизводимого бара (по умолчанию window - 1)
+            max_bars: Максимальное количество воспроизводимых баров
+        """
+        self.df = df[['Open', 'High', 'Low', 'Close', 'Volume']]
+        self.window = window
+        self.start = window - 1 if start is None else max(start, 0)
+        self.end = len(df) if max_bars is None else min(len(df), self.start + max_bars)
+
+    @classmethod
+    def from_csv(cls, path: str, **kwargs) -> "ReplayFeed":
+        """Загружает записанные бары из CSV (индекс - время бара)"""
+        df = pd.read_csv(path, index_col=0, parse_dates=True)
+        return cls(df, **kwargs)
+
+    @classmethod
+    def from_history(cls, ticker: str, period: str = "1y", **kwargs) -> "ReplayFeed":
+        """Загружает историю тикера из yfinance"""
+        from models.train_model import download_history
+
+        df = download_history(ticker, period)
+        if df.empty:
+            raise ValueError(f"No data available for {ticker}")
+        return cls(df, **kwargs)
+
+    def __len__(self) -> int:
+        return max(0, self.end - self.start)
+
+    def __iter__(self) -> Iterator[Tuple[pd.Timestamp, pd.DataFrame]]:
+        for i in range(self.start, self.end):
+            # Копия окна: build_market_update добавляет в него колонки индикаторов
+            window = self.df.iloc[max(0, i - self.window + 1):i + 1].copy()
+            yield self.df.index[i], window
+
+
+def run_replay(source: Union[pd.DataFrame, ReplayFeed], ticker: str = "AAPL",
+               initial_balance: float = 10000.0, db_path: Optional[str] = None,
+               online_learning: bool = False, dtype: str = "float64",
+               keep_results: bool = False) -> Dict:
+    """
+    Воспроизводит бары через MarketMonitoringAgent -> DecisionMakingAgent -> ExecutionAgent
+    на изолированной БД
+
+    Args:
+        source: OHLCV история или ReplayFeed
+        ticker: Тикер
+        initial_balance: Начальный баланс
+        db_path: Путь к БД воспроизведения (общий менеджер get_db_manager, остается открытым);
+            если None, временная БД закрывается и удаляется после прогона
+        online_learning: Дообучать модель на новых барах (дообучается копия модели во временной
+            директории, чекпоинты пишутся во временный реестр - models/model.pkl не меняется)
+        dtype: Тип данных индикаторов и признаков
+        keep_results: Сохранять результаты всех циклов
+
+    Returns:
+        Сводка воспроизведения (см. AgentCoordinator.replay) с историей сделок
+    """
+    from agents.coordinator import AgentCoordinator
+    from agents.decision_agent import DecisionMakingAgent
+    from models.registry import ModelRegistry
+
+    feed = source if isinstance(source, ReplayFeed) else ReplayFeed(source)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # Общий менеджер для переданной БД (вызывающий код читает из нее результаты);
+        # собственный для временной - закрывается до удаления директории
+        db_manager = get_db_manager(db_path) if db_path else DBManager(os.path.join(temp_dir, "replay.db"))
+        coordinator = None
+        try:
+            user_id = db_manager.create_user(REPLAY_USERNAME, "-")
+            if user_id is None:
+                user_id = db_manager.get_user_by_username(REPLAY_USERNAME)["id"]
+
+            # Копия рабочей модели: чекпоинты онлайн-обучения не должны попасть в models/
+            model_path = os.path.join(temp_dir, "model.pkl")
+            production_model_path = DecisionMakingAgent.DEFAULT_MODEL_PATH
+            if os.path.exists(production_model_path):
+                shutil.copyfile(production_model_path, model_path)
+            decision_agent = DecisionMakingAgent(
+                model_path=model_path, online=online_learning,
+                registry=ModelRegistry(os.path.join(temp_dir, "registry")),
+                dtype=dtype, verbose=False
+            )
+
+            coordinator = AgentCoordinator(
+                ticker, initial_balance, user_id=user_id, use_db=True,
+                online_learning=online_learning, dtype=dtype,
+                db_manager=db_manager, verbose=False, decision_agent=decision_agent
+            )
+            summary = coordinator.replay(feed, keep_results=keep_results)
+            summary["trade_history"] = coordinator.get_trade_history()
+        finally:
+            if coordinator is not None:
+                coordinator.close()
+            if not db_path:
+                db_manager.close()
+    return summary
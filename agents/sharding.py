@@ -0,0 +1,333 @@
+"""
+Sharded Coordinator
+Распределение тикеров watchlist по рабочим процессам для CPU-bound циклов
+"""
+import time
+import weakref
+import zlib
+import multiprocessing
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from .portfolio_coordinator import PortfolioCoordinator, split_batch
+
+
+def shard_for(ticker: str, n_shards: int) -> int:
+    """Номер шарда тикера (стабильный между запусками, в отличие от hash())"""
+    return zlib.crc32(ticker.encode("utf-8")) % n_shards
+
+
+# Хвост, который догружается для "теплых" тикеров, и интервал, который он гарантированно покрывает
+# (5 торговых дней - не меньше 5 календарных)
+TAIL_PERIOD = "5d"
+TAIL_WINDOW = pd.Timedelta(days=5)
+
+
+# ---------- Состояние рабочего процесса ----------
+
+# В каждом процессе: агент решений с моделью, агенты рынка и "теплые" бары своих тикеров
+_worker_state: Dict = {}
+
+
+def _init_worker(model_path: str, dtype: str, online: bool = False):
+    """
+    Инициализация рабочего процесса: модель загружается один раз
+
+    При online каждый процесс дообучает свою копию модели на барах своих тикеров, но не
+    сохраняет чекпоинты: models/model.pkl и реестр пишет только родительский процесс
+    (см. ShardedCoordinator.consolidate_online_models).
+    """
+    from agents.decision_agent import DecisionMakingAgent
+
+    _worker_state.clear()
+    _worker_state.update({
+        "decision_agent": DecisionMakingAgent(model_path, online=online, checkpoint_every=0,
+                                              dtype=dtype, verbose=False),
+        "dtype": dtype,
+        "market_agents": {},
+        "bars": {},
+    })
+
+
+def _reload_worker_model() -> bool:
+    """Перезагружает модель в рабочем процессе (после переобучения)"""
+    _worker_state["decision_agent"].load_model()
+    return _worker_state["decision_agent"].model is not None
+
+
+def _get_worker_model() -> Dict:
+    """Онлайн-модель процесса и ошибки ее предсказаний после последней синхронизации"""
+    decision_agent = _worker_state["decision_agent"]
+    return {"model": decision_agent.model, "abs_errors": list(decision_agent.online_abs_errors)}
+
+
+def _set_worker_model(model) -> bool:
+    """Заменяет модель процесса выбранной родителем (ожидающие разметки бары сохраняются)"""
+    decision_agent = _worker_state["decision_agent"]
+    decision_agent.model = model
+    decision_agent.online_abs_errors = []
+    return True
+
+
+def _merge_bars(ticker: str, new_bars: pd.DataFrame) -> pd.DataFrame:
+    """Добавляет новые бары в хранилище процесса и оставляет последний месяц (как period="1mo")"""
+    bars = _worker_state["bars"].get(ticker)
+    bars = new_bars if bars is None else pd.concat([bars, new_bars])
+    bars = bars[~bars.index.duplicated(keep="last")].sort_index()
+    bars = bars[bars.index > bars.index[-1] - pd.DateOffset(months=1)]
+    _worker_state["bars"][ticker] = bars
+    return bars
+
+
+def _fetch_bars(tickers: List[str], interval: str) -> Dict[str, pd.DataFrame]:
+    """
+    Загружает бары тикеров шарда одним запросом; для "теплых" тикеров - только хвост
+
+    Тикер, последний бар которого старше начала хвоста (процесс простаивал), загружается
+    за месяц целиком - иначе между старыми барами и хвостом останется разрыв.
+    """
+    import yfinance as yf
+
+    cold, warm = [], []
+    for ticker in tickers:
+        bars = _worker_state["bars"].get(ticker)
+        if bars is None or bars.empty:
+            cold.append(ticker)
+            continue
+        last_bar = bars.index[-1]
+        now = pd.Timestamp.now(tz=last_bar.tz)
+        (warm if last_bar >= now - TAIL_WINDOW else cold).append(ticker)
+    frames = {}
+    for group, period in ((cold, "1mo"), (warm, TAIL_PERIOD)):
+        if group:
+            data = yf.download(group, period=period, interval=interval, group_by="ticker",
+                               auto_adjust=True, progress=False, threads=True)
+            frames.update(split_batch(data, group))
+    return frames
+
+
+def _run_shard(tickers: List[str], new_bars: Optional[Dict[str, pd.DataFrame]] = None,
+               interval: str = "1d") -> Tuple[List[Tuple[str, Dict, Dict]], List[Dict]]:
+    """
+    Цикл шарда в рабочем процессе: бары -> индикаторы -> батчевое предсказание
+
+    Returns:
+        (список (ticker, market_update без баров, решение), записи истории решений цикла)
+    """
+    from agents.market_monitor import MarketMonitoringAgent
+
+    if new_bars is None:
+        try:
+            new_bars = _fetch_bars(tickers, interval)
+        except Exception as e:
+            print(f"Error fetching shard data: {e}")
+            new_bars = {}
+
+    dtype = _worker_state["dtype"]
+    market_updates = []
+    for ticker in tickers:
+        if ticker in new_bars and not new_bars[ticker].empty:
+            bars = _merge_bars(ticker, new_bars[ticker])
+        else:
+            bars = _worker_state["bars"].get(ticker)
+        if bars is None or bars.empty:
+            market_updates.append({
+                "type": "error",
+                "ticker": ticker,
+                "message": f"No data available for {ticker}",
+                "timestamp": datetime.now().isoformat()
+            })
+            continue
+        agent = _worker_state["market_agents"].get(ticker)
+        if agent is None:
+            agent = MarketMonitoringAgent(ticker, dtype=dtype if dtype != "float64" else None)
+            _worker_state["market_agents"][ticker] = agent
+        try:
+            market_updates.append(agent.build_market_update(bars.copy()))
+        except Exception as e:
+            market_updates.append({
+                "type": "error",
+                "ticker": ticker,
+                "message": f"Error building market update: {str(e)}",
+                "timestamp": datetime.now().isoformat()
+            })
+
+    decision_agent = _worker_state["decision_agent"]
+    decisions = decision_agent.process_market_updates(market_updates)
+    # История решений переносится в родительский процесс, в процессе не накапливается
+    history, decision_agent.decision_history = decision_agent.decision_history, []
+    # Бары остаются в процессе; в родительский процесс передаем только нужные поля
+    light_updates = [{k: v for k, v in m.items() if k != "data"} for m in market_updates]
+    return list(zip(tickers, light_updates, decisions)), history
+
+
+def _shutdown_executors(executors: List[ProcessPoolExecutor], wait: bool = True):
+    """Останавливает пулы рабочих процессов"""
+    for executor in executors:
+        executor.shutdown(wait=wait, cancel_futures=True)
+
+
+class ShardedCoordinator(PortfolioCoordinator):
+    """
+    Координатор watchlist, распределяющий тикеры по N рабочим процессам
+
+    Тикер всегда попадает в один и тот же процесс (crc32 % N), поэтому процесс держит
+    "теплые" бары своих тикеров и загруженную модель. Индикаторы и инференс считаются
+    в процессах параллельно, а исполнение сделок - в родительском процессе на общем портфеле.
+
+    При онлайн-обучении копии модели в процессах учатся каждая на своем шарде; каждые
+    checkpoint_every обновлений родитель выбирает лучшую из них, сохраняет чекпоинт и
+    раздает ее всем процессам, чтобы копии не расходились.
+    """
+
+    def __init__(self, tickers: List[str], n_shards: int = 4, **kwargs):
+        """
+        Инициализация координатора
+
+        Args:
+            tickers: Список тикеров (watchlist)
+            n_shards: Количество рабочих процессов
+            **kwargs: Параметры PortfolioCoordinator
+        """
+        super().__init__(tickers, **kwargs)
+        self.n_shards = max(1, n_shards)
+        context = multiprocessing.get_context("spawn")
+        # Отдельный однопроцессный пул на шард - закрепляет тикеры за процессом
+        self.executors = [
+            ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_worker,
+                                initargs=(self.decision_agent.model_path, self.dtype, self.decision_agent.online))
+            for _ in range(self.n_shards)
+        ]
+        # Онлайн-обновления шардов после последней синхронизации моделей
+        self.pending_online_updates = 0
+        # Координатор, который удалили без close() (например, вместе с сессией UI),
+        # не оставляет рабочие процессы
+        self._finalizer = weakref.finalize(self, _shutdown_executors, self.executors, False)
+
+    def partition(self, tickers: Optional[List[str]] = None) -> List[List[str]]:
+        """Разбивает тикеры по шардам"""
+        shards = [[] for _ in range(self.n_shards)]
+        for ticker in tickers or self.tickers:
+            shards[shard_for(ticker, self.n_shards)].append(ticker)
+        return shards
+
+    def reload_model(self):
+        """Перезагружает модель во всех процессах"""
+        self.decision_agent.load_model()
+        for executor in self.executors:
+            executor.submit(_reload_worker_model).result()
+        self.pending_online_updates = 0
+
+    def consolidate_online_models(self) -> Optional[str]:
+        """
+        Выбирает онлайн-модель шарда с наименьшей средней ошибкой после последней синхронизации,
+        сохраняет ее чекпоинт (единственный писатель models/model.pkl и реестра) и раздает
+        всем процессам
+
+        Returns:
+            ID записи реестра или None, если обновлений не было
+        """
+        if not self.pending_online_updates:
+            return None
+        shard_models = [executor.submit(_get_worker_model).result() for executor in self.executors]
+        shard_models = [m for m in shard_models if m["model"] is not None and m["abs_errors"]]
+        if not shard_models:
+            return None
+        best = min(shard_models, key=lambda m: float(np.mean(m["abs_errors"])))
+
+        decision_agent = self.decision_agent
+        decision_agent.model = best["model"]
+        decision_agent.online_updates += self.pending_online_updates
+        decision_agent.online_abs_errors = best["abs_errors"][-500:]
+        self.pending_online_updates = 0
+        for executor in self.executors:
+            executor.submit(_set_worker_model, best["model"]).result()
+        return decision_agent.checkpoint_model()
+
+    def run_cycle(self, bars: Optional[Dict[str, pd.DataFrame]] = None, interval: str = "1d") -> Dict:
+        """
+        Выполняет один цикл для всего watchlist в рабочих процессах
+
+        Args:
+            bars: Новые бары {ticker: OHLCV} (например, при воспроизведении); иначе процессы
+                  загружают данные сами
+            interval: Интервал баров
+
+        Returns:
+            Результат цикла в формате PortfolioCoordinator.run_cycle
+        """
+        try:
+            started = time.perf_counter()
+            futures = []
+            for executor, shard_tickers in zip(self.executors, self.partition()):
+                if not shard_tickers:
+                    continue
+                shard_bars = None if bars is None else {t: bars[t] for t in shard_tickers if t in bars}
+                futures.append(executor.submit(_run_shard, shard_tickers, shard_bars, interval))
+
+            market_updates, decisions = {}, {}
+            n_online_updates = 0
+            for future in futures:
+                shard_results, history = future.result()
+                self.decision_agent.decision_history.extend(history)
+                for ticker, market_data, decision in shard_results:
+                    market_updates[ticker] = market_data
+                    decisions[ticker] = decision
+                    n_online_updates += decision.get("online_update") is not None
+                    self.log_communication("MarketAgent", "DecisionAgent", market_data)
+                    if market_data.get("type") == "market_update":
+                        self.last_prices[ticker] = market_data["current_price"]
+            self.pending_online_updates += n_online_updates
+            checkpoint_every = self.decision_agent.checkpoint_every
+            if checkpoint_every and self.pending_online_updates >= checkpoint_every:
+                self.consolidate_online_models()
+            decided = time.perf_counter()
+
+            # Продажи исполняются первыми, чтобы освободить средства для покупок в этом же цикле
+            order = sorted(decisions, key=lambda t: 0 if decisions[t].get("decision") == "SELL" else 1)
+            executions = {}
+            for ticker in order:
+                if decisions[ticker].get("type") != "trading_decision":
+                    continue
+                self.log_communication("DecisionAgent", "ExecutionAgent", decisions[ticker])
+                executions[ticker] = self.execution_agent.execute_trade(decisions[ticker])
+                self.log_communication("ExecutionAgent", "UI", executions[ticker])
+            executed = time.perf_counter()
+
+            results = {
+                ticker: self.ticker_result(ticker, market_updates[ticker], decisions[ticker], executions.get(ticker))
+                for ticker in self.tickers if ticker in market_updates
+            }
+            return self.cycle_result(results, {
+                "shards": (decided - started) * 1000,
+                "execution": (executed - decided) * 1000,
+                "n_shards": self.n_shards
+            })
+
+        except Exception as e:
+            return {
+                "status": "error",
+                "message": f"Error in sharded cycle: {str(e)}",
+                "timestamp": datetime.now().isoformat()
+            }
+
+    def close(self):
+        """Сохраняет несинхронизированные онлайн-обновления и останавливает рабочие процессы"""
+        if self.executors and self.decision_agent.checkpoint_every:
+            try:
+                self.consolidate_online_models()
+            except Exception as e:
+                print(f"Error saving shard models: {e}")
+        self._finalizer.detach()
+        _shutdown_executors(self.executors)
+        self.executors = []
+        super().close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,186 @@
+"""
+Trade Journal
+Append-only CSV журнал сделок с периодическими снимками баланса и позиций
+(режим без БД: запуск читает последний снимок и воспроизводит только хвост журнала)
+"""
+import csv
+import json
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+
+# Колонки журнала (совпадают с CSV, который раньше целиком переписывал ExecutionAgent)
+FIELDS = ["timestamp", "ticker", "action", "shares", "price", "total", "balance_after", "confidence"]
+# Типы колонок при чтении хвоста журнала
+_CONVERTERS = {"shares": int, "price": float, "total": float, "balance_after": float, "confidence": float}
+
+
+def _parse_value(field: str, value: str):
+    converter = _CONVERTERS.get(field)
+    if converter is None or value == "":
+        return value
+    try:
+        return converter(value)
+    except ValueError:
+        return converter(float(value))
+
+
+def reduce_holding(portfolio: Dict, ticker: str, shares: int):
+    """
+    Уменьшает позицию после продажи: стоимость позиции списывается пропорционально
+    проданным акциям (средняя цена не меняется, как в DBManager.record_trade)
+    """
+    holding = portfolio[ticker]
+    shares_before = holding["shares"]
+    holding["shares"] = shares_before - shares
+    if holding["shares"] <= 0:
+        del portfolio[ticker]
+        return
+    holding["total_cost"] = holding["total_cost"] * holding["shares"] / shares_before
+
+
+def replay_trades(trades: List[Dict], balance: float, portfolio: Dict,
+                  default_ticker: str = "AAPL") -> Tuple[float, Dict]:
+    """
+    Применяет сделки журнала к балансу и позициям (по месту)
+
+    Args:
+        trades: Сделки журнала в порядке исполнения
+        balance: Баланс до первой сделки
+        portfolio: Позиции до первой сделки {ticker: {"shares", "avg_price", "total_cost"}}
+        default_ticker: Тикер сделок без тикера (старые журналы)
+
+    Returns:
+        (баланс, позиции) после всех сделок
+    """
+    for trade in trades:
+        ticker = trade.get("ticker") or default_ticker
+        action = trade.get("action")
+        shares = trade.get("shares", 0)
+        price = trade.get("price", 0)
+
+        if action == "BUY":
+            cost = shares * price
+            if balance >= cost:
+                balance -= cost
+                holding = portfolio.setdefault(ticker, {"shares": 0, "avg_price": 0, "total_cost": 0})
+                holding["shares"] += shares
+                holding["total_cost"] += cost
+                holding["avg_price"] = holding["total_cost"] / holding["shares"] if holding["shares"] > 0 else 0
+
+        elif action == "SELL":
+            if ticker in portfolio and portfolio[ticker]["shares"] >= shares:
+                balance += shares * price
+                reduce_holding(portfolio, ticker, shares)
+    return balance, portfolio
+
+
+class TradeJournal:
+    """
+    Журнал сделок: сделка дописывается одной строкой в конец CSV, а состояние портфеля
+    раз в snapshot_every сделок сохраняется в JSON-снимок вместе с позицией в файле
+    """
+
+    def __init__(self, path: str, snapshot_every: int = 500):
+        """
+        Инициализация
+
+        Args:
+            path: Путь к CSV журналу
+            snapshot_every: Через сколько сделок после последнего снимка нужен новый
+        """
+        self.path = path
+        self.snapshot_path = os.path.splitext(path)[0] + ".snapshot.json"
+        self.snapshot_every = snapshot_every
+        self.trades_since_snapshot = 0
+
+    @property
+    def snapshot_due(self) -> bool:
+        return self.trades_since_snapshot >= self.snapshot_every
+
+    def append(self, trade: Dict):
+        """Дописывает сделку в конец журнала (заголовок - только в новый файл)"""
+        write_header = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, "a", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS, extrasaction="ignore", lineterminator="\n")
+            if write_header:
+                writer.writeheader()
+            writer.writerow(trade)
+        self.trades_since_snapshot += 1
+
+    def write_snapshot(self, state: Dict):
+        """
+        Сохраняет состояние портфеля на текущий конец журнала
+
+        Args:
+            state: JSON-сериализуемое состояние (баланс, позиции)
+        """
+        snapshot = {
+            "offset": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            "created_at": datetime.now().isoformat(),
+            "state": state
+        }
+        # Запись через временный файл: снимок либо старый, либо новый целиком
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.snapshot_path)
+        self.trades_since_snapshot = 0
+
+    def _read_snapshot(self) -> Optional[Dict]:
+        if not os.path.exists(self.snapshot_path):
+            return None
+        try:
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading journal snapshot: {e}")
+            return None
+        # Журнал короче снимка (файл заменен или обрезан) - снимок недействителен
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if snapshot.get("offset", 0) > size:
+            return None
+        return snapshot
+
+    def load(self, use_snapshot: bool = True) -> Tuple[Optional[Dict], List[Dict]]:
+        """
+        Последний снимок и сделки после него
+
+        Args:
+            use_snapshot: False - игнорировать снимок и вернуть весь журнал
+
+        Returns:
+            (состояние из снимка или None, список сделок хвоста журнала)
+        """
+        if not os.path.exists(self.path):
+            return None, []
+
+        snapshot = self._read_snapshot() if use_snapshot else None
+        with open(self.path, newline="", encoding="utf-8") as f:
+            header = next(csv.reader([f.readline()]), None)
+            if not header:
+                return None, []
+            if snapshot is not None and snapshot["offset"] > f.tell():
+                f.seek(snapshot["offset"])
+            tail = [
+                {field: _parse_value(field, value) for field, value in row.items()}
+                for row in csv.DictReader(f, fieldnames=header)
+            ]
+        self.trades_since_snapshot = len(tail)
+        return (snapshot["state"] if snapshot is not None else None), tail
+
+    def read(self) -> pd.DataFrame:
+        """Весь журнал в виде DataFrame"""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return pd.DataFrame()
+        return pd.read_csv(self.path)
+
+    def clear(self):
+        """Удаляет журнал и снимок"""
+        for path in (self.path, self.snapshot_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.trades_since_snapshot = 0
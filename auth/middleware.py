@@ -58,8 +58,8 @@ def show_login_page():
             if submit:
                 if username and password:
                     # Импортируем здесь, чтобы избежать циклических импортов
-                    from database.db_manager import DBManager
-                    db_manager = DBManager()
+                    from database.db_manager import get_db_manager
+                    db_manager = get_db_manager()
                     auth_manager = AuthManager()
                     
                     result = auth_manager.login(username, password, db_manager)
@@ -91,8 +91,8 @@ def show_login_page():
                     elif len(new_password) < 6:
                         st.warning("Пароль должен содержать минимум 6 символов")
                     else:
-                        from database.db_manager import DBManager
-                        db_manager = DBManager()
+                        from database.db_manager import get_db_manager
+                        db_manager = get_db_manager()
                         auth_manager = AuthManager()
                         
                         result = auth_manager.register(new_username, new_password, new_email, db_manager)
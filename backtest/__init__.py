@@ -0,0 +1,8 @@
+"""
+Backtesting модуль
+"""
+from .engine import Backtester, simulate_policy, max_drawdown
+from .sweep import run_sweep, SWEEP_GRID
+from .monte_carlo import run_monte_carlo
+
+__all__ = ['Backtester', 'simulate_policy', 'max_drawdown', 'run_sweep', 'SWEEP_GRID', 'run_monte_carlo']
@@ -0,0 +1,224 @@
+"""
+Backtest Engine
+Векторизованный бэктест политики DecisionMakingAgent + ExecutionAgent на истории
+"""
+import time
+import numpy as np
+import pandas as pd
+from typing import Dict, Optional
+
+from agents.decision_agent import DecisionMakingAgent, BUY, SELL, HOLD, ACTION_NAMES
+from models.online import CLOSE_INDEX
+from models.train_model import build_feature_matrix, download_history
+
+
+def simulate_policy(close: np.ndarray, actions: np.ndarray, initial_balance: float = 10000.0,
+                    trade_percentage=0.1, sell_fraction=0.5) -> Dict[str, np.ndarray]:
+    """
+    Симулирует правила ExecutionAgent (покупка на долю баланса, продажа доли акций)
+
+    Работает сразу для P независимых траекторий: close и actions имеют форму (T,) или (T, P),
+    trade_percentage и sell_fraction - скаляры или массивы формы (P,). Состояние меняется
+    только на барах с сигналом BUY/SELL, поэтому цикл идет лишь по таким барам, а все
+    операции внутри векторизованы по траекториям; балансы между сигналами заполняются
+    векторно.
+
+    Args:
+        close: Цены закрытия
+        actions: Коды действий (BUY=1, SELL=-1, HOLD=0)
+        initial_balance: Начальный баланс
+        trade_percentage: Доля баланса на одну покупку
+        sell_fraction: Доля акций, продаваемая за одну продажу
+
+    Returns:
+        Словарь массивов формы (T, P): balance, shares, traded (со знаком), equity
+    """
+    close = np.asarray(close, dtype=np.float64)
+    actions = np.asarray(actions)
+    if close.ndim == 1:
+        close = close[:, None]
+    if actions.ndim == 1:
+        actions = actions[:, None]
+
+    n_bars = actions.shape[0]
+    n_paths = max(close.shape[1], actions.shape[1])
+    close = np.broadcast_to(close, (n_bars, n_paths))
+    actions = np.broadcast_to(actions, (n_bars, n_paths))
+    trade_percentage = np.broadcast_to(np.asarray(trade_percentage, dtype=np.float64), (n_paths,))
+    sell_fraction = np.broadcast_to(np.asarray(sell_fraction, dtype=np.float64), (n_paths,))
+
+    balance = np.full(n_paths, float(initial_balance))
+    shares = np.zeros(n_paths, dtype=np.int64)
+    traded = np.zeros((n_bars, n_paths), dtype=np.int64)
+
+    event_rows = np.flatnonzero((actions != HOLD).any(axis=1))
+    balance_at_event = np.empty((len(event_rows), n_paths))
+    shares_at_event = np.empty((len(event_rows), n_paths), dtype=np.int64)
+
+    for k, t in enumerate(event_rows):
+        price = close[t]
+        action = actions[t]
+
+        # BUY: int(balance * trade_percentage / price) акций, если хватает средств
+        buy = action == BUY
+        if buy.any():
+            safe_price = np.where(price > 0, price, 1.0)
+            qty = np.where(price > 0, np.floor(balance * trade_percentage / safe_price), 0.0)
+            cost = qty * price
+            ok = buy & (qty > 0) & (balance >= cost)
+            balance = np.where(ok, balance - cost, balance)
+            bought = np.where(ok, qty, 0).astype(np.int64)
+            shares = shares + bought
+            traded[t] += bought
+
+        # SELL: max(1, int(shares * sell_fraction)), но не больше имеющихся
+        sell = (action == SELL) & (shares > 0)
+        if sell.any():
+            qty = np.minimum(np.maximum(1, np.floor(shares * sell_fraction)), shares).astype(np.int64)
+            qty = np.where(sell, qty, 0)
+            balance = balance + qty * price
+            shares = shares - qty
+            traded[t] -= qty
+
+        balance_at_event[k] = balance
+        shares_at_event[k] = shares
+
+    # Заполняем состояние между сигналами: для каждого бара берем последний бар с сигналом
+    # (строка 0 - начальное состояние до первого сигнала)
+    balance_at_event = np.vstack([np.full((1, n_paths), float(initial_balance)), balance_at_event])
+    shares_at_event = np.vstack([np.zeros((1, n_paths), dtype=np.int64), shares_at_event])
+    last_event = np.zeros(n_bars, dtype=np.int64)
+    last_event[event_rows] = np.arange(1, len(event_rows) + 1)
+    last_event = np.maximum.accumulate(last_event) if n_bars else last_event
+    balance_hist = balance_at_event[last_event]
+    shares_hist = shares_at_event[last_event]
+
+    return {
+        "balance": balance_hist,
+        "shares": shares_hist,
+        "traded": traded,
+        "equity": balance_hist + shares_hist * close,
+    }
+
+
+def max_drawdown(equity: np.ndarray) -> np.ndarray:
+    """Максимальная просадка (доля, <= 0) по оси времени"""
+    equity = np.asarray(equity, dtype=np.float64)
+    peak = np.maximum.accumulate(equity, axis=0)
+    return np.min(equity / np.where(peak > 0, peak, 1.0) - 1.0, axis=0)
+
+
+class Backtester:
+    """Бэктест торговой политики агентов на полной истории тикера"""
+
+    def __init__(self, decision_agent: Optional[DecisionMakingAgent] = None,
+                 initial_balance: float = 10000.0, trade_percentage: float = 0.1,
+                 sell_fraction: float = 0.5, dtype: str = "float64"):
+        """
+        Инициализация бэктестера
+
+        Args:
+            decision_agent: Агент с загруженной моделью и правилами (если None, создается новый)
+            initial_balance: Начальный баланс
+            trade_percentage: Доля баланса на одну покупку (как в ExecutionAgent)
+            sell_fraction: Доля акций на одну продажу (как в ExecutionAgent)
+            dtype: Тип данных признаков
+        """
+        self.decision_agent = decision_agent or DecisionMakingAgent(dtype=dtype)
+        self.initial_balance = initial_balance
+        self.trade_percentage = trade_percentage
+        self.sell_fraction = sell_fraction
+        self.dtype = dtype
+
+    def compute_signals(self, df: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """
+        Считает признаки, предсказания и уверенность для всех баров одним батчем
+
+        Args:
+            df: OHLCV история
+
+        Returns:
+            Словарь массивов: dates, close, predicted, confidence
+        """
+        if self.decision_agent.model is None:
+            raise ValueError("Model is not loaded. Please train the model first.")
+
+        X, _, _, dates = build_feature_matrix(df, self.dtype, require_target=False)
+        close = X[:, CLOSE_INDEX].astype(np.float64)
+        raw_predictions = self.decision_agent.model.predict(X)
+        predicted = self.decision_agent.sanitize_predictions(raw_predictions, close)
+        confidence = self.decision_agent.confidence_batch(close, predicted)
+        return {"dates": dates, "close": close, "predicted": predicted, "confidence": confidence}
+
+    def run(self, df: Optional[pd.DataFrame] = None, ticker: str = "AAPL", period: str = "10y") -> Dict:
+        """
+        Выполняет бэктест
+
+        Args:
+            df: OHLCV история (если None, загружается для ticker за period)
+            ticker: Тикер
+            period: Период истории для загрузки
+
+        Returns:
+            Словарь: equity_curve (DataFrame), trades (DataFrame), summary (dict)
+        """
+        if df is None:
+            df = download_history(ticker, period)
+            if df.empty:
+                raise ValueError(f"No data available for {ticker}")
+
+        started = time.perf_counter()
+        signals = self.compute_signals(df)
+        signals_time = time.perf_counter() - started
+
+        actions = self.decision_agent.decide_batch(signals["close"], signals["predicted"], signals["confidence"])
+        state = simulate_policy(signals["close"], actions, self.initial_balance,
+                                self.trade_percentage, self.sell_fraction)
+        elapsed = time.perf_counter() - started
+
+        close = signals["close"]
+        equity = state["equity"][:, 0]
+        traded = state["traded"][:, 0]
+
+        equity_curve = pd.DataFrame({
+            "close": close,
+            "predicted": signals["predicted"],
+            "confidence": signals["confidence"],
+            "signal": pd.Categorical.from_codes(actions + 1, ["SELL", "HOLD", "BUY"]),
+            "balance": state["balance"][:, 0],
+            "shares": state["shares"][:, 0],
+            "equity": equity,
+        }, index=pd.to_datetime(signals["dates"]))
+
+        trade_rows = np.flatnonzero(traded)
+        trades = pd.DataFrame({
+            "timestamp": equity_curve.index[trade_rows],
+            "ticker": ticker,
+            "action": np.where(traded[trade_rows] > 0, "BUY", "SELL"),
+            "shares": np.abs(traded[trade_rows]),
+            "price": close[trade_rows],
+            "total": np.abs(traded[trade_rows]) * close[trade_rows],
+            "balance_after": state["balance"][trade_rows, 0],
+            "confidence": signals["confidence"][trade_rows],
+        })
+
+        final_equity = float(equity[-1]) if len(equity) else self.initial_balance
+        summary = {
+            "ticker": ticker,
+            "n_bars": len(close),
+            "start": equity_curve.index[0].isoformat() if len(close) else None,
+            "end": equity_curve.index[-1].isoformat() if len(close) else None,
+            "initial_balance": self.initial_balance,
+            "final_equity": final_equity,
+            "pnl": final_equity - self.initial_balance,
+            "total_return_pct": (final_equity / self.initial_balance - 1) * 100,
+            "buy_and_hold_return_pct": float(close[-1] / close[0] - 1) * 100 if len(close) else 0.0,
+            "max_drawdown_pct": float(max_drawdown(equity)) * 100 if len(close) else 0.0,
+            "n_trades": len(trade_rows),
+            "n_buys": int((traded > 0).sum()),
+            "n_sells": int((traded < 0).sum()),
+            "signal_counts": {ACTION_NAMES[a]: int((actions == a).sum()) for a in (BUY, SELL, HOLD)},
+            "signals_time": signals_time,
+            "elapsed": elapsed,
+        }
+        return {"equity_curve": equity_curve, "trades": trades, "summary": summary}
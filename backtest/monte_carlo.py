@@ -0,0 +1,265 @@
+"""
+Monte Carlo stress simulation
+Прогон торговой политики агентов на тысячах синтетических траекторий цены
+"""
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from typing import Dict, Optional, Tuple
+
+# Добавляем корневую директорию в путь (для запуска как скрипт)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.decision_agent import DecisionMakingAgent, BUY, SELL
+from backtest.engine import simulate_policy, max_drawdown
+from models.train_model import create_features, download_history, FEATURE_COLUMNS
+
+
+# Сколько реальных баров истории предшествует каждой траектории (окно MA50 + запас)
+WARMUP_BARS = 60
+
+PERCENTILES = [5, 25, 50, 75, 95]
+
+
+def generate_paths(df: pd.DataFrame, n_paths: int, horizon: int = 252, method: str = "bootstrap",
+                   block_size: int = 1, rng: Optional[np.random.Generator] = None) -> Dict[str, np.ndarray]:
+    """
+    Генерирует синтетические OHLCV траектории в виде массивов (horizon, n_paths)
+
+    Доходности берутся бутстрепом исторических дней (блоками по block_size дней) или из
+    геометрического броуновского движения с параметрами истории. Форма бара (Open/High/Low
+    относительно Close) и объем берутся из тех же случайно выбранных исторических дней.
+
+    Args:
+        df: Историческая OHLCV история
+        n_paths: Количество траекторий
+        horizon: Длина траекторий в барах
+        method: "bootstrap" или "gbm"
+        block_size: Длина блока для бутстрепа (1 - независимые дни)
+        rng: Генератор случайных чисел
+
+    Returns:
+        Словарь массивов Open, High, Low, Close, Volume формы (horizon, n_paths)
+    """
+    if method not in ("bootstrap", "gbm"):
+        raise ValueError(f"Unknown path generation method: {method}")
+    rng = rng or np.random.default_rng()
+
+    close = df['Close'].to_numpy(dtype=np.float64)
+    n_bars = len(close)
+    block_size = max(1, min(block_size, n_bars - 1))
+    if n_bars < WARMUP_BARS + 2:
+        raise ValueError(f"Not enough history ({n_bars} bars) for Monte Carlo simulation")
+
+    # Индексы исторических дней (начиная с 1, чтобы у каждого дня была доходность)
+    n_blocks = -(-horizon // block_size)
+    starts = rng.integers(1, n_bars - block_size + 1, size=(n_blocks, n_paths))
+    rows = (starts[:, None, :] + np.arange(block_size)[None, :, None]).reshape(-1, n_paths)[:horizon]
+
+    if method == "bootstrap":
+        returns = close[rows] / close[rows - 1] - 1.0
+    else:
+        log_returns = np.diff(np.log(close))
+        returns = np.expm1(log_returns.mean() + log_returns.std() * rng.standard_normal((horizon, n_paths)))
+
+    path_close = close[-1] * np.cumprod(1.0 + returns, axis=0)
+    return {
+        'Open': path_close * (df['Open'].to_numpy(dtype=np.float64) / close)[rows],
+        'High': path_close * (df['High'].to_numpy(dtype=np.float64) / close)[rows],
+        'Low': path_close * (df['Low'].to_numpy(dtype=np.float64) / close)[rows],
+        'Close': path_close,
+        'Volume': df['Volume'].to_numpy(dtype=np.float64)[rows],
+    }
+
+
+def panel_features(df: pd.DataFrame, paths: Dict[str, np.ndarray], dtype: str = "float64") -> np.ndarray:
+    """
+    Считает признаки модели сразу для всех траекторий
+
+    К каждой траектории спереди добавляются последние WARMUP_BARS реальных баров, затем
+    индикаторы считаются теми же create_features/add_indicators на панелях T x P.
+
+    Returns:
+        Массив признаков формы (horizon, n_paths, n_features) в порядке FEATURE_COLUMNS
+    """
+    horizon, n_paths = paths['Close'].shape
+    warmup = df.iloc[-WARMUP_BARS:]
+    panels = {
+        column: pd.DataFrame(np.vstack([
+            np.repeat(warmup[column].to_numpy(dtype=np.float64)[:, None], n_paths, axis=1),
+            values,
+        ]))
+        for column, values in paths.items()
+    }
+
+    data = create_features(panels)
+    # Lag-признаки, как в build_feature_matrix
+    for i in range(5):
+        data[f'Return_lag_{i+1}'] = data['Returns'].shift(i+1)
+
+    X = np.empty((horizon, n_paths, len(FEATURE_COLUMNS)), dtype=dtype)
+    for j, column in enumerate(FEATURE_COLUMNS):
+        X[:, :, j] = data[column].to_numpy()[WARMUP_BARS:]
+    return X
+
+
+def simulate_paths(df: pd.DataFrame, decision_agent: DecisionMakingAgent, n_paths: int,
+                   horizon: int = 252, method: str = "bootstrap", block_size: int = 1,
+                   initial_balance: float = 10000.0, trade_percentage: float = 0.1,
+                   sell_fraction: float = 0.5, seed=None, path_chunk: int = 250,
+                   dtype: str = "float64") -> pd.DataFrame:
+    """
+    Прогоняет политику на n_paths траекториях (один шард; выполняется в рабочем процессе)
+
+    Траектории обрабатываются блоками по path_chunk, чтобы ограничить память под признаки.
+
+    Returns:
+        DataFrame метрик по траекториям
+    """
+    rng = np.random.default_rng(seed)
+    results = []
+    for start in range(0, n_paths, path_chunk):
+        chunk_paths = min(path_chunk, n_paths - start)
+        paths = generate_paths(df, chunk_paths, horizon, method, block_size, rng)
+        X = panel_features(df, paths, dtype)
+
+        # Одно предсказание на все бары всех траекторий
+        X_flat = X.reshape(-1, X.shape[-1])
+        valid = np.isfinite(X_flat).all(axis=1)
+        raw = np.zeros(len(X_flat))
+        if valid.any():
+            raw[valid] = decision_agent.model.predict(X_flat[valid])
+
+        close = paths['Close']
+        predicted = decision_agent.sanitize_predictions(raw.reshape(close.shape), close)
+        # Бары с неполными признаками не торгуются (predicted = current -> HOLD)
+        predicted = np.where(valid.reshape(close.shape), predicted, close)
+        confidence = decision_agent.confidence_batch(close, predicted)
+        actions = decision_agent.decide_batch(close, predicted, confidence)
+
+        state = simulate_policy(close, actions, initial_balance, trade_percentage, sell_fraction)
+        final_equity = state["equity"][-1]
+        results.append(pd.DataFrame({
+            "final_equity": final_equity,
+            "pnl": final_equity - initial_balance,
+            "return_pct": (final_equity / initial_balance - 1) * 100,
+            "max_drawdown_pct": max_drawdown(state["equity"]) * 100,
+            "n_trades": np.count_nonzero(state["traded"], axis=0),
+            "n_buy_signals": (actions == BUY).sum(axis=0),
+            "n_sell_signals": (actions == SELL).sum(axis=0),
+            "buy_and_hold_return_pct": (close[-1] / close[0] - 1) * 100,
+        }))
+    return pd.concat(results, ignore_index=True)
+
+
+def summarize_paths(paths_df: pd.DataFrame) -> Dict:
+    """Распределения итогового P&L, просадки и количества сделок (процентили)"""
+    summary = {}
+    for column in ["pnl", "return_pct", "max_drawdown_pct", "n_trades", "buy_and_hold_return_pct"]:
+        values = paths_df[column].to_numpy(dtype=np.float64)
+        summary[column] = {
+            "mean": float(values.mean()),
+            "std": float(values.std()),
+            **{f"p{q}": float(v) for q, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))},
+        }
+    summary["prob_loss"] = float((paths_df["pnl"] < 0).mean())
+    summary["prob_beat_buy_and_hold"] = float(
+        (paths_df["return_pct"] > paths_df["buy_and_hold_return_pct"]).mean()
+    )
+    return summary
+
+
+def run_monte_carlo(ticker: str = "AAPL", decision_agent: Optional[DecisionMakingAgent] = None,
+                    df: Optional[pd.DataFrame] = None, period: str = "5y", n_paths: int = 1000,
+                    horizon: int = 252, method: str = "bootstrap", block_size: int = 1,
+                    initial_balance: float = 10000.0, trade_percentage: float = 0.1,
+                    sell_fraction: float = 0.5, n_shards: int = 1, seed: int = 42,
+                    path_chunk: int = 250, dtype: str = "float64") -> Tuple[pd.DataFrame, Dict]:
+    """
+    Monte Carlo стресс-тест торговой политики
+
+    Args:
+        ticker: Тикер (история используется для генерации траекторий)
+        decision_agent: Агент с загруженной моделью (если None, создается новый)
+        df: Историческая OHLCV история (если None, загружается за period)
+        period: Период истории для загрузки
+        n_paths: Количество траекторий
+        horizon: Длина траекторий в барах (252 - торговый год)
+        method: "bootstrap" (бутстреп исторических доходностей) или "gbm"
+        block_size: Длина блока для бутстрепа
+        initial_balance: Начальный баланс
+        trade_percentage: Доля баланса на одну покупку
+        sell_fraction: Доля акций на одну продажу
+        n_shards: Количество процессов, между которыми делятся траектории
+        seed: Seed (каждый шард получает независимый поток случайных чисел)
+        path_chunk: Количество траекторий, обрабатываемых за один блок
+        dtype: Тип данных признаков
+
+    Returns:
+        Кортеж (DataFrame метрик по траекториям, сводка распределений)
+    """
+    decision_agent = decision_agent or DecisionMakingAgent(dtype=dtype)
+    if decision_agent.model is None:
+        raise ValueError("Model is not loaded. Please train the model first.")
+    if df is None:
+        df = download_history(ticker, period)
+        if df.empty:
+            raise ValueError(f"No data available for {ticker}")
+
+    n_shards = max(1, min(n_shards, n_paths))
+    shard_sizes = [len(part) for part in np.array_split(np.arange(n_paths), n_shards)]
+    shard_seeds = np.random.SeedSequence(seed).spawn(n_shards)
+
+    started = time.perf_counter()
+    args = (horizon, method, block_size, initial_balance, trade_percentage, sell_fraction)
+    if n_shards == 1:
+        shards = [simulate_paths(df, decision_agent, n_paths, *args, seed=shard_seeds[0],
+                                 path_chunk=path_chunk, dtype=dtype)]
+    else:
+        shards = Parallel(n_jobs=n_shards, backend="loky")(
+            delayed(simulate_paths)(df, decision_agent, size, *args, seed=shard_seed,
+                                    path_chunk=path_chunk, dtype=dtype)
+            for size, shard_seed in zip(shard_sizes, shard_seeds)
+        )
+    wall_time = time.perf_counter() - started
+
+    paths_df = pd.concat(shards, ignore_index=True)
+    summary = summarize_paths(paths_df)
+    summary.update({
+        "ticker": ticker,
+        "method": method,
+        "n_paths": n_paths,
+        "horizon": horizon,
+        "n_shards": n_shards,
+        "wall_time": wall_time,
+    })
+    return paths_df, summary
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Monte Carlo stress test of the trading policy")
+    parser.add_argument("--ticker", default="AAPL")
+    parser.add_argument("--period", default="5y")
+    parser.add_argument("--model-path", default=None)
+    parser.add_argument("--n-paths", type=int, default=1000)
+    parser.add_argument("--horizon", type=int, default=252)
+    parser.add_argument("--method", default="bootstrap", choices=["bootstrap", "gbm"])
+    parser.add_argument("--block-size", type=int, default=1)
+    parser.add_argument("--n-shards", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    _, summary = run_monte_carlo(args.ticker, DecisionMakingAgent(args.model_path), period=args.period,
+                                 n_paths=args.n_paths, horizon=args.horizon, method=args.method,
+                                 block_size=args.block_size, n_shards=args.n_shards, seed=args.seed)
+    print(f"{summary['n_paths']} paths x {summary['horizon']} bars ({summary['method']}) "
+          f"in {summary['wall_time']:.1f}s")
+    for metric in ["pnl", "max_drawdown_pct", "n_trades"]:
+        stats = summary[metric]
+        print(f"{metric}: " + ", ".join(f"{k}={v:.2f}" for k, v in stats.items()))
+    print(f"P(loss)={summary['prob_loss']:.2%}, P(beat buy&hold)={summary['prob_beat_buy_and_hold']:.2%}")
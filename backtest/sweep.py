@@ -0,0 +1,204 @@
+"""
+Strategy parameter sweep
+Параллельный перебор порогов решения и размеров сделок на бэктесте по многим тикерам
+"""
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from typing import Dict, List, Optional, Tuple
+from sklearn.model_selection import ParameterGrid
+
+# Добавляем корневую директорию в путь (для запуска как скрипт)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.decision_agent import DecisionMakingAgent, BUY, SELL
+from backtest.engine import Backtester, simulate_policy, max_drawdown
+from models.train_model import download_history
+
+
+# Сетка параметров по умолчанию: правила DecisionMakingAgent.decide и размеры сделок ExecutionAgent
+SWEEP_GRID = {
+    "threshold": [0.005, 0.01, 0.02, 0.03, 0.05],
+    "low_confidence_multiplier": [1.0, 1.5, 2.0],
+    "high_confidence_multiplier": [0.6, 0.8, 1.0],
+    "min_abs_move": [0.0, 0.005, 0.01],
+    "trade_percentage": [0.05, 0.1, 0.2],
+    "sell_fraction": [0.25, 0.5, 1.0],
+}
+
+DECISION_PARAMS = ["threshold", "low_confidence_multiplier", "high_confidence_multiplier", "min_abs_move"]
+SIZING_PARAMS = ["trade_percentage", "sell_fraction"]
+
+
+def grid_to_columns(grid: Dict[str, List]) -> pd.DataFrame:
+    """
+    Разворачивает сетку в таблицу комбинаций (одна строка - одна комбинация)
+
+    Отсутствующие в сетке параметры берутся из значений по умолчанию агентов.
+    """
+    defaults = {
+        "threshold": 0.02, "low_confidence_multiplier": 1.5, "high_confidence_multiplier": 0.8,
+        "min_abs_move": 0.01, "trade_percentage": 0.1, "sell_fraction": 0.5,
+    }
+    unknown = set(grid) - set(defaults)
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {sorted(unknown)}")
+    full_grid = {name: grid.get(name, [value]) for name, value in defaults.items()}
+    return pd.DataFrame(list(ParameterGrid(full_grid)))[DECISION_PARAMS + SIZING_PARAMS]
+
+
+def sweep_signals(close: np.ndarray, predicted: np.ndarray, confidence: np.ndarray,
+                  combos: pd.DataFrame, decision_agent: DecisionMakingAgent,
+                  initial_balance: float = 10000.0, chunk_size: int = 2048) -> pd.DataFrame:
+    """
+    Оценивает все комбинации параметров на одном массиве предсказаний
+
+    Каждая комбинация - отдельный столбец матрицы действий (T, C); решения и симуляция
+    считаются сразу для блока из chunk_size комбинаций.
+
+    Args:
+        close: Цены закрытия (T,)
+        predicted: Предсказанные цены (T,)
+        confidence: Уверенность (T,)
+        combos: Таблица комбинаций (grid_to_columns)
+        decision_agent: Агент, правила которого используются (decide_batch)
+        initial_balance: Начальный баланс
+        chunk_size: Количество комбинаций в одном блоке
+
+    Returns:
+        DataFrame метрик по комбинациям (в порядке combos)
+    """
+    close_col, predicted_col, confidence_col = close[:, None], predicted[:, None], confidence[:, None]
+    rows = []
+    for start in range(0, len(combos), chunk_size):
+        chunk = combos.iloc[start:start + chunk_size]
+        actions = decision_agent.decide_batch(
+            close_col, predicted_col, confidence_col,
+            threshold=chunk["threshold"].to_numpy(),
+            low_confidence_multiplier=chunk["low_confidence_multiplier"].to_numpy(),
+            high_confidence_multiplier=chunk["high_confidence_multiplier"].to_numpy(),
+            min_abs_move=chunk["min_abs_move"].to_numpy(),
+        )
+        state = simulate_policy(close, actions, initial_balance,
+                                chunk["trade_percentage"].to_numpy(), chunk["sell_fraction"].to_numpy())
+        final_equity = state["equity"][-1]
+        rows.append(pd.DataFrame({
+            "final_equity": final_equity,
+            "total_return_pct": (final_equity / initial_balance - 1) * 100,
+            "max_drawdown_pct": max_drawdown(state["equity"]) * 100,
+            "n_trades": np.count_nonzero(state["traded"], axis=0),
+            "n_buy_signals": (actions == BUY).sum(axis=0),
+            "n_sell_signals": (actions == SELL).sum(axis=0),
+        }))
+    return pd.concat(rows, ignore_index=True)
+
+
+def sweep_ticker(ticker: str, combos: pd.DataFrame, decision_agent: DecisionMakingAgent,
+                 df: Optional[pd.DataFrame] = None, period: str = "10y",
+                 initial_balance: float = 10000.0) -> pd.DataFrame:
+    """
+    Перебор параметров для одного тикера (выполняется в рабочем процессе)
+
+    Предсказания модели считаются один раз и переиспользуются всеми комбинациями.
+    """
+    started = time.perf_counter()
+    if df is None:
+        df = download_history(ticker, period)
+        if df.empty:
+            raise ValueError(f"No data available for {ticker}")
+
+    signals = Backtester(decision_agent, initial_balance).compute_signals(df)
+    results = sweep_signals(signals["close"], signals["predicted"], signals["confidence"],
+                            combos, decision_agent, initial_balance)
+    results.insert(0, "combo", np.arange(len(combos)))
+    results.insert(0, "ticker", ticker)
+    results["buy_and_hold_return_pct"] = float(signals["close"][-1] / signals["close"][0] - 1) * 100
+    results["ticker_time"] = time.perf_counter() - started
+    return results
+
+
+def run_sweep(tickers: List[str], grid: Optional[Dict[str, List]] = None,
+              decision_agent: Optional[DecisionMakingAgent] = None, period: str = "10y",
+              histories: Optional[Dict[str, pd.DataFrame]] = None,
+              initial_balance: float = 10000.0, rank_by: str = "mean_return_pct",
+              n_jobs: int = -1) -> Tuple[pd.DataFrame, pd.DataFrame, Dict]:
+    """
+    Перебирает сетку параметров стратегии по тикерам параллельно
+
+    Args:
+        tickers: Список тикеров
+        grid: Сетка параметров (по умолчанию SWEEP_GRID)
+        decision_agent: Агент с загруженной моделью (если None, создается новый)
+        period: Период истории
+        histories: Уже загруженные истории {ticker: df} (иначе загружаются в рабочих процессах)
+        initial_balance: Начальный баланс
+        rank_by: Столбец сводной таблицы для сортировки (по убыванию)
+        n_jobs: Количество процессов (-1 - все ядра)
+
+    Returns:
+        Кортеж (сводная таблица комбинаций, отсортированная по rank_by;
+                результаты по тикерам; сводка перебора)
+    """
+    decision_agent = decision_agent or DecisionMakingAgent()
+    if decision_agent.model is None:
+        raise ValueError("Model is not loaded. Please train the model first.")
+
+    combos = grid_to_columns(grid or SWEEP_GRID)
+    histories = histories or {}
+
+    started = time.perf_counter()
+    per_ticker = Parallel(n_jobs=n_jobs, backend="loky")(
+        delayed(sweep_ticker)(ticker, combos, decision_agent, histories.get(ticker), period, initial_balance)
+        for ticker in tickers
+    )
+    wall_time = time.perf_counter() - started
+
+    per_ticker_df = pd.concat(per_ticker, ignore_index=True)
+    aggregated = per_ticker_df.groupby("combo").agg(
+        mean_return_pct=("total_return_pct", "mean"),
+        median_return_pct=("total_return_pct", "median"),
+        worst_return_pct=("total_return_pct", "min"),
+        mean_drawdown_pct=("max_drawdown_pct", "mean"),
+        worst_drawdown_pct=("max_drawdown_pct", "min"),
+        mean_trades=("n_trades", "mean"),
+    )
+    ranked = combos.join(aggregated).sort_values(rank_by, ascending=False)
+    ranked.insert(0, "rank", np.arange(1, len(ranked) + 1))
+    ranked.index.name = "combo"
+
+    best = ranked.iloc[0]
+    summary = {
+        "tickers": list(tickers),
+        "n_combinations": len(combos),
+        "n_backtests": len(per_ticker_df),
+        "rank_by": rank_by,
+        "best_params": {name: float(best[name]) for name in DECISION_PARAMS + SIZING_PARAMS},
+        "best_score": float(best[rank_by]),
+        "wall_time": wall_time,
+    }
+    return ranked, per_ticker_df, summary
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Parameter sweep for the trading policy")
+    parser.add_argument("--tickers", nargs="+", default=["AAPL"])
+    parser.add_argument("--period", default="10y")
+    parser.add_argument("--model-path", default=None)
+    parser.add_argument("--rank-by", default="mean_return_pct")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--output", default=None, help="CSV file for the ranked table")
+    args = parser.parse_args()
+
+    ranked, _, summary = run_sweep(args.tickers, decision_agent=DecisionMakingAgent(args.model_path),
+                                   period=args.period, rank_by=args.rank_by)
+    print(f"Evaluated {summary['n_combinations']} combinations x {len(args.tickers)} tickers "
+          f"in {summary['wall_time']:.1f}s")
+    print(f"Best params: {summary['best_params']} ({args.rank_by} {summary['best_score']:.2f})")
+    print(ranked.head(args.top).to_string())
+    if args.output:
+        ranked.to_csv(args.output)
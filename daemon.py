@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Trading Daemon
+Фоновый планировщик автоторговли: выполняет циклы агентов для активных сессий из БД
+независимо от веб-интерфейса (UI только включает/выключает сессии и читает результаты)
+"""
+import argparse
+import os
+import signal
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import yfinance as yf
+
+# Добавляем корневую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from agents.decision_agent import DecisionMakingAgent
+from agents.portfolio_coordinator import PortfolioCoordinator, split_batch
+from database.db_manager import DBManager, get_db_manager
+
+
+# Сколько последних решений держать в памяти (история хранится в cycle_results)
+DECISION_HISTORY_LIMIT = 1000
+
+
+class TradingDaemon:
+    """Планировщик циклов run_cycle для всех активных сессий автоторговли"""
+
+    def __init__(self, db_manager: Optional[DBManager] = None, sync_interval: float = 5.0,
+                 verbose: bool = False):
+        """
+        Инициализация демона
+
+        Args:
+            db_manager: Менеджер БД (сессии, портфели, результаты циклов)
+            sync_interval: Как часто перечитывать сессии из БД, сек
+            verbose: Печатать отладочную информацию агентов
+        """
+        self.db_manager = db_manager or get_db_manager()
+        self.sync_interval = sync_interval
+        # Модель загружается один раз и используется всеми сессиями
+        self.decision_agent = DecisionMakingAgent(verbose=verbose)
+        self.verbose = verbose
+        # {session_id: {"session", "coordinator", "next_due", "n_cycles", "saved_cycles"}}
+        self.sessions: Dict[int, Dict] = {}
+        # День последнего обслуживания снимков капитала
+        self.maintenance_day: Optional[str] = None
+        self._stop = threading.Event()
+
+    def sync_sessions(self):
+        """Подхватывает новые, измененные и остановленные в UI сессии"""
+        active = {row["id"]: row for row in self.db_manager.get_active_trading_sessions()}
+
+        for session_id in list(self.sessions):
+            if session_id not in active:
+                print(f"Session {session_id} stopped")
+                self._drop_session(session_id)
+
+        now = time.monotonic()
+        for session_id, row in active.items():
+            tickers = [t for t in row["tickers"].split(",") if t]
+            state = self.sessions.get(session_id)
+            # Перезапуск из UI сбрасывает n_cycles в БД - начинаем расписание заново
+            # (сравниваем с последним сохраненным значением: запись прогресса могла не пройти)
+            if state is not None and row["n_cycles"] < state["saved_cycles"]:
+                self._drop_session(session_id)
+                state = None
+            if state is None:
+                try:
+                    coordinator = PortfolioCoordinator(
+                        tickers, user_id=row["user_id"], db_manager=self.db_manager,
+                        verbose=self.verbose, decision_agent=self.decision_agent
+                    )
+                except ValueError as e:
+                    print(f"Session {session_id} skipped: {e}")
+                    continue
+                self.sessions[session_id] = {
+                    "session": row,
+                    "coordinator": coordinator,
+                    "next_due": now,
+                    "n_cycles": row["n_cycles"],
+                    "saved_cycles": row["n_cycles"]
+                }
+                print(f"Session {session_id} started for user {row['user_id']}: "
+                      f"{', '.join(tickers)} every {row['interval_seconds']:g}s")
+            else:
+                if tickers != state["coordinator"].tickers:
+                    state["coordinator"].set_watchlist(tickers)
+                state["session"] = row
+
+    def _drop_session(self, session_id: int):
+        state = self.sessions.pop(session_id)
+        state["coordinator"].close()
+
+    def run_due(self):
+        """Выполняет циклы сессий, время которых наступило"""
+        for session_id in list(self.sessions):
+            if self._stop.is_set():
+                return
+            if self.sessions[session_id]["next_due"] <= time.monotonic():
+                self.run_session_cycle(session_id)
+
+    def run_session_cycle(self, session_id: int) -> Dict:
+        """
+        Выполняет один цикл сессии, сохраняет результат и планирует следующий
+
+        Ошибка сессии (например, БД заблокирована другим процессом) записывается в лог,
+        а следующий цикл планируется как обычно - остальные сессии и демон продолжают работу.
+
+        Returns:
+            Результат PortfolioCoordinator.run_cycle
+        """
+        state = self.sessions[session_id]
+        session, coordinator = state["session"], state["coordinator"]
+        interval = float(session["interval_seconds"])
+
+        started = time.perf_counter()
+        try:
+            # Портфель мог измениться вне демона (ручной цикл или сброс в UI)
+            coordinator.execution_agent.refresh()
+            result = coordinator.run_cycle()
+            completed = True
+        except Exception as e:
+            print(f"Session {session_id}: error in cycle: {e}")
+            result = {
+                "status": "error",
+                "message": f"Error in session cycle: {str(e)}",
+                "timestamp": datetime.now().isoformat()
+            }
+            completed = False
+        duration_ms = (time.perf_counter() - started) * 1000
+        if completed:
+            state["n_cycles"] += 1
+        if len(self.decision_agent.decision_history) > DECISION_HISTORY_LIMIT:
+            del self.decision_agent.decision_history[:-DECISION_HISTORY_LIMIT]
+
+        # Расписание по монотонным часам без накопления дрейфа; пропущенные интервалы
+        # (цикл длиннее интервала) не догоняются пачкой
+        now = time.monotonic()
+        state["next_due"] += interval
+        if state["next_due"] <= now:
+            missed = int((now - state["next_due"]) // interval) + 1
+            state["next_due"] += missed * interval
+            print(f"Session {session_id}: cycle took {duration_ms:.0f} ms, skipped {missed} interval(s)")
+
+        finished = session["max_cycles"] is not None and state["n_cycles"] >= session["max_cycles"]
+        timestamp = datetime.now()
+        next_cycle_at = None if finished else timestamp + timedelta(seconds=state["next_due"] - now)
+
+        try:
+            if completed:
+                self.db_manager.add_cycle_results(self.result_rows(session, state["n_cycles"], result, duration_ms))
+            self.db_manager.record_session_cycle(
+                session_id, state["n_cycles"], timestamp.isoformat(),
+                next_cycle_at.isoformat() if next_cycle_at else None,
+                status="finished" if finished else "active",
+                last_error=result.get("message") if result.get("status") == "error" else None
+            )
+            state["saved_cycles"] = state["n_cycles"]
+        except Exception as e:
+            print(f"Session {session_id}: error saving cycle {state['n_cycles']}: {e}")
+        if finished:
+            print(f"Session {session_id} finished after {state['n_cycles']} cycles")
+            self._drop_session(session_id)
+        return result
+
+    @staticmethod
+    def result_rows(session: Dict, cycle: int, result: Dict, duration_ms: float) -> List[Dict]:
+        """Строки cycle_results для результата цикла (по строке на тикер)"""
+        base = {
+            "session_id": session["id"],
+            "user_id": session["user_id"],
+            "cycle": cycle,
+            "timestamp": result.get("timestamp") or datetime.now().isoformat(),
+            "portfolio_value": result.get("portfolio", {}).get("portfolio_value"),
+            "duration_ms": duration_ms
+        }
+        if not result.get("tickers"):
+            return [{**base, "ticker": session["tickers"], "status": "error", "message": result.get("message")}]
+
+        rows = []
+        for ticker, ticker_result in result["tickers"].items():
+            row = {**base, "ticker": ticker, "status": ticker_result["status"]}
+            if ticker_result["status"] == "success":
+                row.update({
+                    "action": ticker_result["decision"]["action"],
+                    "current_price": ticker_result["market_data"]["current_price"],
+                    "predicted_price": ticker_result["decision"]["predicted_price"],
+                    "confidence": ticker_result["decision"]["confidence"],
+                    "execution_status": ticker_result["execution"]["status"],
+                    "message": ticker_result["execution"]["message"]
+                })
+            else:
+                row["message"] = ticker_result.get("message")
+            rows.append(row)
+        return rows
+
+    def closing_prices(self, day: str) -> Dict[str, float]:
+        """
+        Цены закрытия дня для тикеров из портфелей пользователей (одним запросом)
+
+        Args:
+            day: День (YYYY-MM-DD); для выходных берется последний торговый день до него
+
+        Returns:
+            {ticker: цена закрытия}; тикеры без данных пропускаются
+        """
+        tickers = self.db_manager.get_held_tickers()
+        if not tickers:
+            return {}
+        end = datetime.strptime(day, "%Y-%m-%d") + timedelta(days=1)
+        try:
+            data = yf.download(tickers, start=end - timedelta(days=7), end=end, interval="1d",
+                               group_by="ticker", auto_adjust=True, progress=False, threads=True)
+        except Exception as e:
+            print(f"Error fetching closing prices for {day}: {e}")
+            return {}
+        return {ticker: float(frame["Close"].iloc[-1]) for ticker, frame in split_batch(data, tickers).items()}
+
+    def run_maintenance(self):
+        """
+        Ежедневное обслуживание: дневные снимки капитала без пропусков и удаление старых снимков
+
+        Закончившийся день заполняется для пользователей без активности по ценам его закрытия.
+        """
+        now = datetime.now()
+        day = (now - timedelta(days=1)).strftime("%Y-%m-%d")
+        try:
+            carried = self.db_manager.carry_forward_equity_snapshots(day, self.closing_prices(day))
+            pruned = self.db_manager.prune_equity_snapshots(now)
+            print(f"Equity snapshots for {day}: carried forward {carried}, pruned {pruned}")
+        except Exception as e:
+            print(f"Error in daily maintenance: {e}")
+        self.maintenance_day = now.strftime("%Y-%m-%d")
+
+    def run(self, max_seconds: Optional[float] = None):
+        """
+        Основной цикл: ждет ближайшего цикла сессии или пересинхронизации с БД
+
+        Args:
+            max_seconds: Ограничение времени работы (None - до stop())
+        """
+        deadline = None if max_seconds is None else time.monotonic() + max_seconds
+        last_sync = None
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                break
+            if last_sync is None or now - last_sync >= self.sync_interval:
+                try:
+                    self.sync_sessions()
+                except Exception as e:
+                    print(f"Error syncing sessions: {e}")
+                last_sync = now
+                if self.maintenance_day != datetime.now().strftime("%Y-%m-%d"):
+                    self.run_maintenance()
+            self.run_due()
+
+            wake_at = min([state["next_due"] for state in self.sessions.values()] +
+                          [last_sync + self.sync_interval] +
+                          ([deadline] if deadline is not None else []))
+            self._stop.wait(max(0.0, wake_at - time.monotonic()))
+
+    def stop(self):
+        """Останавливает основной цикл (безопасно из обработчика сигнала)"""
+        self._stop.set()
+
+    def close(self):
+        for session_id in list(self.sessions):
+            self._drop_session(session_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless trading daemon")
+    parser.add_argument("--db-path", default=None, help="SQLite database path (default: data/trading_system.db)")
+    parser.add_argument("--sync-interval", type=float, default=5.0,
+                        help="How often to reload trading sessions from the database, seconds")
+    parser.add_argument("--verbose", action="store_true", help="Print agent debug output")
+    args = parser.parse_args()
+
+    daemon = TradingDaemon(get_db_manager(args.db_path), sync_interval=args.sync_interval, verbose=args.verbose)
+    signal.signal(signal.SIGINT, lambda *_: daemon.stop())
+    signal.signal(signal.SIGTERM, lambda *_: daemon.stop())
+
+    print("=" * 50)
+    print("Trading daemon started (Ctrl+C to stop)")
+    print("=" * 50)
+    try:
+        daemon.run()
+    finally:
+        daemon.close()
+        print("Trading daemon stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 """
 Database module for Multi-Agent Trading System
 """
-from .db_manager import DBManager
+from .db_manager import DBManager, get_db_manager
 
-__all__ = ['DBManager']
+__all__ = ['DBManager', 'get_db_manager']
 
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Bulk Import
+Перенос историй режима без БД (data/history_*.csv) в SQLite: сделки, баланс и холдинги
+загружаются пакетами через executemany, по транзакции на пакет пользователей
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from typing import Dict, List, Optional
+
+# Добавляем корневую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.trade_journal import TradeJournal, replay_trades
+from database.db_manager import DBManager, get_db_manager
+
+
+HISTORY_FILE_PATTERN = re.compile(r"^history_(\d+)\.csv$")
+
+
+def find_history_files(data_dir: str) -> Dict[int, str]:
+    """Файлы журналов в директории: {user_id: путь}"""
+    files = {}
+    for name in sorted(os.listdir(data_dir)):
+        match = HISTORY_FILE_PATTERN.match(name)
+        if match:
+            files[int(match.group(1))] = os.path.join(data_dir, name)
+    return files
+
+
+def load_history_file(user_id: int, data_dir: str, initial_balance: float = 10000.0) -> Dict:
+    """
+    Читает журнал пользователя и восстанавливает итоговый портфель
+
+    Журнал читается один раз (без снимка, только чтение - файлы в data_dir не меняются);
+    состояние считается той же replay_trades, что и при запуске ExecutionAgent без БД.
+
+    Returns:
+        Словарь для DBManager.import_portfolios
+    """
+    journal = TradeJournal(os.path.join(data_dir, f"history_{user_id}.csv"))
+    _, trades = journal.load(use_snapshot=False)
+    balance, portfolio = replay_trades(trades, initial_balance, {})
+    return {
+        "user_id": user_id,
+        "initial_balance": initial_balance,
+        "balance": balance,
+        "holdings": portfolio,
+        "trades": trades
+    }
+
+
+def migrate_history_files(db_manager: DBManager, data_dir: str = "data", initial_balance: float = 10000.0,
+                          replace: bool = False, batch_size: int = 500,
+                          user_ids: Optional[List[int]] = None) -> Dict:
+    """
+    Переносит журналы data/history_*.csv в БД
+
+    Args:
+        db_manager: Менеджер БД
+        data_dir: Директория с журналами
+        initial_balance: Начальный баланс, с которого воспроизводятся журналы
+        replace: Перезаписать историю пользователей, у которых уже есть сделки в БД
+            (иначе такие пользователи пропускаются, повторный запуск ничего не дублирует)
+        batch_size: Пользователей в одной транзакции
+        user_ids: Переносить только этих пользователей
+
+    Returns:
+        Статистика: users, trades, skipped, errors
+    """
+    files = find_history_files(data_dir)
+    known_users = db_manager.get_user_ids()
+    users_with_trades = set() if replace else db_manager.get_user_ids(with_trades=True)
+    stats = {"users": 0, "trades": 0, "skipped": 0, "errors": 0}
+
+    batch = []
+    for user_id, path in files.items():
+        if user_ids is not None and user_id not in user_ids:
+            continue
+        if user_id not in known_users or user_id in users_with_trades:
+            stats["skipped"] += 1
+            continue
+        try:
+            batch.append(load_history_file(user_id, data_dir, initial_balance))
+        except Exception as e:
+            print(f"Error reading {path}: {e}")
+            stats["errors"] += 1
+            continue
+        if len(batch) >= batch_size:
+            stats["trades"] += db_manager.import_portfolios(batch, replace=replace)
+            stats["users"] += len(batch)
+            batch = []
+    if batch:
+        stats["trades"] += db_manager.import_portfolios(batch, replace=replace)
+        stats["users"] += len(batch)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import file-mode trade histories (history_*.csv) into SQLite")
+    parser.add_argument("--data-dir", default="data", help="Directory with history_<user_id>.csv files")
+    parser.add_argument("--db-path", default=None, help="SQLite database path (default: data/trading_system.db)")
+    parser.add_argument("--initial-balance", type=float, default=10000.0,
+                        help="Starting balance the journals are replayed from")
+    parser.add_argument("--replace", action="store_true",
+                        help="Overwrite trade history of users that already have trades in the database")
+    parser.add_argument("--batch-size", type=int, default=500, help="Users per transaction")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    stats = migrate_history_files(get_db_manager(args.db_path), args.data_dir, args.initial_balance,
+                                  replace=args.replace, batch_size=args.batch_size)
+    print(f"Imported {stats['trades']} trades for {stats['users']} users in "
+          f"{time.perf_counter() - started:.1f}s (skipped {stats['skipped']}, errors {stats['errors']})")
+
+
+if __name__ == "__main__":
+    main()
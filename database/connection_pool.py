@@ -0,0 +1,157 @@
+"""
+Connection Pool
+Пул соединений SQLite: одно долгоживущее соединение на поток, WAL и настроенные PRAGMA
+"""
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+
+# PRAGMA каждого нового соединения
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",      # читатели не ждут завершения записи (и наоборот)
+    "synchronous": "NORMAL",    # в WAL безопасно при падении процесса; fsync только при checkpoint
+    "cache_size": -16000,       # 16 МБ страничного кэша (отрицательное значение - в КБ)
+    "mmap_size": 134217728,     # 128 МБ memory-mapped чтения
+    "temp_store": "MEMORY",
+}
+
+# Сколько ждать освобождения блокировки другим соединением/процессом, сек
+BUSY_TIMEOUT = 5.0
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    Соединение из пула
+
+    Поток получает одно и то же соединение при каждом обращении к пулу, поэтому выдачи
+    вложены: depth - глубина вложенности. Вложенные commit() не фиксируют транзакцию
+    (это делает внешняя единица работы), а close() возвращает соединение в пул и откатывает
+    незавершенную транзакцию только на внешнем уровне.
+    """
+
+    pool: Optional["ConnectionPool"] = None
+    depth = 0
+    # Вложенный уровень откатил транзакцию - внешний commit() не должен фиксировать остаток
+    rollback_only = False
+
+    def commit(self):
+        if self.depth > 1:
+            return
+        if self.rollback_only:
+            self.rollback()
+            raise sqlite3.OperationalError("Transaction was rolled back by a nested unit of work")
+        super().commit()
+
+    def rollback(self):
+        super().rollback()
+        self.rollback_only = self.depth > 1
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+            return
+        self.depth = max(self.depth - 1, 0)
+        if self.depth > 0:
+            return
+        if self.in_transaction:
+            super().rollback()
+        self.rollback_only = False
+        self.pool.release(self)
+
+    def _close(self):
+        """Закрывает соединение по-настоящему"""
+        super().close()
+
+
+class ConnectionPool:
+    """Пул соединений: по одному на поток (sqlite3 не разделяет соединение между потоками)"""
+
+    def __init__(self, db_path: str, timeout: float = BUSY_TIMEOUT, pragmas: Optional[Dict] = None):
+        """
+        Инициализация пула
+
+        Args:
+            db_path: Путь к файлу БД
+            timeout: busy timeout, сек
+            pragmas: PRAGMA новых соединений (по умолчанию DEFAULT_PRAGMAS)
+        """
+        self.db_path = db_path
+        self.timeout = timeout
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Соединение закрывается вместе с потоком-владельцем; здесь - только слабые ссылки
+        self._connections = weakref.WeakSet()
+        self.stats = {"opened": 0, "checkouts": 0, "returns": 0, "reused": 0, "nested": 0}
+
+    def _open(self) -> PooledConnection:
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, factory=PooledConnection,
+                               check_same_thread=False)
+        conn.row_factory = sqlite3.Row  # Для доступа по имени колонок
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        conn.pool = self
+        return conn
+
+    def connect(self) -> PooledConnection:
+        """
+        Выдает соединение текущего потока (открывает при первом обращении)
+
+        Каждая выдача должна завершиться close(); надежнее - через checkout().
+        """
+        conn = getattr(self._local, "conn", None)
+        with self._lock:
+            if conn is None:
+                conn = self._open()
+                self._local.conn = conn
+                self._connections.add(conn)
+                self.stats["opened"] += 1
+            elif conn.depth == 0:
+                self.stats["reused"] += 1
+            if conn.depth == 0:
+                self.stats["checkouts"] += 1
+            else:
+                self.stats["nested"] += 1
+            conn.depth += 1
+        return conn
+
+    @contextmanager
+    def checkout(self) -> Iterator[PooledConnection]:
+        """
+        Соединение текущего потока на время блока with
+
+        Соединение возвращается в пул в finally: незавершенная транзакция откатывается
+        (и не держит блокировку записи WAL), даже если блок прерван исключением.
+        """
+        conn = self.connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def release(self, conn: PooledConnection):
+        """Возврат соединения (вызывается из PooledConnection.close на внешнем уровне)"""
+        with self._lock:
+            self.stats["returns"] += 1
+
+    def get_stats(self) -> Dict:
+        """Статистика пула: открыто и занято соединений, выдачи, вложенные выдачи, возвраты"""
+        with self._lock:
+            stats = dict(self.stats)
+            connections = list(self._connections)
+        stats["open_connections"] = len(connections)
+        # Занято - соединения, выданные и еще не возвращенные (depth > 0)
+        stats["in_use"] = sum(1 for conn in connections if conn.depth > 0)
+        return stats
+
+    def close_all(self):
+        """Закрывает все соединения пула"""
+        with self._lock:
+            connections = list(self._connections)
+            self._connections = weakref.WeakSet()
+            self._local = threading.local()
+        for conn in connections:
+            conn._close()
@@ -4,11 +4,43 @@ Database Manager with SQLite
 """
 import sqlite3
 import os
+import threading
+from contextlib import contextmanager
 import pandas as pd
-from typing import Optional, Dict, List
-from datetime import datetime
+from typing import Optional, Dict, List, Tuple
+from datetime import datetime, timedelta
 import json
 
+from .connection_pool import ConnectionPool
+from .migrations import REALIZED_PNL_UPDATE, migrate
+
+
+# Пути БД, схема которых уже проверена в этом процессе
+_initialized_paths = set()
+_initialized_lock = threading.Lock()
+# Общие экземпляры DBManager по пути БД (см. get_db_manager)
+_shared_managers: Dict[str, "DBManager"] = {}
+
+# Пакетная вставка сделок (import_trades); realized_pnl пересчитывается после вставки
+_INSERT_TRADE_SQL = """
+    INSERT INTO trade_history
+    (user_id, timestamp, ticker, action, shares, price, total, balance_after, confidence)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Гранулярности кривой капитала: формат начала интервала (bucket)
+EQUITY_GRANULARITIES = {
+    "minute": "%Y-%m-%dT%H:%M:00",
+    "hour": "%Y-%m-%dT%H:00:00",
+    "day": "%Y-%m-%d",
+}
+# Сколько хранить снимки каждой гранулярности (None - бессрочно)
+EQUITY_RETENTION = {
+    "minute": timedelta(days=2),
+    "hour": timedelta(days=90),
+    "day": None,
+}
+
 
 class DBManager:
     """Управление базой данных SQLite"""
@@ -35,78 +67,63 @@ class DBManager:
         else:
             self.db_path = db_path
         
-        # Инициализируем БД
-        self.init_database()
+        # Соединения переиспользуются в пределах потока (WAL, busy timeout)
+        self.pool = ConnectionPool(self.db_path)
+        
+        # Схема проверяется и мигрируется один раз на процесс для каждого файла БД
+        # (повторно - только если файл удален, например во временной директории)
+        db_key = os.path.abspath(self.db_path)
+        with _initialized_lock:
+            if db_key not in _initialized_paths or not os.path.exists(self.db_path):
+                self.init_database()
+                _initialized_paths.add(db_key)
     
     def get_connection(self):
-        """Получает соединение с БД"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row  # Для доступа по имени колонок
-        return conn
+        """Получает соединение с БД из пула (close() возвращает его в пул)"""
+        return self.pool.connect()
     
-    def init_database(self):
-        """Инициализирует таблицы БД"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Таблица пользователей
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                email TEXT,
-                password_hash TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Таблица портфелей
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS portfolios (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                balance REAL DEFAULT 10000.0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                UNIQUE(user_id)
-            )
-        """)
-        
-        # Таблица холдингов (акции в портфеле)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS holdings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                ticker TEXT NOT NULL,
-                shares INTEGER NOT NULL,
-                avg_price REAL NOT NULL,
-                total_cost REAL NOT NULL,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                UNIQUE(user_id, ticker)
-            )
-        """)
-        
-        # Таблица истории торгов
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS trade_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                timestamp TEXT NOT NULL,
-                ticker TEXT NOT NULL,
-                action TEXT NOT NULL,
-                shares INTEGER NOT NULL,
-                price REAL NOT NULL,
-                total REAL NOT NULL,
-                balance_after REAL NOT NULL,
-                confidence REAL,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-        """)
+    def connection(self):
+        """
+        Соединение из пула на время блока with (возвращается в пул в finally)
         
-        conn.commit()
-        conn.close()
+        Вызовы DBManager внутри transaction() используют то же соединение и не фиксируют
+        и не откатывают внешнюю транзакцию.
+        """
+        return self.pool.checkout()
+    
+    def get_pool_stats(self) -> Dict:
+        """Статистика пула соединений"""
+        return self.pool.get_stats()
+    
+    def close(self):
+        """Закрывает все соединения пула"""
+        self.pool.close_all()
+    
+    @contextmanager
+    def transaction(self):
+        """
+        Единица работы: все запросы внутри блока выполняются на одном соединении
+        и фиксируются одним commit (при исключении - rollback)
+        
+        Пример:
+            with db_manager.transaction() as conn:
+                conn.execute(...)
+                conn.execute(...)
+        """
+        with self.connection() as conn:
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    
+    def init_database(self):
+        """Применяет недостающие миграции схемы (см. database/migrations.py)"""
+        with self.connection() as conn:
+            applied = migrate(conn)
+        if applied:
+            print(f"Database schema migrated to version {applied[-1]}: {self.db_path}")
     
     # ========== User Management ==========
     
@@ -117,30 +134,27 @@ class DBManager:
         Returns:
             ID созданного пользователя или None
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute("""
-                INSERT INTO users (username, password_hash, email)
-                VALUES (?, ?, ?)
-            """, (username, password_hash, email))
-            conn.commit()
-            user_id = cursor.lastrowid
-            conn.close()
-            return user_id
-        except sqlite3.IntegrityError:
-            conn.close()
-            return None
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            try:
+                cursor.execute("""
+                    INSERT INTO users (username, password_hash, email)
+                    VALUES (?, ?, ?)
+                """, (username, password_hash, email))
+                conn.commit()
+                user_id = cursor.lastrowid
+                return user_id
+            except sqlite3.IntegrityError:
+                return None
     
     def get_user_by_username(self, username: str) -> Optional[Dict]:
         """Получает пользователя по username"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-        row = cursor.fetchone()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
+            row = cursor.fetchone()
         
         if row:
             return dict(row)
@@ -148,12 +162,11 @@ class DBManager:
     
     def get_user_by_id(self, user_id: int) -> Optional[Dict]:
         """Получает пользователя по ID"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        row = cursor.fetchone()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+            row = cursor.fetchone()
         
         if row:
             return dict(row)
@@ -163,29 +176,26 @@ class DBManager:
     
     def create_portfolio(self, user_id: int, initial_balance: float = 10000.0) -> bool:
         """Создает портфель для пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute("""
-                INSERT INTO portfolios (user_id, balance)
-                VALUES (?, ?)
-            """, (user_id, initial_balance))
-            conn.commit()
-            conn.close()
-            return True
-        except sqlite3.IntegrityError:
-            conn.close()
-            return False
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            try:
+                cursor.execute("""
+                    INSERT INTO portfolios (user_id, balance, initial_balance)
+                    VALUES (?, ?, ?)
+                """, (user_id, initial_balance, initial_balance))
+                conn.commit()
+                return True
+            except sqlite3.IntegrityError:
+                return False
     
     def get_portfolio(self, user_id: int) -> Optional[Dict]:
         """Получает портфель пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM portfolios WHERE user_id = ?", (user_id,))
-        row = cursor.fetchone()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT * FROM portfolios WHERE user_id = ?", (user_id,))
+            row = cursor.fetchone()
         
         if row:
             return dict(row)
@@ -193,122 +203,743 @@ class DBManager:
     
     def update_portfolio_balance(self, user_id: int, new_balance: float) -> bool:
         """Обновляет баланс портфеля"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            UPDATE portfolios 
-            SET balance = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE user_id = ?
-        """, (new_balance, user_id))
-        
-        conn.commit()
-        success = cursor.rowcount > 0
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                UPDATE portfolios 
+                SET balance = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE user_id = ?
+            """, (new_balance, user_id))
+            
+            conn.commit()
+            success = cursor.rowcount > 0
         return success
     
+    def reset_portfolio(self, user_id: int, balance: float) -> bool:
+        """Сбрасывает портфель одной транзакцией: удаляет все холдинги и устанавливает баланс"""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM holdings WHERE user_id = ?", (user_id,))
+            cursor = conn.execute("""
+                UPDATE portfolios 
+                SET balance = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE user_id = ?
+            """, (balance, user_id))
+            return cursor.rowcount > 0
+    
     def get_holdings(self, user_id: int) -> List[Dict]:
         """Получает все холдинги пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT * FROM holdings WHERE user_id = ?
-        """, (user_id,))
-        
-        rows = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                SELECT * FROM holdings WHERE user_id = ?
+            """, (user_id,))
+            
+            rows = cursor.fetchall()
         
         return [dict(row) for row in rows]
     
     def update_holding(self, user_id: int, ticker: str, shares: int, 
                       avg_price: float, total_cost: float) -> bool:
         """Обновляет или создает холдинг"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Проверяем, существует ли холдинг
-        cursor.execute("""
-            SELECT * FROM holdings WHERE user_id = ? AND ticker = ?
-        """, (user_id, ticker))
-        
-        existing = cursor.fetchone()
-        
-        if existing:
-            # Обновляем существующий
-            cursor.execute("""
-                UPDATE holdings 
-                SET shares = ?, avg_price = ?, total_cost = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE user_id = ? AND ticker = ?
-            """, (shares, avg_price, total_cost, user_id, ticker))
-        else:
-            # Создаем новый
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            # Проверяем, существует ли холдинг
             cursor.execute("""
-                INSERT INTO holdings (user_id, ticker, shares, avg_price, total_cost)
-                VALUES (?, ?, ?, ?, ?)
-            """, (user_id, ticker, shares, avg_price, total_cost))
-        
-        conn.commit()
-        conn.close()
+                SELECT * FROM holdings WHERE user_id = ? AND ticker = ?
+            """, (user_id, ticker))
+            
+            existing = cursor.fetchone()
+            
+            if existing:
+                # Обновляем существующий
+                cursor.execute("""
+                    UPDATE holdings 
+                    SET shares = ?, avg_price = ?, total_cost = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE user_id = ? AND ticker = ?
+                """, (shares, avg_price, total_cost, user_id, ticker))
+            else:
+                # Создаем новый
+                cursor.execute("""
+                    INSERT INTO holdings (user_id, ticker, shares, avg_price, total_cost)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (user_id, ticker, shares, avg_price, total_cost))
+            
+            conn.commit()
         return True
     
     def delete_holding(self, user_id: int, ticker: str) -> bool:
         """Удаляет холдинг"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            DELETE FROM holdings WHERE user_id = ? AND ticker = ?
-        """, (user_id, ticker))
-        
-        conn.commit()
-        success = cursor.rowcount > 0
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                DELETE FROM holdings WHERE user_id = ? AND ticker = ?
+            """, (user_id, ticker))
+            
+            conn.commit()
+            success = cursor.rowcount > 0
         return success
     
     # ========== Trade History ==========
     
     def add_trade(self, user_id: int, ticker: str, action: str, 
                   shares: int, price: float, total: float, 
-                  balance_after: float, confidence: float = 0.0) -> bool:
-        """Добавляет сделку в историю"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO trade_history 
-            (user_id, timestamp, ticker, action, shares, price, total, balance_after, confidence)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (user_id, datetime.now().isoformat(), ticker, action, shares, 
-              price, total, balance_after, confidence))
-        
-        conn.commit()
-        conn.close()
+                  balance_after: float, confidence: float = 0.0,
+                  timestamp: Optional[str] = None) -> bool:
+        """Добавляет сделку в историю (timestamp по умолчанию - текущее время)"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                INSERT INTO trade_history 
+                (user_id, timestamp, ticker, action, shares, price, total, balance_after, confidence)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (user_id, timestamp or datetime.now().isoformat(), ticker, action, shares, 
+                  price, total, balance_after, confidence))
+            
+            conn.commit()
+        return True
+    
+    def record_trade(self, user_id: int, ticker: str, action: str,
+                     shares: int, price: float, total: float,
+                     balance_after: float, holding_shares: int,
+                     avg_price: float, total_cost: float,
+                     confidence: float = 0.0, timestamp: Optional[str] = None) -> bool:
+        """
+        Записывает сделку одной транзакцией: история, холдинг и баланс
+        
+        Реализованный P&L продажи считается здесь же по средней цене холдинга до сделки,
+        поэтому сводки по сделкам суммируют готовую колонку realized_pnl.
+        
+        Args:
+            holding_shares: Количество акций тикера после сделки (0 - холдинг удаляется)
+            avg_price: Средняя цена холдинга после сделки
+            total_cost: Стоимость холдинга после сделки
+        """
+        with self.transaction() as conn:
+            realized_pnl = 0.0
+            if action == "SELL":
+                holding = conn.execute("""
+                    SELECT shares, total_cost FROM holdings WHERE user_id = ? AND ticker = ? AND shares > 0
+                """, (user_id, ticker)).fetchone()
+                if holding is not None:
+                    realized_pnl = total - holding["total_cost"] * min(shares, holding["shares"]) / holding["shares"]
+            
+            conn.execute("""
+                INSERT INTO trade_history 
+                (user_id, timestamp, ticker, action, shares, price, total, balance_after, confidence, realized_pnl)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (user_id, timestamp or datetime.now().isoformat(), ticker, action, shares,
+                  price, total, balance_after, confidence, realized_pnl))
+            
+            if holding_shares > 0:
+                conn.execute("""
+                    INSERT INTO holdings (user_id, ticker, shares, avg_price, total_cost)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(user_id, ticker) DO UPDATE SET
+                        shares = excluded.shares,
+                        avg_price = excluded.avg_price,
+                        total_cost = excluded.total_cost,
+                        updated_at = CURRENT_TIMESTAMP
+                """, (user_id, ticker, holding_shares, avg_price, total_cost))
+            else:
+                conn.execute("""
+                    DELETE FROM holdings WHERE user_id = ? AND ticker = ?
+                """, (user_id, ticker))
+            
+            conn.execute("""
+                UPDATE portfolios 
+                SET balance = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE user_id = ?
+            """, (balance_after, user_id))
         return True
     
+    @staticmethod
+    def _trade_rows(user_id: int, trades: List[Dict]) -> List[Tuple]:
+        return [
+            (user_id, str(trade["timestamp"]), trade["ticker"], trade["action"], int(trade["shares"]),
+             float(trade["price"]), float(trade["total"]), float(trade["balance_after"]),
+             float(trade.get("confidence") or 0.0))
+            for trade in trades
+        ]
+    
+    def import_trades(self, user_id: int, trades: List[Dict]) -> int:
+        """
+        Загружает пакет сделок в историю одной транзакцией (executemany)
+        
+        Реализованный P&L пользователя пересчитывается по всей его истории.
+        
+        Args:
+            user_id: ID пользователя
+            trades: Сделки с полями timestamp, ticker, action, shares, price, total,
+                balance_after, confidence (как в CSV журнале)
+        
+        Returns:
+            Количество загруженных сделок
+        """
+        rows = self._trade_rows(user_id, trades)
+        with self.transaction() as conn:
+            conn.executemany(_INSERT_TRADE_SQL, rows)
+            conn.execute(REALIZED_PNL_UPDATE.format(user_filter="user_id = ?"), (user_id,))
+        return len(rows)
+    
+    def import_portfolios(self, portfolios: List[Dict], replace: bool = False) -> int:
+        """
+        Загружает портфели вместе с историей сделок одной транзакцией
+        
+        Args:
+            portfolios: Словари user_id, initial_balance, balance, holdings
+                ({ticker: {"shares", "avg_price", "total_cost"}}), trades
+            replace: Удалить существующую историю сделок пользователей перед загрузкой
+        
+        Returns:
+            Количество загруженных сделок
+        """
+        n_trades = 0
+        with self.transaction() as conn:
+            for portfolio in portfolios:
+                user_id = portfolio["user_id"]
+                if replace:
+                    conn.execute("DELETE FROM trade_history WHERE user_id = ?", (user_id,))
+                trade_rows = self._trade_rows(user_id, portfolio["trades"])
+                conn.executemany(_INSERT_TRADE_SQL, trade_rows)
+                conn.execute(REALIZED_PNL_UPDATE.format(user_filter="user_id = ?"), (user_id,))
+                n_trades += len(trade_rows)
+                
+                conn.execute("""
+                    INSERT INTO portfolios (user_id, balance, initial_balance)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        balance = excluded.balance,
+                        initial_balance = excluded.initial_balance,
+                        updated_at = CURRENT_TIMESTAMP
+                """, (user_id, portfolio["balance"], portfolio["initial_balance"]))
+                conn.execute("DELETE FROM holdings WHERE user_id = ?", (user_id,))
+                conn.executemany("""
+                    INSERT INTO holdings (user_id, ticker, shares, avg_price, total_cost)
+                    VALUES (?, ?, ?, ?, ?)
+                """, [
+                    (user_id, ticker, holding["shares"], holding["avg_price"], holding["total_cost"])
+                    for ticker, holding in portfolio["holdings"].items() if holding["shares"] > 0
+                ])
+        return n_trades
+    
+    def get_user_ids(self, with_trades: bool = False) -> set:
+        """ID всех пользователей (with_trades=True - только с историей сделок)"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            if with_trades:
+                cursor.execute("SELECT DISTINCT user_id FROM trade_history")
+            else:
+                cursor.execute("SELECT id FROM users")
+            user_ids = {row[0] for row in cursor.fetchall()}
+        
+        return user_ids
+    
     def get_trade_history(self, user_id: int) -> pd.DataFrame:
         """Получает историю торгов пользователя"""
-        conn = self.get_connection()
+        with self.connection() as conn:
+            query = """
+                SELECT * FROM trade_history 
+                WHERE user_id = ?
+                ORDER BY timestamp DESC
+            """
+            
+            df = pd.read_sql_query(query, conn, params=(user_id,))
+        
+        return df
+    
+    def get_trade_history_page(self, user_id: int, page_size: int = 50,
+                               after: Optional[Tuple[str, int]] = None,
+                               ticker: Optional[str] = None,
+                               start: Optional[str] = None,
+                               end: Optional[str] = None) -> Tuple[pd.DataFrame, Optional[Tuple[str, int]]]:
+        """
+        Страница истории торгов (от новых к старым) с курсором по (timestamp, id)
         
-        query = """
-            SELECT * FROM trade_history 
-            WHERE user_id = ?
-            ORDER BY timestamp DESC
+        В отличие от OFFSET, курсор не пропускает уже прочитанные строки: каждая
+        страница - поиск по индексу и чтение page_size строк.
+        
+        Args:
+            user_id: ID пользователя
+            page_size: Количество сделок на странице
+            after: Курсор (timestamp, id) последней сделки предыдущей страницы
+            ticker: Фильтр по тикеру
+            start: Сделки не раньше этого времени (ISO)
+            end: Сделки раньше этого времени (ISO)
+        
+        Returns:
+            (DataFrame страницы, курсор следующей страницы или None, если страница последняя)
+        """
+        conditions, params = ["user_id = ?"], [user_id]
+        if ticker:
+            conditions.append("ticker = ?")
+            params.append(ticker)
+        if start:
+            conditions.append("timestamp >= ?")
+            params.append(start)
+        if end:
+            conditions.append("timestamp < ?")
+            params.append(end)
+        if after is not None:
+            conditions.append("(timestamp, id) < (?, ?)")
+            params.extend(after)
+        
+        query = f"""
+            SELECT * FROM trade_history
+            WHERE {" AND ".join(conditions)}
+            ORDER BY timestamp DESC, id DESC
+            LIMIT ?
         """
         
-        df = pd.read_sql_query(query, conn, params=(user_id,))
-        conn.close()
+        with self.connection() as conn:
+            # Одна лишняя строка показывает, есть ли следующая страница
+            df = pd.read_sql_query(query, conn, params=(*params, page_size + 1))
         
-        return df
+        next_cursor = None
+        if len(df) > page_size:
+            df = df.iloc[:page_size]
+            last = df.iloc[-1]
+            next_cursor = (last["timestamp"], int(last["id"]))
+        return df, next_cursor
+    
+    def get_traded_tickers(self, user_id: int) -> List[str]:
+        """Тикеры, по которым у пользователя есть сделки"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT DISTINCT ticker FROM trade_history WHERE user_id = ? ORDER BY ticker", (user_id,))
+            tickers = [row[0] for row in cursor.fetchall()]
+        
+        return tickers
     
     def get_trade_history_count(self, user_id: int) -> int:
         """Получает количество сделок пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT COUNT(*) FROM trade_history WHERE user_id = ?", (user_id,))
-        count = cursor.fetchone()[0]
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT COUNT(*) FROM trade_history WHERE user_id = ?", (user_id,))
+            count = cursor.fetchone()[0]
         
         return count
+    
+    def get_trade_stats(self, user_id: int) -> Dict:
+        """
+        Сводка по сделкам пользователя, посчитанная в SQLite
+        
+        Returns:
+            Словарь: total_trades, buy_count, sell_count, buy_total, sell_total,
+            first_trade_at, last_trade_at, realized_pnl
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                SELECT COUNT(*) AS total_trades,
+                       COALESCE(SUM(action = 'BUY'), 0) AS buy_count,
+                       COALESCE(SUM(action = 'SELL'), 0) AS sell_count,
+                       COALESCE(SUM(CASE WHEN action = 'BUY' THEN total END), 0.0) AS buy_total,
+                       COALESCE(SUM(CASE WHEN action = 'SELL' THEN total END), 0.0) AS sell_total,
+                       MIN(timestamp) AS first_trade_at,
+                       MAX(timestamp) AS last_trade_at,
+                       COALESCE(SUM(realized_pnl), 0.0) AS realized_pnl
+                FROM trade_history
+                WHERE user_id = ?
+            """, (user_id,))
+            stats = dict(cursor.fetchone())
+        
+        return stats
+    
+    def get_daily_trade_summary(self, user_id: int) -> pd.DataFrame:
+        """
+        Сделки пользователя, агрегированные по дням
+        
+        Returns:
+            DataFrame (по строке на день): day, trades, buys, sells, buy_total, sell_total,
+            realized_pnl, balance (баланс после последней сделки дня)
+        """
+        with self.connection() as conn:
+            # Группировка по idx_trade_history_user_day; баланс дня - последняя сделка
+            # не позже конца дня (поиск по idx_trade_history_user_time)
+            query = """
+                SELECT date(timestamp) AS day,
+                       COUNT(*) AS trades,
+                       SUM(action = 'BUY') AS buys,
+                       SUM(action = 'SELL') AS sells,
+                       SUM(CASE WHEN action = 'BUY' THEN total ELSE 0.0 END) AS buy_total,
+                       SUM(CASE WHEN action = 'SELL' THEN total ELSE 0.0 END) AS sell_total,
+                       SUM(realized_pnl) AS realized_pnl,
+                       (SELECT last.balance_after FROM trade_history last
+                        WHERE last.user_id = ? AND last.timestamp < date(date(trade_history.timestamp), '+1 day')
+                        ORDER BY last.timestamp DESC, last.id DESC
+                        LIMIT 1) AS balance
+                FROM trade_history
+                WHERE user_id = ?
+                GROUP BY date(timestamp)
+                ORDER BY date(timestamp)
+            """
+            
+            df = pd.read_sql_query(query, conn, params=(user_id, user_id))
+        
+        return df
+    
+    # ========== Communication Log ==========
+    
+    def add_communication_logs(self, user_id: Optional[int], entries: List[Dict]) -> int:
+        """
+        Добавляет пакет записей лога коммуникации одной транзакцией
+        
+        Returns:
+            Количество добавленных записей
+        """
+        rows = [
+            (
+                user_id,
+                entry["timestamp"].isoformat() if isinstance(entry["timestamp"], datetime) else str(entry["timestamp"]),
+                entry["from"],
+                entry["to"],
+                entry["message_type"],
+                entry.get("ticker"),
+                entry.get("status"),
+                entry.get("decision"),
+                json.dumps(entry["payload"], default=str) if "payload" in entry else None
+            )
+            for entry in entries
+        ]
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.executemany("""
+                INSERT INTO communication_log
+                (user_id, timestamp, from_agent, to_agent, message_type, ticker, status, decision, payload)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            
+            conn.commit()
+        return len(rows)
+    
+    def get_communication_log(self, user_id: Optional[int] = None, limit: int = 100) -> pd.DataFrame:
+        """Получает последние записи лога коммуникации"""
+        with self.connection() as conn:
+            if user_id is None:
+                query = "SELECT * FROM communication_log ORDER BY id DESC LIMIT ?"
+                params = (limit,)
+            else:
+                query = "SELECT * FROM communication_log WHERE user_id = ? ORDER BY id DESC LIMIT ?"
+                params = (user_id, limit)
+            
+            df = pd.read_sql_query(query, conn, params=params)
+        
+        return df
+    
+    # ========== Equity Snapshots ==========
+    
+    def record_equity_snapshot(self, user_id: int, cash: float, holdings_value: float, pnl: float,
+                               timestamp: Optional[datetime] = None):
+        """
+        Обновляет снимки капитала за текущую минуту, час и день одной транзакцией
+        
+        Снимок интервала хранит последнее значение и максимум/минимум капитала,
+        поэтому кривая за любой период читается из небольшого числа строк.
+        
+        Args:
+            user_id: ID пользователя
+            cash: Свободные средства
+            holdings_value: Рыночная стоимость позиций
+            pnl: Капитал минус начальный баланс
+            timestamp: Время снимка (по умолчанию сейчас)
+        """
+        timestamp = timestamp or datetime.now()
+        equity = cash + holdings_value
+        rows = [
+            (user_id, granularity, timestamp.strftime(fmt), cash, holdings_value, equity, equity, equity, pnl,
+             timestamp.isoformat())
+            for granularity, fmt in EQUITY_GRANULARITIES.items()
+        ]
+        with self.transaction() as conn:
+            conn.executemany("""
+                INSERT INTO equity_snapshots
+                (user_id, granularity, bucket, cash, holdings_value, equity, equity_high, equity_low, pnl, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, granularity, bucket) DO UPDATE SET
+                    cash = excluded.cash,
+                    holdings_value = excluded.holdings_value,
+                    equity = excluded.equity,
+                    equity_high = MAX(equity_high, excluded.equity),
+                    equity_low = MIN(equity_low, excluded.equity),
+                    pnl = excluded.pnl,
+                    updated_at = excluded.updated_at
+            """, rows)
+    
+    def get_equity_curve(self, user_id: int, granularity: str = "day",
+                         start: Optional[str] = None, end: Optional[str] = None) -> pd.DataFrame:
+        """
+        Кривая капитала пользователя
+        
+        Args:
+            user_id: ID пользователя
+            granularity: minute, hour или day
+            start: Интервалы не раньше этого времени (ISO)
+            end: Интервалы раньше этого времени (ISO)
+        
+        Returns:
+            DataFrame: bucket, cash, holdings_value, equity, equity_high, equity_low, pnl
+        """
+        if granularity not in EQUITY_GRANULARITIES:
+            raise ValueError(f"Unknown granularity: {granularity}")
+        conditions, params = ["user_id = ?", "granularity = ?"], [user_id, granularity]
+        if start:
+            conditions.append("bucket >= ?")
+            params.append(start)
+        if end:
+            conditions.append("bucket < ?")
+            params.append(end)
+        
+        query = f"""
+            SELECT bucket, cash, holdings_value, equity, equity_high, equity_low, pnl
+            FROM equity_snapshots
+            WHERE {" AND ".join(conditions)}
+            ORDER BY bucket
+        """
+        
+        with self.connection() as conn:
+            df = pd.read_sql_query(query, conn, params=params)
+        
+        return df
+    
+    def carry_forward_equity_snapshots(self, day: Optional[str] = None,
+                                       prices: Optional[Dict[str, float]] = None) -> int:
+        """
+        Дневной снимок для пользователей без активности за день: последний дневной
+        снимок, переоцененный по ценам закрытия дня (кривая по дням без пропусков)
+        
+        Сделок за день не было, поэтому свободные средства и позиции те же, меняется
+        только их рыночная стоимость. Если цены не переданы или нет цены хотя бы для одного
+        тикера пользователя, стоимость позиций переносится без изменений.
+        
+        Args:
+            day: День (YYYY-MM-DD), по умолчанию сегодня
+            prices: Цены закрытия дня {ticker: price}
+        
+        Returns:
+            Количество добавленных снимков
+        """
+        day = day or datetime.now().strftime(EQUITY_GRANULARITIES["day"])
+        with self.transaction() as conn:
+            last_snapshots = conn.execute("""
+                SELECT s.user_id, s.cash, s.holdings_value, s.equity, s.pnl, s.updated_at
+                FROM equity_snapshots s
+                WHERE s.granularity = 'day'
+                  AND s.bucket = (SELECT MAX(bucket) FROM equity_snapshots
+                                  WHERE user_id = s.user_id AND granularity = 'day' AND bucket < ?)
+                  AND NOT EXISTS (SELECT 1 FROM equity_snapshots
+                                  WHERE user_id = s.user_id AND granularity = 'day' AND bucket = ?)
+            """, (day, day)).fetchall()
+            if not last_snapshots:
+                return 0
+            
+            holdings: Dict[int, List] = {}
+            if prices is not None:
+                for user_id, ticker, shares in conn.execute(
+                        "SELECT user_id, ticker, shares FROM holdings WHERE shares > 0"):
+                    holdings.setdefault(user_id, []).append((ticker, shares))
+            
+            rows = []
+            for snapshot in last_snapshots:
+                user_holdings = holdings.get(snapshot["user_id"], [])
+                holdings_value, updated_at = snapshot["holdings_value"], snapshot["updated_at"]
+                if prices is not None and all(ticker in prices for ticker, _ in user_holdings):
+                    holdings_value = sum(shares * prices[ticker] for ticker, shares in user_holdings)
+                    updated_at = datetime.now().isoformat()
+                equity = snapshot["cash"] + holdings_value
+                # Без сделок P&L меняется ровно на изменение капитала
+                pnl = snapshot["pnl"] + (equity - snapshot["equity"])
+                rows.append((snapshot["user_id"], day, snapshot["cash"], holdings_value,
+                             equity, equity, equity, pnl, updated_at))
+            cursor = conn.executemany("""
+                INSERT INTO equity_snapshots
+                (user_id, granularity, bucket, cash, holdings_value, equity, equity_high, equity_low, pnl, updated_at)
+                VALUES (?, 'day', ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, granularity, bucket) DO NOTHING
+            """, rows)
+            return cursor.rowcount
+    
+    def get_held_tickers(self) -> List[str]:
+        """Тикеры, которые есть в портфеле хотя бы у одного пользователя"""
+        with self.connection() as conn:
+            cursor = conn.execute("SELECT DISTINCT ticker FROM holdings WHERE shares > 0 ORDER BY ticker")
+            tickers = [row[0] for row in cursor.fetchall()]
+        return tickers
+    
+    def prune_equity_snapshots(self, now: Optional[datetime] = None,
+                               retention: Optional[Dict[str, Optional[timedelta]]] = None) -> int:
+        """
+        Удаляет снимки старше срока хранения своей гранулярности
+        
+        Args:
+            now: Текущее время (по умолчанию сейчас)
+            retention: Сроки хранения {granularity: timedelta или None}, по умолчанию EQUITY_RETENTION
+        
+        Returns:
+            Количество удаленных снимков
+        """
+        now = now or datetime.now()
+        retention = EQUITY_RETENTION if retention is None else retention
+        deleted = 0
+        with self.transaction() as conn:
+            for granularity, keep in retention.items():
+                if keep is None:
+                    continue
+                cutoff = (now - keep).strftime(EQUITY_GRANULARITIES[granularity])
+                cursor = conn.execute("DELETE FROM equity_snapshots WHERE granularity = ? AND bucket < ?",
+                                      (granularity, cutoff))
+                deleted += cursor.rowcount
+        return deleted
+    
+    # ========== Trading Sessions ==========
+    
+    def start_trading_session(self, user_id: int, tickers: List[str], interval_seconds: float,
+                              max_cycles: Optional[int] = None) -> int:
+        """
+        Создает или перезапускает сессию автоторговли пользователя
+        
+        Returns:
+            ID сессии
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                INSERT INTO trading_sessions (user_id, tickers, interval_seconds, max_cycles, status, n_cycles)
+                VALUES (?, ?, ?, ?, 'active', 0)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    tickers = excluded.tickers,
+                    interval_seconds = excluded.interval_seconds,
+                    max_cycles = excluded.max_cycles,
+                    status = 'active',
+                    n_cycles = 0,
+                    last_error = NULL,
+                    next_cycle_at = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+            """, (user_id, ",".join(tickers), interval_seconds, max_cycles))
+            cursor.execute("SELECT id FROM trading_sessions WHERE user_id = ?", (user_id,))
+            session_id = cursor.fetchone()[0]
+            
+            conn.commit()
+        return session_id
+    
+    def set_trading_session_status(self, user_id: int, status: str) -> bool:
+        """Меняет статус сессии (active / stopped / finished)"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                UPDATE trading_sessions
+                SET status = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE user_id = ?
+            """, (status, user_id))
+            
+            conn.commit()
+            success = cursor.rowcount > 0
+        return success
+    
+    def get_trading_session(self, user_id: int) -> Optional[Dict]:
+        """Получает сессию автоторговли пользователя"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT * FROM trading_sessions WHERE user_id = ?", (user_id,))
+            row = cursor.fetchone()
+        
+        if row:
+            return dict(row)
+        return None
+    
+    def get_active_trading_sessions(self) -> List[Dict]:
+        """Получает все активные сессии автоторговли"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT * FROM trading_sessions WHERE status = 'active'")
+            rows = cursor.fetchall()
+        
+        return [dict(row) for row in rows]
+    
+    def record_session_cycle(self, session_id: int, n_cycles: int, last_cycle_at: str,
+                             next_cycle_at: Optional[str], status: str = "active",
+                             last_error: Optional[str] = None) -> bool:
+        """
+        Обновляет прогресс сессии после цикла
+        
+        Сессия, остановленная из UI во время цикла, не возвращается в active.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                UPDATE trading_sessions
+                SET n_cycles = ?, last_cycle_at = ?, next_cycle_at = ?, last_error = ?,
+                    status = CASE WHEN status = 'active' THEN ? ELSE status END,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (n_cycles, last_cycle_at, next_cycle_at, last_error, status, session_id))
+            
+            conn.commit()
+            success = cursor.rowcount > 0
+        return success
+    
+    def add_cycle_results(self, rows: List[Dict]) -> int:
+        """
+        Добавляет результаты цикла (по строке на тикер) одной транзакцией
+        
+        Returns:
+            Количество добавленных строк
+        """
+        columns = ("session_id", "user_id", "cycle", "timestamp", "ticker", "status", "action",
+                   "current_price", "predicted_price", "confidence", "execution_status", "message",
+                   "portfolio_value", "duration_ms")
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.executemany(f"""
+                INSERT INTO cycle_results ({", ".join(columns)})
+                VALUES ({", ".join("?" for _ in columns)})
+            """, [tuple(row.get(column) for column in columns) for row in rows])
+            
+            conn.commit()
+        return len(rows)
+    
+    def get_cycle_results(self, user_id: int, limit: int = 50) -> pd.DataFrame:
+        """Получает последние результаты циклов демона"""
+        with self.connection() as conn:
+            query = """
+                SELECT * FROM cycle_results
+                WHERE user_id = ?
+                ORDER BY id DESC
+                LIMIT ?
+            """
+            
+            df = pd.read_sql_query(query, conn, params=(user_id, limit))
+        
+        return df
+
 
+def get_db_manager(db_path: Optional[str] = None) -> DBManager:
+    """
+    Общий экземпляр DBManager для пути БД (один пул соединений на процесс)
+    
+    Args:
+        db_path: Путь к файлу БД (если None, используется дефолтный)
+    """
+    key = os.path.abspath(db_path) if db_path else None
+    with _initialized_lock:
+        manager = _shared_managers.get(key)
+    if manager is None:
+        manager = DBManager(db_path)
+        with _initialized_lock:
+            manager = _shared_managers.setdefault(key, manager)
+    return manager
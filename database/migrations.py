@@ -0,0 +1,285 @@
+"""
+Migrations
+Версионированная схема БД: таблица schema_version и упорядоченный список миграций
+"""
+import sqlite3
+from typing import List, Tuple
+
+
+# Пересчет реализованного P&L сделок по средней цене позиции: рекурсивный проход по сделкам
+# каждой позиции (user_id, ticker) в порядке времени. user_filter - условие на trade_history
+# (например, "user_id = ?")
+REALIZED_PNL_UPDATE = """
+    WITH RECURSIVE trades AS (
+        SELECT id, user_id, ticker, action, shares, total,
+               ROW_NUMBER() OVER (PARTITION BY user_id, ticker ORDER BY timestamp, id) AS rn
+        FROM trade_history
+        WHERE {user_filter}
+    ),
+    positions (user_id, ticker, rn, id, shares, cost, realized) AS (
+        SELECT user_id, ticker, rn, id,
+               CASE WHEN action = 'BUY' THEN shares ELSE 0 END,
+               CASE WHEN action = 'BUY' THEN total ELSE 0.0 END,
+               0.0
+        FROM trades
+        WHERE rn = 1
+        UNION ALL
+        SELECT t.user_id, t.ticker, t.rn, t.id,
+               CASE WHEN t.action = 'BUY' THEN p.shares + t.shares
+                    ELSE MAX(p.shares - t.shares, 0) END,
+               CASE WHEN t.action = 'BUY' THEN p.cost + t.total
+                    WHEN p.shares > t.shares THEN p.cost * (p.shares - t.shares) / p.shares
+                    ELSE 0.0 END,
+               CASE WHEN t.action = 'SELL' AND p.shares > 0
+                    THEN t.total - p.cost * MIN(t.shares, p.shares) / p.shares
+                    ELSE 0.0 END
+        FROM positions p
+        JOIN trades t ON t.user_id = p.user_id AND t.ticker = p.ticker AND t.rn = p.rn + 1
+    )
+    UPDATE trade_history
+    SET realized_pnl = positions.realized
+    FROM positions
+    WHERE positions.id = trade_history.id
+"""
+
+# (версия, название, SQL-операторы); новые миграции добавляются только в конец списка
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (1, "initial schema", [
+        # Таблица пользователей
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT,
+            password_hash TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Таблица портфелей
+        """
+        CREATE TABLE IF NOT EXISTS portfolios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            balance REAL DEFAULT 10000.0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            UNIQUE(user_id)
+        )
+        """,
+        # Таблица холдингов (акции в портфеле)
+        """
+        CREATE TABLE IF NOT EXISTS holdings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            ticker TEXT NOT NULL,
+            shares INTEGER NOT NULL,
+            avg_price REAL NOT NULL,
+            total_cost REAL NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            UNIQUE(user_id, ticker)
+        )
+        """,
+        # Таблица истории торгов
+        """
+        CREATE TABLE IF NOT EXISTS trade_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            timestamp TEXT NOT NULL,
+            ticker TEXT NOT NULL,
+            action TEXT NOT NULL,
+            shares INTEGER NOT NULL,
+            price REAL NOT NULL,
+            total REAL NOT NULL,
+            balance_after REAL NOT NULL,
+            confidence REAL,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """,
+    ]),
+    (2, "communication log", [
+        # Лог коммуникации агентов (payload - JSON выборки сообщений)
+        """
+        CREATE TABLE IF NOT EXISTS communication_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            timestamp TEXT NOT NULL,
+            from_agent TEXT NOT NULL,
+            to_agent TEXT NOT NULL,
+            message_type TEXT NOT NULL,
+            ticker TEXT,
+            status TEXT,
+            decision TEXT,
+            payload TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """,
+    ]),
+    (3, "trading sessions", [
+        # Сессии автоторговли (расписание демона; UI только включает/выключает)
+        """
+        CREATE TABLE IF NOT EXISTS trading_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            tickers TEXT NOT NULL,
+            interval_seconds REAL NOT NULL,
+            max_cycles INTEGER,
+            status TEXT NOT NULL DEFAULT 'active',
+            n_cycles INTEGER NOT NULL DEFAULT 0,
+            last_cycle_at TEXT,
+            next_cycle_at TEXT,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            UNIQUE(user_id)
+        )
+        """,
+        # Результаты циклов демона (по строке на тикер)
+        """
+        CREATE TABLE IF NOT EXISTS cycle_results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            cycle INTEGER NOT NULL,
+            timestamp TEXT NOT NULL,
+            ticker TEXT NOT NULL,
+            status TEXT NOT NULL,
+            action TEXT,
+            current_price REAL,
+            predicted_price REAL,
+            confidence REAL,
+            execution_status TEXT,
+            message TEXT,
+            portfolio_value REAL,
+            duration_ms REAL,
+            FOREIGN KEY (session_id) REFERENCES trading_sessions(id) ON DELETE CASCADE
+        )
+        """,
+    ]),
+    (4, "access path indexes", [
+        # История сделок: выборка пользователя по времени (ORDER BY timestamp без сортировки)
+        # и по тикеру; COUNT(*) по user_id читает только индекс
+        """
+        CREATE INDEX IF NOT EXISTS idx_trade_history_user_time
+        ON trade_history (user_id, timestamp)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_trade_history_user_ticker
+        ON trade_history (user_id, ticker, timestamp)
+        """,
+        # Последние записи пользователя (ORDER BY id - rowid входит в индекс)
+        """
+        CREATE INDEX IF NOT EXISTS idx_communication_log_user
+        ON communication_log (user_id)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_cycle_results_user
+        ON cycle_results (user_id)
+        """,
+        # Демон опрашивает активные сессии каждые несколько секунд
+        """
+        CREATE INDEX IF NOT EXISTS idx_trading_sessions_status
+        ON trading_sessions (status)
+        """,
+    ]),
+    (5, "equity snapshots", [
+        # Кривая капитала: последнее значение за минуту/час/день (bucket - начало интервала)
+        """
+        CREATE TABLE IF NOT EXISTS equity_snapshots (
+            user_id INTEGER NOT NULL,
+            granularity TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            cash REAL NOT NULL,
+            holdings_value REAL NOT NULL,
+            equity REAL NOT NULL,
+            equity_high REAL NOT NULL,
+            equity_low REAL NOT NULL,
+            pnl REAL NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (user_id, granularity, bucket),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+        """,
+    ]),
+    (6, "portfolio starting capital", [
+        # Стартовый капитал хранится в портфеле, а не вычисляется по истории сделок
+        "ALTER TABLE portfolios ADD COLUMN initial_balance REAL NOT NULL DEFAULT 10000.0",
+        # Backfill одним запросом: баланс до первой сделки (поиск по idx_trade_history_user_time),
+        # без сделок - текущий баланс
+        """
+        UPDATE portfolios
+        SET initial_balance = COALESCE(
+            (SELECT CASE WHEN action = 'BUY' THEN balance_after + total ELSE balance_after - total END
+             FROM trade_history
+             WHERE trade_history.user_id = portfolios.user_id
+             ORDER BY timestamp, id
+             LIMIT 1),
+            balance
+        )
+        """,
+    ]),
+    (7, "realized pnl per trade", [
+        # Реализованный P&L хранится в сделке (считает record_trade), агрегаты - обычные GROUP BY
+        "ALTER TABLE trade_history ADD COLUMN realized_pnl REAL NOT NULL DEFAULT 0.0",
+        # Backfill существующей истории: один проход по сделкам каждой позиции (user_id, ticker)
+        REALIZED_PNL_UPDATE.format(user_filter="1"),
+        # Сводка по дням: GROUP BY date(timestamp) по индексу, без сортировки
+        """
+        CREATE INDEX IF NOT EXISTS idx_trade_history_user_day
+        ON trade_history (user_id, date(timestamp))
+        """,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _ensure_version_table(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    """Текущая версия схемы (0 - пустая БД или БД до появления миграций)"""
+    _ensure_version_table(conn)
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> List[int]:
+    """
+    Применяет недостающие миграции; каждая - в отдельной транзакции вместе с записью версии
+
+    Миграции 1-3 используют IF NOT EXISTS, поэтому БД, созданные до появления миграций,
+    обновляются без потери данных. Параллельный запуск из нескольких процессов безопасен:
+    версия перепроверяется под блокировкой записи (BEGIN IMMEDIATE).
+
+    Returns:
+        Список примененных версий
+    """
+    applied = []
+    if current_version(conn) >= LATEST_VERSION:
+        return applied
+
+    for version, name, statements in MIGRATIONS:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM schema_version WHERE version = ?", (version,)).fetchone():
+                conn.rollback()
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (version, name))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
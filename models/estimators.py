@@ -0,0 +1,51 @@
+"""
+Model factory
+Создает модели для предсказания цен по типу и гиперпараметрам
+"""
+from typing import Dict, Optional
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import LinearRegression
+from models.online import OnlineRegressor
+
+
+# Гиперпараметры по умолчанию (те же, что исторически использовались в train_model)
+DEFAULT_PARAMS = {
+    "random_forest": {
+        "n_estimators": 100,
+        "max_depth": 5,  # Уменьшено с 10 до 5 для предотвращения переобучения
+        "min_samples_split": 10,  # Минимум примеров для разделения узла
+        "min_samples_leaf": 5,  # Минимум примеров в листе
+        "max_features": "sqrt",  # Ограничение признаков для каждого дерева
+    },
+    "linear": {},
+    "online": {
+        "alpha": 1e-4,
+        "eta0": 0.001,
+        "learning_rate": "constant",
+    },
+}
+
+
+def make_model(model_type: str = "random_forest", params: Optional[Dict] = None, n_jobs: int = -1):
+    """
+    Создает необученную модель
+
+    Args:
+        model_type: Тип модели ("random_forest", "linear" или "online")
+        params: Гиперпараметры (переопределяют DEFAULT_PARAMS)
+        n_jobs: Число потоков для моделей, которые это поддерживают
+
+    Returns:
+        Необученная модель sklearn
+    """
+    if model_type not in DEFAULT_PARAMS:
+        raise ValueError(f"Unknown model type: {model_type}")
+
+    model_params = dict(DEFAULT_PARAMS[model_type])
+    model_params.update(params or {})
+
+    if model_type == "random_forest":
+        return RandomForestRegressor(random_state=42, n_jobs=n_jobs, **model_params)
+    if model_type == "online":
+        return OnlineRegressor(**model_params)
+    return LinearRegression(**model_params)
@@ -0,0 +1,234 @@
+"""
+Feature Store
+Кэширует матрицу признаков (X, y, даты) на диске в виде компактных бинарных массивов
+"""
+import os
+import json
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from typing import Callable, Optional, Tuple, List
+
+
+# Приблизительная длина периодов yfinance в календарных днях
+PERIOD_DAYS = {
+    "1mo": 31,
+    "3mo": 92,
+    "6mo": 183,
+    "1y": 366,
+    "2y": 731,
+    "5y": 1827,
+    "10y": 3653,
+}
+
+# Сколько календарных дней истории нужно до первой новой строки,
+# чтобы прогреть самые длинные окна индикаторов (MA50 + лаги)
+WARMUP_DAYS = 120
+
+
+class FeatureStore:
+    """Дисковый кэш признаков для обучения, ключ: (тикер, период, версия схемы признаков)"""
+
+    def __init__(self, cache_dir: Optional[str] = None, max_age: timedelta = timedelta(hours=12)):
+        """
+        Инициализация хранилища
+
+        Args:
+            cache_dir: Директория кэша (по умолчанию data/feature_store)
+            max_age: Как долго кэш считается свежим без обращения к Yahoo Finance
+        """
+        if cache_dir is None:
+            base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            cache_dir = os.path.join(base_dir, "data", "feature_store")
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry_dir(self, ticker: str, period: str, schema_version: int, dtype: str) -> str:
+        """Директория записи кэша для ключа"""
+        key = f"{ticker.upper()}_{period}_v{schema_version}_{dtype}"
+        return os.path.join(self.cache_dir, key)
+
+    def _read_meta(self, entry_dir: str) -> Optional[dict]:
+        meta_path = os.path.join(entry_dir, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        try:
+            with open(meta_path, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error reading feature store meta: {e}")
+            return None
+
+    def _write_meta(self, entry_dir: str, meta: dict):
+        # Атомарная запись: meta.json - источник истины о числе строк
+        meta_path = os.path.join(entry_dir, "meta.json")
+        tmp_path = meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def load(self, ticker: str, period: str, schema_version: int,
+             dtype: str = "float64", mmap: bool = True) -> Optional[Tuple[np.ndarray, np.ndarray, List[str], np.ndarray]]:
+        """
+        Загружает закэшированную матрицу признаков
+
+        Args:
+            ticker: Тикер акции
+            period: Период данных
+            schema_version: Версия схемы признаков
+            dtype: Тип данных матрицы признаков
+            mmap: Отображать файлы в память вместо чтения (без копирования)
+
+        Returns:
+            Кортеж (X, y, feature_columns, dates) или None, если кэша нет
+        """
+        entry_dir = self._entry_dir(ticker, period, schema_version, dtype)
+        meta = self._read_meta(entry_dir)
+        if meta is None or meta.get("n_rows", 0) == 0:
+            return None
+
+        n_rows = meta["n_rows"]
+        n_features = meta["n_features"]
+        np_dtype = np.dtype(meta["dtype"])
+
+        try:
+            if mmap:
+                X = np.memmap(os.path.join(entry_dir, "X.bin"), dtype=np_dtype, mode="r",
+                              shape=(n_rows, n_features))
+                y = np.memmap(os.path.join(entry_dir, "y.bin"), dtype=np_dtype, mode="r",
+                              shape=(n_rows,))
+            else:
+                X = np.fromfile(os.path.join(entry_dir, "X.bin"), dtype=np_dtype,
+                                count=n_rows * n_features).reshape(n_rows, n_features)
+                y = np.fromfile(os.path.join(entry_dir, "y.bin"), dtype=np_dtype, count=n_rows)
+            dates = np.fromfile(os.path.join(entry_dir, "dates.bin"), dtype="datetime64[ns]", count=n_rows)
+        except Exception as e:
+            print(f"Error loading feature store entry {entry_dir}: {e}")
+            return None
+
+        # Обрезаем начало, чтобы окно соответствовало периоду (срез без копирования)
+        start = _period_start(period, datetime.utcnow())
+        if start is not None:
+            first = int(np.searchsorted(dates, np.datetime64(start, "ns")))
+            X, y, dates = X[first:], y[first:], dates[first:]
+
+        return X, y, list(meta["feature_columns"]), dates
+
+    def append(self, ticker: str, period: str, schema_version: int,
+               X: np.ndarray, y: np.ndarray, feature_columns: List[str], dates: np.ndarray) -> int:
+        """
+        Дописывает в кэш строки, которые новее последней сохраненной даты
+
+        Returns:
+            Количество добавленных строк
+        """
+        dtype = np.dtype(X.dtype).name
+        entry_dir = self._entry_dir(ticker, period, schema_version, dtype)
+        os.makedirs(entry_dir, exist_ok=True)
+
+        meta = self._read_meta(entry_dir) or {
+            "ticker": ticker.upper(),
+            "period": period,
+            "schema_version": schema_version,
+            "dtype": dtype,
+            "n_features": X.shape[1],
+            "feature_columns": list(feature_columns),
+            "n_rows": 0,
+            "last_date": None,
+        }
+
+        if list(meta["feature_columns"]) != list(feature_columns):
+            raise ValueError("Feature columns do not match the cached schema; bump FEATURE_SCHEMA_VERSION")
+
+        dates = np.asarray(dates, dtype="datetime64[ns]")
+        if meta["last_date"] is not None:
+            mask = dates > np.datetime64(meta["last_date"], "ns")
+            X, y, dates = X[mask], y[mask], dates[mask]
+
+        n_new = len(dates)
+        if n_new > 0:
+            n_rows = meta["n_rows"]
+            row_bytes = X.shape[1] * np.dtype(dtype).itemsize
+            # Отрезаем хвост от прерванной записи (если meta не успела обновиться)
+            for name, size in (("X.bin", n_rows * row_bytes),
+                               ("y.bin", n_rows * np.dtype(dtype).itemsize),
+                               ("dates.bin", n_rows * 8)):
+                path = os.path.join(entry_dir, name)
+                if os.path.exists(path) and os.path.getsize(path) != size:
+                    with open(path, "r+b") as f:
+                        f.truncate(size)
+
+            with open(os.path.join(entry_dir, "X.bin"), "ab") as f:
+                f.write(np.ascontiguousarray(X, dtype=dtype).tobytes())
+            with open(os.path.join(entry_dir, "y.bin"), "ab") as f:
+                f.write(np.ascontiguousarray(y, dtype=dtype).tobytes())
+            with open(os.path.join(entry_dir, "dates.bin"), "ab") as f:
+                f.write(dates.tobytes())
+
+            meta["n_rows"] = n_rows + n_new
+            meta["last_date"] = str(dates[-1])
+
+        meta["refreshed_at"] = datetime.utcnow().isoformat()
+        self._write_meta(entry_dir, meta)
+        return n_new
+
+    def get(self, ticker: str, period: str, schema_version: int,
+            builder: Callable[[Optional[datetime]], tuple],
+            dtype: str = "float64", force_refresh: bool = False) -> Tuple[np.ndarray, np.ndarray, List[str], np.ndarray]:
+        """
+        Возвращает признаки из кэша, при необходимости достраивая новые строки
+
+        Args:
+            ticker: Тикер акции
+            period: Период данных
+            schema_version: Версия схемы признаков
+            builder: Функция builder(start) -> (X, y, feature_columns, dates);
+                     start=None означает полную загрузку периода
+            dtype: Тип данных матрицы признаков
+            force_refresh: Проверить новые данные, даже если кэш свежий
+
+        Returns:
+            Кортеж (X, y, feature_columns, dates)
+        """
+        entry_dir = self._entry_dir(ticker, period, schema_version, dtype)
+        meta = self._read_meta(entry_dir)
+
+        if meta is None or meta.get("n_rows", 0) == 0:
+            # Холодный старт - полная загрузка периода
+            X, y, feature_columns, dates = builder(None)
+            self.append(ticker, period, schema_version, X, y, feature_columns, dates)
+        else:
+            refreshed_at = meta.get("refreshed_at")
+            is_fresh = (refreshed_at is not None and
+                        datetime.utcnow() - datetime.fromisoformat(refreshed_at) < self.max_age)
+            if force_refresh or not is_fresh:
+                # Догружаем только хвост с запасом на прогрев индикаторов
+                last_date = pd.Timestamp(meta["last_date"]).to_pydatetime()
+                X, y, feature_columns, dates = builder(last_date - timedelta(days=WARMUP_DAYS))
+                added = self.append(ticker, period, schema_version, X, y, feature_columns, dates)
+                print(f"Feature store: appended {added} new rows for {ticker}")
+
+        cached = self.load(ticker, period, schema_version, dtype)
+        if cached is None:
+            raise ValueError(f"No cached features available for {ticker}")
+        return cached
+
+    def clear(self, ticker: Optional[str] = None):
+        """Удаляет записи кэша (для тикера или все)"""
+        import shutil
+        if not os.path.isdir(self.cache_dir):
+            return
+        prefix = f"{ticker.upper()}_" if ticker else ""
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(prefix):
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+
+
+def _period_start(period: str, now: datetime) -> Optional[datetime]:
+    """Начало окна для периода yfinance (None - без ограничения)"""
+    if period in PERIOD_DAYS:
+        return now - timedelta(days=PERIOD_DAYS[period])
+    if period == "ytd":
+        return datetime(now.year, 1, 1)
+    return None
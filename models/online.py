@@ -0,0 +1,97 @@
+"""
+Online model
+Модель с инкрементальным дообучением (partial_fit) на каждом новом баре
+"""
+import numpy as np
+from sklearn.linear_model import SGDRegressor
+from sklearn.preprocessing import StandardScaler
+
+from agents.market_monitor import CLOSE_INDEX
+
+
+class OnlineRegressor:
+    """
+    Инкрементальная модель цены: SGD-регрессия доходности следующего бара
+
+    Модель учится предсказывать доходность Future_Price / Close - 1 (стационарная цель,
+    хорошо подходит для SGD), а predict() возвращает цену, как и остальные модели.
+    """
+
+    def __init__(self, alpha: float = 1e-4, eta0: float = 0.001,
+                 learning_rate: str = "constant", epochs: int = 5,
+                 batch_size: int = 32, random_state: int = 42):
+        """
+        Инициализация модели
+
+        Args:
+            alpha: L2-регуляризация
+            eta0: Начальная скорость обучения
+            learning_rate: Расписание скорости обучения SGDRegressor
+            epochs: Количество проходов при начальном обучении (fit)
+            batch_size: Размер мини-батча при начальном обучении
+            random_state: Seed
+        """
+        self.alpha = alpha
+        self.eta0 = eta0
+        self.learning_rate = learning_rate
+        self.epochs = epochs
+        self.batch_size = batch_size
+        self.random_state = random_state
+        self.scaler = StandardScaler()
+        self.regressor = SGDRegressor(alpha=alpha, eta0=eta0, learning_rate=learning_rate,
+                                      random_state=random_state)
+        self.n_updates = 0
+
+    @staticmethod
+    def _to_returns(X: np.ndarray, y: np.ndarray) -> np.ndarray:
+        close = X[:, CLOSE_INDEX]
+        return np.where(close > 0, y / np.where(close > 0, close, 1.0) - 1.0, 0.0)
+
+    def partial_fit(self, X: np.ndarray, y: np.ndarray) -> "OnlineRegressor":
+        """
+        Дообучает модель на новых размеченных барах
+
+        Args:
+            X: Признаки баров
+            y: Следующая цена закрытия для каждого бара
+        """
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        self.scaler.partial_fit(X)
+        self.regressor.partial_fit(self.scaler.transform(X), self._to_returns(X, y))
+        self.n_updates += len(y)
+        return self
+
+    def fit(self, X: np.ndarray, y: np.ndarray) -> "OnlineRegressor":
+        """Начальное обучение мини-батчами (совместимо с train_model)"""
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        self.scaler = StandardScaler().fit(X)
+        self.regressor = SGDRegressor(alpha=self.alpha, eta0=self.eta0, learning_rate=self.learning_rate,
+                                      random_state=self.random_state)
+        X_scaled = self.scaler.transform(X)
+        returns = self._to_returns(X, y)
+        rng = np.random.default_rng(self.random_state)
+        for _ in range(self.epochs):
+            order = rng.permutation(len(y))
+            for start in range(0, len(y), self.batch_size):
+                batch = order[start:start + self.batch_size]
+                self.regressor.partial_fit(X_scaled[batch], returns[batch])
+        self.n_updates = len(y)
+        return self
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """Предсказывает следующую цену закрытия"""
+        X = np.asarray(X)
+        predicted_returns = self.regressor.predict(self.scaler.transform(X))
+        return X[:, CLOSE_INDEX] * (1.0 + predicted_returns)
+
+    def get_params(self, deep: bool = True) -> dict:
+        return {
+            "alpha": self.alpha,
+            "eta0": self.eta0,
+            "learning_rate": self.learning_rate,
+            "epochs": self.epochs,
+            "batch_size": self.batch_size,
+            "random_state": self.random_state,
+        }
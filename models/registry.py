@@ -0,0 +1,116 @@
+"""
+Model Registry
+Хранит результаты обучения/подбора параметров и артефакты моделей
+"""
+import os
+import json
+import uuid
+import joblib
+import pandas as pd
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+
+class ModelRegistry:
+    """Простой файловый реестр моделей: индекс в JSON + артефакты joblib"""
+
+    def __init__(self, registry_dir: Optional[str] = None):
+        """
+        Инициализация реестра
+
+        Args:
+            registry_dir: Директория реестра (по умолчанию models/registry)
+        """
+        if registry_dir is None:
+            registry_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "registry")
+        self.registry_dir = registry_dir
+        self.index_path = os.path.join(registry_dir, "registry.json")
+        os.makedirs(registry_dir, exist_ok=True)
+
+    def _read_index(self) -> List[Dict]:
+        if not os.path.exists(self.index_path):
+            return []
+        try:
+            with open(self.index_path, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error reading model registry: {e}")
+            return []
+
+    def _write_index(self, entries: List[Dict]):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f, indent=2, default=str)
+        os.replace(tmp_path, self.index_path)
+
+    def register(self, kind: str, ticker: str, model_type: str,
+                 params: Optional[Dict] = None, metrics: Optional[Dict] = None,
+                 model: Any = None, details: Optional[Any] = None) -> str:
+        """
+        Добавляет запись в реестр
+
+        Args:
+            kind: Тип записи ("hyperparameter_search", "training", ...)
+            ticker: Тикер
+            model_type: Тип модели
+            params: Гиперпараметры
+            metrics: Метрики
+            model: Обученная модель (сохраняется как артефакт, если указана)
+            details: Дополнительные данные (например, все кандидаты поиска)
+
+        Returns:
+            ID записи
+        """
+        entry_id = f"{datetime.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}"
+        artifact_path = None
+        if model is not None:
+            artifact_path = os.path.join(self.registry_dir, f"{entry_id}.pkl")
+            joblib.dump(model, artifact_path)
+
+        entry = {
+            "id": entry_id,
+            "kind": kind,
+            "ticker": ticker,
+            "model_type": model_type,
+            "created_at": datetime.now().isoformat(),
+            "params": params or {},
+            "metrics": metrics or {},
+            "artifact_path": artifact_path,
+            "details": details,
+        }
+        entries = self._read_index()
+        entries.append(entry)
+        self._write_index(entries)
+        return entry_id
+
+    def list_entries(self, kind: Optional[str] = None, ticker: Optional[str] = None) -> pd.DataFrame:
+        """Возвращает записи реестра в виде DataFrame (без подробностей)"""
+        entries = [
+            {k: v for k, v in e.items() if k != "details"}
+            for e in self._read_index()
+            if (kind is None or e["kind"] == kind) and (ticker is None or e["ticker"] == ticker)
+        ]
+        return pd.DataFrame(entries)
+
+    def get_entry(self, entry_id: str) -> Optional[Dict]:
+        """Получает запись по ID"""
+        for entry in self._read_index():
+            if entry["id"] == entry_id:
+                return entry
+        return None
+
+    def latest(self, kind: str, ticker: Optional[str] = None,
+               model_type: Optional[str] = None) -> Optional[Dict]:
+        """Последняя запись заданного типа"""
+        for entry in reversed(self._read_index()):
+            if (entry["kind"] == kind and (ticker is None or entry["ticker"] == ticker)
+                    and (model_type is None or entry["model_type"] == model_type)):
+                return entry
+        return None
+
+    def load_model(self, entry_id: str):
+        """Загружает артефакт модели записи"""
+        entry = self.get_entry(entry_id)
+        if entry is None or not entry.get("artifact_path"):
+            return None
+        return joblib.load(entry["artifact_path"])
@@ -5,140 +5,171 @@ Training script for ML model
 import yfinance as yf
 import pandas as pd
 import numpy as np
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.linear_model import LinearRegression
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
 import joblib
 import os
+import sys
+from datetime import datetime
+from typing import Optional
 
+# Добавляем корневую директорию в путь (для запуска как скрипт)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-def create_features(df: pd.DataFrame) -> pd.DataFrame:
+from agents.market_monitor import FEATURE_COLUMNS, add_indicators
+from models.feature_store import FeatureStore
+from models.estimators import make_model
+from models.validation import walk_forward_validate
+
+
+def create_features(df: pd.DataFrame, dtype: Optional[str] = None) -> pd.DataFrame:
     """
     Создает признаки для ML-модели
     
     Args:
         df: DataFrame с данными рынка
+        dtype: Тип данных для вычислений (например, "float32"); None - как в исходных данных
     
     Returns:
         DataFrame с признаками
     """
-    # Копируем данные
-    data = df.copy()
-    
-    # Технические индикаторы
-    data['MA5'] = data['Close'].rolling(window=5).mean()
-    data['MA20'] = data['Close'].rolling(window=20).mean()
-    data['MA50'] = data['Close'].rolling(window=50).mean()
-    
-    # Returns
-    data['Returns'] = data['Close'].pct_change()
-    data['Returns_5'] = data['Returns'].rolling(window=5).mean()
-    data['Returns_20'] = data['Returns'].rolling(window=20).mean()
-    
-    # Volatility
-    data['Volatility'] = data['Returns'].rolling(window=20).std()
+    # Копируем данные и считаем технические индикаторы (общий код с MarketMonitoringAgent)
+    data = add_indicators(df.copy(), dtype)
     
     # Price ratios
     data['MA5_MA20_ratio'] = data['MA5'] / data['MA20']
     data['Price_MA20_ratio'] = data['Close'] / data['MA20']
     data['Price_MA50_ratio'] = data['Close'] / data['MA50']
     
-    # Тренд и импульс (важно для предсказания роста)
-    data['Trend'] = (data['Close'] - data['Close'].shift(5)) / data['Close'].shift(5)  # 5-дневный тренд
-    data['Momentum'] = data['Close'] / data['Close'].shift(10) - 1  # 10-дневный импульс
-    
-    # Volume indicators
-    data['Volume_MA'] = data['Volume'].rolling(window=20).mean()
-    data['Volume_ratio'] = data['Volume'] / data['Volume_MA']
-    
-    # High-Low spread
-    data['HL_spread'] = (data['High'] - data['Low']) / data['Close']
-    
-    # RSI (Relative Strength Index) - индикатор силы тренда
-    delta = data['Close'].diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-    rs = gain / loss
-    data['RSI'] = 100 - (100 / (1 + rs))
-    
     # Target: будущая цена (сдвигаем на 1 день вперед)
     data['Future_Price'] = data['Close'].shift(-1)
     
     return data
 
 
-def prepare_training_data(ticker: str = "AAPL", period: str = "2y") -> tuple:
+# Версия схемы признаков: увеличивайте при любом изменении create_features/FEATURE_COLUMNS,
+# чтобы не использовать устаревший кэш признаков
+FEATURE_SCHEMA_VERSION = 1
+
+
+def download_history(ticker: str, period: str = "2y", start: Optional[datetime] = None) -> pd.DataFrame:
     """
-    Подготавливает данные для обучения
-    
+    Загружает дневную историю цен
+
     Args:
         ticker: Тикер акции
-        period: Период данных
-    
+        period: Период данных (используется, если start не указан)
+        start: Начальная дата (для догрузки хвоста)
+
     Returns:
-        Кортеж (X, y) - признаки и целевая переменная
+        DataFrame с OHLCV
     """
-    print(f"Downloading data for {ticker}...")
     stock = yf.Ticker(ticker)
-    df = stock.history(period=period)
-    
-    if df.empty:
-        raise ValueError(f"No data available for {ticker}")
+    if start is not None:
+        return stock.history(start=start.strftime("%Y-%m-%d"))
+    return stock.history(period=period)
+
+
+def build_feature_matrix(df: pd.DataFrame, dtype: str = "float64", require_target: bool = True) -> tuple:
+    """
+    Строит матрицу признаков из OHLCV данных
     
-    print(f"Data shape: {df.shape}")
+    Args:
+        df: DataFrame с данными рынка
+        dtype: Тип данных матрицы ("float64" или "float32")
+        require_target: Отбрасывать строки без будущей цены (False - для инференса/бэктеста,
+                        y последней строки будет NaN)
     
+    Returns:
+        Кортеж (X, y, feature_columns, dates)
+    """
     # Создаем признаки
-    df = create_features(df)
-    
-    # Удаляем строки с NaN
-    df = df.dropna()
-    
-    # Выбираем признаки для модели
-    feature_columns = [
-        'MA5', 'MA20', 'Volatility',
-        'Returns', 'Returns_5', 'Returns_20',
-        'MA5_MA20_ratio', 'Price_MA20_ratio', 'Price_MA50_ratio',
-        'Trend', 'Momentum',  # Добавлены тренд и импульс
-        'Volume_ratio', 'HL_spread',
-        'RSI',  # Добавлен RSI
-        'Close'
-    ]
+    df = create_features(df, dtype if dtype != "float64" else None)
     
     # Добавляем последние 5 значений Returns как отдельные признаки
     for i in range(5):
         df[f'Return_lag_{i+1}'] = df['Returns'].shift(i+1)
-        feature_columns.append(f'Return_lag_{i+1}')
-    
-    # Удаляем NaN после добавления lag features
-    df = df.dropna()
-    
-    X = df[feature_columns].values
-    y = df['Future_Price'].values
-    dates = df.index.values  # Сохраняем даты
     
+    # Маска строк без NaN (включая последнюю строку без будущей цены) -
+    # вместо dropna() и df[FEATURE_COLUMNS], которые копируют весь фрейм
+    y_full = df['Future_Price'].to_numpy()
+    valid = ~np.isnan(y_full) if require_target else np.ones(len(df), dtype=bool)
+    for column in FEATURE_COLUMNS:
+        valid &= ~np.isnan(df[column].to_numpy())
+    
+    # Заполняем матрицу по колонкам сразу в нужном типе
+    X = np.empty((int(valid.sum()), len(FEATURE_COLUMNS)), dtype=dtype)
+    for j, column in enumerate(FEATURE_COLUMNS):
+        X[:, j] = df[column].to_numpy()[valid]
+    y = y_full[valid].astype(dtype, copy=False)
+    dates = df.index.values[valid]  # Сохраняем даты
+    
+    return X, y, list(FEATURE_COLUMNS), dates
+
+
+def prepare_training_data(ticker: str = "AAPL", period: str = "2y",
+                          use_cache: bool = True, force_refresh: bool = False,
+                          dtype: str = "float64") -> tuple:
+    """
+    Подготавливает данные для обучения
+
+    Args:
+        ticker: Тикер акции
+        period: Период данных
+        use_cache: Использовать дисковый кэш признаков (FeatureStore)
+        force_refresh: Проверить наличие новых данных, даже если кэш свежий
+        dtype: Тип данных матрицы признаков ("float64" или "float32")
+
+    Returns:
+        Кортеж (X, y, feature_columns, dates) - признаки, целевая переменная, названия и даты
+    """
+    def builder(start: Optional[datetime] = None) -> tuple:
+        print(f"Downloading data for {ticker}..." if start is None
+              else f"Downloading data for {ticker} since {start:%Y-%m-%d}...")
+        df = download_history(ticker, period, start=start)
+
+        if df.empty:
+            raise ValueError(f"No data available for {ticker}")
+
+        print(f"Data shape: {df.shape}")
+        return build_feature_matrix(df, dtype)
+
+    if use_cache:
+        X, y, feature_columns, dates = FeatureStore().get(
+            ticker, period, FEATURE_SCHEMA_VERSION, builder, dtype=dtype, force_refresh=force_refresh
+        )
+    else:
+        X, y, feature_columns, dates = builder()
+
     print(f"Features shape: {X.shape}")
     print(f"Target shape: {y.shape}")
-    
+
     return X, y, feature_columns, dates
 
 
 def train_model(ticker: str = "AAPL", model_type: str = "random_forest", 
-                period: str = "2y", test_size: float = 0.2):
+                period: str = "2y", test_size: float = 0.2, use_cache: bool = True,
+                cv_folds: int = 0, cv_mode: str = "expanding", params: Optional[dict] = None,
+                dtype: str = "float64"):
     """
     Обучает модель
     
     Args:
         ticker: Тикер акции
-        model_type: Тип модели ("random_forest" или "linear")
+        model_type: Тип модели ("random_forest", "linear" или "online")
         period: Период данных для обучения
         test_size: Доля тестовых данных
+        use_cache: Использовать кэш признаков вместо повторной загрузки данных
+        cv_folds: Количество фолдов walk-forward валидации (0 - только holdout)
+        cv_mode: Режим окна walk-forward валидации ("expanding" или "sliding")
+        params: Гиперпараметры модели (например, лучшие из реестра после подбора)
+        dtype: Тип данных признаков ("float32" вдвое уменьшает память)
     
     Returns:
         Обученная модель и метрики
     """
     # Подготавливаем данные
-    X, y, feature_columns, dates = prepare_training_data(ticker, period)
+    X, y, feature_columns, dates = prepare_training_data(ticker, period, use_cache=use_cache, dtype=dtype)
     
     # Разделяем на train/test
     X_train, X_test, y_train, y_test = train_test_split(
@@ -153,20 +184,7 @@ def train_model(ticker: str = "AAPL", model_type: str = "random_forest",
     print(f"Train size: {X_train.shape[0]}, Test size: {X_test.shape[0]}")
     
     # Выбираем модель
-    if model_type == "random_forest":
-        model = RandomForestRegressor(
-            n_estimators=100,
-            max_depth=5,  # Уменьшено с 10 до 5 для предотвращения переобучения
-            min_samples_split=10,  # Минимум примеров для разделения узла
-            min_samples_leaf=5,  # Минимум примеров в листе
-            max_features='sqrt',  # Ограничение признаков для каждого дерева
-            random_state=42,
-            n_jobs=-1
-        )
-    elif model_type == "linear":
-        model = LinearRegression()
-    else:
-        raise ValueError(f"Unknown model type: {model_type}")
+    model = make_model(model_type, params)
     
     # Обучаем модель
     print("Training model...")
@@ -191,9 +209,19 @@ def train_model(ticker: str = "AAPL", model_type: str = "random_forest",
         "test_rmse": test_rmse,
         "train_r2": train_r2,
         "test_r2": test_r2,
-        "feature_columns": feature_columns
+        "feature_columns": feature_columns,
+        "dtype": dtype
     }
     
+    # Walk-forward валидация (фолды обучаются параллельно на общей матрице признаков)
+    if cv_folds and cv_folds > 1:
+        folds_df, cv_summary = walk_forward_validate(X, y, model_type, params, n_splits=cv_folds, mode=cv_mode)
+        metrics["cv_folds"] = folds_df.to_dict("records")
+        metrics["cv_summary"] = cv_summary
+        print(f"Walk-forward ({cv_mode}, {cv_folds} folds): "
+              f"MAE ${cv_summary['mae_mean']:.2f} ± {cv_summary['mae_std']:.2f}, "
+              f"wall time {cv_summary['wall_time']:.2f}s")
+    
     print("\n=== Model Performance ===")
     print(f"Train MAE: ${train_mae:.2f}")
     print(f"Test MAE: ${test_mae:.2f}")
@@ -211,6 +239,63 @@ def train_model(ticker: str = "AAPL", model_type: str = "random_forest",
     return model, metrics, (X_test, y_test, y_test_pred, dates_test)
 
 
+def check_float32_parity(ticker: str = "AAPL", model_type: str = "random_forest",
+                         period: str = "2y", test_size: float = 0.2, rtol: float = 1e-2) -> dict:
+    """
+    Сравнивает точность модели на float32 и float64 признаках
+    
+    Обе матрицы строятся из одних и тех же загруженных данных, модели обучаются
+    с одинаковыми параметрами и сравниваются на одном тестовом отрезке.
+    
+    Args:
+        ticker: Тикер акции
+        model_type: Тип модели
+        period: Период данных
+        test_size: Доля тестовых данных
+        rtol: Допустимое относительное расхождение test MAE
+    
+    Returns:
+        Словарь с метриками обеих версий и флагом passed
+    """
+    df = download_history(ticker, period)
+    if df.empty:
+        raise ValueError(f"No data available for {ticker}")
+    
+    results = {}
+    predictions = {}
+    for dtype in ("float64", "float32"):
+        X, y, _, _ = build_feature_matrix(df, dtype)
+        X_train, X_test, y_train, y_test = train_test_split(
+            X, y, test_size=test_size, random_state=42, shuffle=False
+        )
+        model = make_model(model_type)
+        model.fit(X_train, y_train)
+        y_pred = model.predict(X_test)
+        predictions[dtype] = y_pred
+        results[dtype] = {
+            "test_mae": mean_absolute_error(y_test, y_pred),
+            "test_rmse": float(np.sqrt(mean_squared_error(y_test, y_pred))),
+            "test_r2": r2_score(y_test, y_pred),
+            "X_nbytes": X.nbytes
+        }
+    
+    mae64 = results["float64"]["test_mae"]
+    mae_rel_diff = abs(results["float32"]["test_mae"] - mae64) / mae64 if mae64 > 0 else 0.0
+    max_pred_rel_diff = float(np.max(np.abs(predictions["float32"] - predictions["float64"]) /
+                                     np.abs(predictions["float64"])))
+    
+    parity = {
+        "float64": results["float64"],
+        "float32": results["float32"],
+        "mae_rel_diff": mae_rel_diff,
+        "max_pred_rel_diff": max_pred_rel_diff,
+        "passed": mae_rel_diff <= rtol
+    }
+    print(f"float32 parity for {ticker} ({model_type}): MAE rel. diff {mae_rel_diff:.2e}, "
+          f"max prediction rel. diff {max_pred_rel_diff:.2e} -> {'OK' if parity['passed'] else 'FAIL'}")
+    return parity
+
+
 if __name__ == "__main__":
     # Обучаем модель на данных AAPL
     print("=" * 50)
@@ -0,0 +1,221 @@
+"""
+Hyperparameter search
+Параллельный подбор гиперпараметров (grid/random) с successive halving по фолдам walk-forward
+"""
+import os
+import sys
+import math
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from typing import Dict, List, Optional, Tuple
+from sklearn.model_selection import ParameterGrid, ParameterSampler
+
+# Добавляем корневую директорию в путь (для запуска как скрипт)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.registry import ModelRegistry
+from models.validation import walk_forward_splits, as_shared_arrays, fit_fold
+
+
+# Пространства поиска для моделей
+SEARCH_SPACES = {
+    "random_forest": {
+        "n_estimators": [50, 100, 200, 400],
+        "max_depth": [3, 5, 8, 12, None],
+        "min_samples_split": [2, 10, 20],
+        "min_samples_leaf": [1, 5, 10, 20],
+        "max_features": ["sqrt", 0.5, 1.0],
+    },
+    "linear": {
+        "fit_intercept": [True, False],
+        "positive": [False, True],
+    },
+    "online": {
+        "alpha": [1e-5, 1e-4, 1e-3],
+        "eta0": [1e-4, 1e-3, 1e-2],
+        "epochs": [3, 5, 10],
+    },
+}
+
+
+def generate_candidates(model_type: str, strategy: str = "grid", n_iter: int = 20,
+                        space: Optional[Dict] = None, random_state: int = 42) -> List[Dict]:
+    """
+    Генерирует кандидатов гиперпараметров
+
+    Args:
+        model_type: Тип модели
+        strategy: "grid" (полный перебор) или "random" (случайная выборка)
+        n_iter: Количество кандидатов для random
+        space: Пространство поиска (по умолчанию SEARCH_SPACES[model_type])
+        random_state: Seed для random
+
+    Returns:
+        Список словарей гиперпараметров
+    """
+    space = space or SEARCH_SPACES[model_type]
+    if strategy == "grid":
+        return list(ParameterGrid(space))
+    if strategy == "random":
+        n_total = len(ParameterGrid(space))
+        return list(ParameterSampler(space, n_iter=min(n_iter, n_total), random_state=random_state))
+    raise ValueError(f"Unknown search strategy: {strategy}")
+
+
+def search_hyperparameters(X: np.ndarray, y: np.ndarray, model_type: str = "random_forest",
+                           strategy: str = "random", n_iter: int = 20, space: Optional[Dict] = None,
+                           n_splits: int = 5, mode: str = "expanding", halving: bool = True,
+                           eta: int = 3, min_folds: int = 1, n_jobs: int = -1) -> Tuple[pd.DataFrame, Dict]:
+    """
+    Подбирает гиперпараметры на фолдах walk-forward валидации
+
+    При halving=True используется successive halving: на первом раунде все кандидаты
+    оцениваются на min_folds самых свежих фолдах, затем лучшая 1/eta часть получает
+    в eta раз больше фолдов, и так до полного набора фолдов. Уже посчитанные фолды
+    повторно не обучаются.
+
+    Args:
+        X: Матрица признаков (упорядочена по времени)
+        y: Целевая переменная
+        model_type: Тип модели
+        strategy: "grid" или "random"
+        n_iter: Количество кандидатов для random
+        space: Пространство поиска
+        n_splits: Количество фолдов walk-forward
+        mode: "expanding" или "sliding"
+        halving: Использовать successive halving
+        eta: Во сколько раз сокращается число кандидатов на каждом раунде
+        min_folds: Количество фолдов на первом раунде
+        n_jobs: Количество процессов
+
+    Returns:
+        Кортеж (DataFrame кандидатов, отсортированный по MAE, сводка поиска)
+    """
+    candidates = generate_candidates(model_type, strategy, n_iter, space)
+    splits = walk_forward_splits(len(y), n_splits, mode)
+    # Самые свежие фолды первыми - ранний отсев идет по наиболее релевантным данным
+    fold_order = list(reversed(range(n_splits)))
+
+    fold_results: Dict[Tuple[int, int], Dict] = {}
+    alive = list(range(len(candidates)))
+    n_folds = min(min_folds, n_splits) if halving else n_splits
+    rungs = []
+
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        X_shared, y_shared = as_shared_arrays(X, y, temp_dir)
+
+        with Parallel(n_jobs=n_jobs, backend="loky") as parallel:
+            while True:
+                folds = fold_order[:n_folds]
+                tasks = [(c, f) for c in alive for f in folds if (c, f) not in fold_results]
+                results = parallel(
+                    delayed(fit_fold)(X_shared, y_shared, model_type, candidates[c], f, splits[f])
+                    for c, f in tasks
+                )
+                for (c, f), result in zip(tasks, results):
+                    fold_results[(c, f)] = result
+
+                scores = {c: np.mean([fold_results[(c, f)]["mae"] for f in folds]) for c in alive}
+                rungs.append({"n_candidates": len(alive), "n_folds": n_folds, "n_fits": len(tasks)})
+
+                if not halving or n_folds >= n_splits or len(alive) <= 1:
+                    break
+
+                keep = max(1, math.ceil(len(alive) / eta))
+                alive = sorted(alive, key=lambda c: scores[c])[:keep]
+                n_folds = min(n_splits, n_folds * eta)
+    wall_time = time.perf_counter() - started
+
+    rows = []
+    for c, params in enumerate(candidates):
+        evaluated = [fold_results[(c, f)] for f in fold_order if (c, f) in fold_results]
+        rows.append({
+            "candidate": c,
+            "params": params,
+            "n_folds": len(evaluated),
+            "mae": float(np.mean([r["mae"] for r in evaluated])),
+            "rmse": float(np.mean([r["rmse"] for r in evaluated])),
+            "r2": float(np.mean([r["r2"] for r in evaluated])),
+            "fit_time": float(np.sum([r["fit_time"] for r in evaluated])),
+        })
+
+    # Сначала кандидаты, дошедшие до последнего раунда, затем по MAE
+    results_df = pd.DataFrame(rows).sort_values(["n_folds", "mae"], ascending=[False, True])
+    results_df = results_df.reset_index(drop=True)
+
+    best = results_df.iloc[0]
+    summary = {
+        "model_type": model_type,
+        "strategy": strategy,
+        "halving": halving,
+        "n_candidates": len(candidates),
+        "n_fits": len(fold_results),
+        "n_fits_full": len(candidates) * n_splits,
+        "rungs": rungs,
+        "best_params": best["params"],
+        "best_mae": float(best["mae"]),
+        "best_rmse": float(best["rmse"]),
+        "best_r2": float(best["r2"]),
+        "wall_time": wall_time,
+    }
+    return results_df, summary
+
+
+def tune_model(ticker: str = "AAPL", model_type: str = "random_forest", period: str = "2y",
+               strategy: str = "random", n_iter: int = 20, n_splits: int = 5,
+               halving: bool = True, registry: Optional[ModelRegistry] = None,
+               **search_kwargs) -> Tuple[pd.DataFrame, Dict]:
+    """
+    Подбирает гиперпараметры для тикера и записывает результат в реестр моделей
+
+    Returns:
+        Кортеж (DataFrame кандидатов, сводка с ID записи реестра)
+    """
+    from models.train_model import prepare_training_data
+
+    X, y, feature_columns, dates = prepare_training_data(ticker, period)
+    results_df, summary = search_hyperparameters(
+        X, y, model_type, strategy=strategy, n_iter=n_iter,
+        n_splits=n_splits, halving=halving, **search_kwargs
+    )
+
+    registry = registry or ModelRegistry()
+    summary["registry_id"] = registry.register(
+        kind="hyperparameter_search",
+        ticker=ticker,
+        model_type=model_type,
+        params=summary["best_params"],
+        metrics={"mae": summary["best_mae"], "rmse": summary["best_rmse"], "r2": summary["best_r2"]},
+        details={
+            "period": period,
+            "summary": {k: v for k, v in summary.items() if k != "best_params"},
+            "candidates": results_df.to_dict("records"),
+        },
+    )
+
+    print(f"Best params for {ticker} ({model_type}): {summary['best_params']} "
+          f"(MAE ${summary['best_mae']:.2f}, {summary['n_fits']}/{summary['n_fits_full']} fits, "
+          f"{summary['wall_time']:.1f}s)")
+    return results_df, summary
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Hyperparameter search for price models")
+    parser.add_argument("--tickers", nargs="+", default=["AAPL"])
+    parser.add_argument("--model-type", default="random_forest", choices=list(SEARCH_SPACES))
+    parser.add_argument("--period", default="2y")
+    parser.add_argument("--strategy", default="random", choices=["grid", "random"])
+    parser.add_argument("--n-iter", type=int, default=20)
+    parser.add_argument("--n-splits", type=int, default=5)
+    parser.add_argument("--no-halving", action="store_true")
+    args = parser.parse_args()
+
+    for ticker in args.tickers:
+        tune_model(ticker, args.model_type, args.period, args.strategy, args.n_iter,
+                   args.n_splits, halving=not args.no_halving)
@@ -0,0 +1,144 @@
+"""
+Walk-forward validation
+Временная кросс-валидация (расширяющееся или скользящее окно) с параллельным обучением фолдов
+"""
+import os
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+import joblib
+from joblib import Parallel, delayed
+from typing import Dict, List, Optional, Tuple
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+
+from models.estimators import make_model
+
+
+def walk_forward_splits(n_samples: int, n_splits: int = 5, mode: str = "expanding",
+                        test_size: Optional[int] = None,
+                        train_window: Optional[int] = None) -> List[Tuple[int, int, int, int]]:
+    """
+    Строит границы фолдов walk-forward валидации
+
+    Args:
+        n_samples: Количество наблюдений
+        n_splits: Количество фолдов
+        mode: "expanding" (обучение с начала истории) или "sliding" (окно фиксированной длины)
+        test_size: Размер тестового блока (по умолчанию n_samples // (n_splits + 1))
+        train_window: Длина окна обучения для режима "sliding"
+                      (по умолчанию равна размеру первого обучающего блока)
+
+    Returns:
+        Список кортежей (train_start, train_end, test_start, test_end), концы не включаются
+    """
+    if mode not in ("expanding", "sliding"):
+        raise ValueError(f"Unknown walk-forward mode: {mode}")
+
+    test_size = test_size or n_samples // (n_splits + 1)
+    first_test_start = n_samples - n_splits * test_size
+    if test_size < 1 or first_test_start < 1:
+        raise ValueError(f"Not enough samples ({n_samples}) for {n_splits} folds")
+
+    if mode == "sliding":
+        train_window = train_window or first_test_start
+
+    splits = []
+    for k in range(n_splits):
+        test_start = first_test_start + k * test_size
+        test_end = test_start + test_size
+        train_start = 0 if mode == "expanding" else max(0, test_start - train_window)
+        splits.append((train_start, test_start, test_start, test_end))
+    return splits
+
+
+def fit_fold(X: np.ndarray, y: np.ndarray, model_type: str, params: Optional[Dict],
+             fold: int, bounds: Tuple[int, int, int, int]) -> Dict:
+    """Обучает и оценивает модель на одном фолде (выполняется в рабочем процессе)"""
+    train_start, train_end, test_start, test_end = bounds
+    # Срезы memmap - это представления, а не копии
+    X_train, y_train = X[train_start:train_end], y[train_start:train_end]
+    X_test, y_test = X[test_start:test_end], y[test_start:test_end]
+
+    started = time.perf_counter()
+    model = make_model(model_type, params, n_jobs=1)
+    model.fit(X_train, y_train)
+    fit_time = time.perf_counter() - started
+
+    y_pred = model.predict(X_test)
+    return {
+        "fold": fold,
+        "train_start": train_start,
+        "train_end": train_end,
+        "test_start": test_start,
+        "test_end": test_end,
+        "mae": mean_absolute_error(y_test, y_pred),
+        "rmse": float(np.sqrt(mean_squared_error(y_test, y_pred))),
+        "r2": r2_score(y_test, y_pred),
+        "fit_time": fit_time,
+    }
+
+
+def as_shared_arrays(X: np.ndarray, y: np.ndarray, temp_dir: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Возвращает X и y в виде memmap, чтобы рабочие процессы читали один файл вместо копий
+
+    Массивы, уже отображенные в память (например, из FeatureStore), возвращаются как есть.
+    """
+    if not isinstance(X, np.memmap):
+        path = os.path.join(temp_dir, "X.joblib")
+        joblib.dump(np.ascontiguousarray(X), path)
+        X = joblib.load(path, mmap_mode="r")
+    if not isinstance(y, np.memmap):
+        path = os.path.join(temp_dir, "y.joblib")
+        joblib.dump(np.ascontiguousarray(y), path)
+        y = joblib.load(path, mmap_mode="r")
+    return X, y
+
+
+def walk_forward_validate(X: np.ndarray, y: np.ndarray, model_type: str = "random_forest",
+                          params: Optional[Dict] = None, n_splits: int = 5,
+                          mode: str = "expanding", train_window: Optional[int] = None,
+                          n_jobs: int = -1) -> Tuple[pd.DataFrame, Dict]:
+    """
+    Выполняет walk-forward валидацию, обучая фолды параллельно в отдельных процессах
+
+    Args:
+        X: Матрица признаков (упорядочена по времени)
+        y: Целевая переменная
+        model_type: Тип модели
+        params: Гиперпараметры модели
+        n_splits: Количество фолдов
+        mode: "expanding" или "sliding"
+        train_window: Длина окна для режима "sliding"
+        n_jobs: Количество процессов (-1 - все ядра)
+
+    Returns:
+        Кортеж (DataFrame с метриками по фолдам, сводка)
+    """
+    splits = walk_forward_splits(len(y), n_splits, mode, train_window=train_window)
+
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        X_shared, y_shared = as_shared_arrays(X, y, temp_dir)
+        results = Parallel(n_jobs=n_jobs, backend="loky")(
+            delayed(fit_fold)(X_shared, y_shared, model_type, params, fold, bounds)
+            for fold, bounds in enumerate(splits)
+        )
+    wall_time = time.perf_counter() - started
+
+    folds_df = pd.DataFrame(results)
+    summary = {
+        "model_type": model_type,
+        "mode": mode,
+        "n_splits": n_splits,
+        "mae_mean": float(folds_df["mae"].mean()),
+        "mae_std": float(folds_df["mae"].std(ddof=0)),
+        "rmse_mean": float(folds_df["rmse"].mean()),
+        "rmse_std": float(folds_df["rmse"].std(ddof=0)),
+        "r2_mean": float(folds_df["r2"].mean()),
+        "r2_std": float(folds_df["r2"].std(ddof=0)),
+        "fit_time_total": float(folds_df["fit_time"].sum()),
+        "wall_time": wall_time,
+    }
+    return folds_df, summary
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+Тесты агентов: воспроизведение баров через конвейер, батчевый цикл watchlist,
+асинхронный конвейер стадий, шардирование watchlist, замеры задержек, лог коммуникации
+"""
+import sys
+import os
+import json
+import subprocess
+import threading
+import time
+
+# Добавляем корневую директорию в путь
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import joblib
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+from agents import sharding
+from agents.comm_log import CommunicationLog, JsonlLogWriter, LogWriter
+from agents.coordinator import AgentCoordinator
+from agents.decision_agent import DecisionMakingAgent
+from agents.execution_agent import ExecutionAgent
+from agents.instrumentation import LatencyRecorder
+from agents.market_monitor import MarketMonitoringAgent
+from agents.pipeline import AgentPipeline
+from agents.portfolio_coordinator import PortfolioCoordinator
+from agents.replay import run_replay
+from agents.sharding import ShardedCoordinator, shard_for
+from models.online import OnlineRegressor
+from models.registry import ModelRegistry
+from database.db_manager import DBManager
+from models.train_model import build_feature_matrix
+
+
+def make_ohlcv(n: int = 300, seed: int = 0, end="2024-06-28") -> pd.DataFrame:
+    """Синтетические дневные OHLCV бары (случайное блуждание)"""
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range(end=end, periods=n)
+    close = 100 * np.exp(np.cumsum(rng.normal(0.0005, 0.015, n)))
+    return pd.DataFrame({
+        "Open": close,
+        "High": close * (1 + rng.uniform(0, 0.02, n)),
+        "Low": close * (1 - rng.uniform(0, 0.02, n)),
+        "Close": close,
+        "Volume": rng.integers(1_000_000, 5_000_000, n).astype(float)
+    }, index=index)
+
+
+def test_online_replay_keeps_production_model(tmp_path, monkeypatch):
+    """Онлайн-воспроизведение дообучает копию модели: models/model.pkl и реестр не меняются"""
+    df = make_ohlcv()
+    X, y, _, _ = build_feature_matrix(df)
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("models")
+    joblib.dump(OnlineRegressor().fit(X, y), "models/model.pkl")
+    with open("models/model.pkl", "rb") as f:
+        model_bytes = f.read()
+    registry_entries = len(ModelRegistry().list_entries())
+
+    summary = run_replay(df, online_learning=True)
+
+    assert summary["n_cycles"] > 50 and summary["n_errors"] == 0
+    # Соединения временной БД закрыты до удаления директории (проверка через /proc - Linux)
+    if os.path.isdir("/proc/self/fd"):
+        assert not [fd for fd in os.listdir("/proc/self/fd")
+                    if "replay.db" in os.path.realpath(os.path.join("/proc/self/fd", fd))]
+    with open("models/model.pkl", "rb") as f:
+        assert f.read() == model_bytes
+    assert len(ModelRegistry().list_entries()) == registry_entries
+
+
+def test_cycle_values_other_holdings_at_their_prices(tmp_path, monkeypatch):
+    """Снимок капитала цикла по одному тикеру оценивает остальные позиции по их ценам, а не по его цене"""
+    db = DBManager(str(tmp_path / "test.db"))
+    user_id = db.create_user("trader", "hash")
+    db.create_portfolio(user_id, 1000.0)
+    db.update_holding(user_id, "AAPL", 10, 100.0, 1000.0)
+    db.update_holding(user_id, "MSFT", 5, 200.0, 1000.0)
+    coordinator = AgentCoordinator("AAPL", user_id=user_id, db_manager=db, verbose=False,
+                                   decision_agent=DecisionMakingAgent(str(tmp_path / "missing.pkl"),
+                                                                      verbose=False))
+    monkeypatch.setattr(coordinator.decision_agent, "process_market_update", lambda market_data: {
+        "type": "trading_decision", "ticker": market_data["ticker"], "decision": "HOLD",
+        "current_price": market_data["current_price"]
+    })
+
+    def cycle(ticker, price):
+        return coordinator.run_cycle({"type": "market_update", "ticker": ticker, "current_price": price})
+
+    # MSFT еще без цены - по средней цене покупки
+    assert cycle("AAPL", 110.0)["portfolio"]["portfolio_value"] == 1000.0 + 10 * 110.0 + 5 * 200.0
+    assert db.get_equity_curve(user_id, "minute")["equity"].iloc[-1] == 3100.0
+    cycle("MSFT", 150.0)
+    curve = db.get_equity_curve(user_id, "day")
+    assert curve["equity"].iloc[-1] == 1000.0 + 10 * 110.0 + 5 * 150.0
+    assert curve["holdings_value"].iloc[-1] == 10 * 110.0 + 5 * 150.0
+    coordinator.close()
+
+
+def save_online_model(df: pd.DataFrame, path: str):
+    """Обучает OnlineRegressor на барах и сохраняет его"""
+    X, y, _, _ = build_feature_matrix(df)
+    joblib.dump(OnlineRegressor().fit(X, y), path)
+
+
+def test_batch_decisions_match_single_updates(tmp_path):
+    """Одно батчевое предсказание на watchlist дает те же решения, что обработка по одному тикеру"""
+    model_path = str(tmp_path / "model.pkl")
+    save_online_model(make_ohlcv(), model_path)
+    updates = [MarketMonitoringAgent(ticker).build_market_update(make_ohlcv(60, seed=i))
+               for i, ticker in enumerate(["AAA", "BBB", "CCC", "DDD"])]
+    updates.insert(2, {"type": "error", "ticker": "EEE", "message": "No data available for EEE"})
+
+    batch = DecisionMakingAgent(model_path, verbose=False).process_market_updates(updates)
+    single = DecisionMakingAgent(model_path, verbose=False)
+    for update, message in zip(updates, batch):
+        expected = single.process_market_update(update)
+        assert message["type"] == expected["type"]
+        if expected["type"] == "trading_decision":
+            assert message["decision"] == expected["decision"]
+            assert abs(message["predicted_price"] - expected["predicted_price"]) < 1e-9
+    assert batch[2]["ticker"] == "EEE" and batch[2]["message"] == "No data available for EEE"
+
+
+def test_portfolio_cycle_sells_before_buys(tmp_path, monkeypatch):
+    """Продажа освобождает средства для покупки в том же цикле; ошибка тикера не прерывает цикл"""
+    execution_agent = ExecutionAgent(0, 0.0, data_dir=str(tmp_path), use_db=False)
+    execution_agent.portfolio["BBB"] = {"shares": 10, "avg_price": 100.0, "total_cost": 1000.0}
+    coordinator = PortfolioCoordinator(["AAA", "BBB", "CCC"], use_db=False, verbose=False,
+                                       decision_agent=DecisionMakingAgent(str(tmp_path / "missing.pkl"),
+                                                                          verbose=False),
+                                       execution_agent=execution_agent)
+    decisions = {"AAA": "BUY", "BBB": "SELL"}
+    monkeypatch.setattr(coordinator.decision_agent, "process_market_updates", lambda updates: [
+        {"type": "trading_decision", "ticker": u["ticker"], "decision": decisions[u["ticker"]],
+         "current_price": u["current_price"]} if u["type"] == "market_update" else {"type": "error"}
+        for u in updates
+    ])
+    result = coordinator.run_cycle({
+        "AAA": {"type": "market_update", "ticker": "AAA", "current_price": 10.0},
+        "BBB": {"type": "market_update", "ticker": "BBB", "current_price": 100.0},
+        "CCC": {"type": "error", "ticker": "CCC", "message": "No data available for CCC"},
+    })
+
+    assert result["status"] == "success" and result["n_errors"] == 1
+    assert result["tickers"]["CCC"]["step"] == "market_data"
+    assert execution_agent.get_trade_history()["action"].tolist() == ["SELL", "BUY"]
+    assert execution_agent.portfolio["AAA"]["shares"] == 5
+    assert result["portfolio"]["portfolio_value"] == 450.0 + 5 * 10.0 + 5 * 100.0
+    coordinator.close()
+
+
+def test_pipeline_backpressure_and_results(tmp_path, monkeypatch):
+    """Медленное исполнение ограничивает число загруженных наперед тикеров; результаты - по своим тикерам"""
+    tickers = [f"T{i:02d}" for i in range(40)]
+    execution_agent = ExecutionAgent(0, 10000.0, data_dir=str(tmp_path), use_db=False)
+    coordinator = PortfolioCoordinator(tickers, use_db=False, verbose=False,
+                                       decision_agent=DecisionMakingAgent(str(tmp_path / "missing.pkl"),
+                                                                          verbose=False),
+                                       execution_agent=execution_agent)
+    monkeypatch.setattr(coordinator.decision_agent, "process_market_updates", lambda updates: [
+        {"type": "trading_decision", "ticker": u["ticker"], "decision": "BUY", "current_price": u["current_price"]}
+        if u["type"] == "market_update" else {"type": "error", "message": u["message"]}
+        for u in updates
+    ])
+    lock = threading.Lock()
+    counts = {"fetched": 0, "executed": 0, "ahead": 0}
+
+    def fetch(ticker):
+        if ticker == "T05":
+            raise ConnectionError("timeout")
+        with lock:
+            counts["fetched"] += 1
+            counts["ahead"] = max(counts["ahead"], counts["fetched"] - counts["executed"])
+        return {"type": "market_update", "ticker": ticker, "current_price": 10.0 + int(ticker[1:])}
+
+    execute_trade = execution_agent.execute_trade
+
+    def slow_execute(decision):
+        time.sleep(0.005)
+        with lock:
+            counts["executed"] += 1
+        return execute_trade(decision)
+
+    monkeypatch.setattr(execution_agent, "execute_trade", slow_execute)
+    pipeline = AgentPipeline(coordinator, queue_size=2, fetch_concurrency=2, batch_size=2, fetch=fetch)
+    result = pipeline.run_cycle()
+
+    assert result["status"] == "success" and result["n_errors"] == 1
+    assert list(result["tickers"]) == tickers
+    assert "timeout" in result["tickers"]["T05"]["message"]
+    # Наперед: две очереди, батч, загрузки в процессе и элемент в исполнении
+    assert counts["ahead"] <= 2 * 2 + 2 + 2 + 2
+    assert result["timings"]["max_execution_queue"] <= 2
+    assert counts["executed"] == 39
+    history = execution_agent.get_trade_history()
+    assert (history["price"] == history["ticker"].str[1:].astype(int) + 10.0).all()
+
+
+def test_shard_for_is_stable_across_processes():
+    """Шард тикера не зависит от PYTHONHASHSEED процесса и всегда в диапазоне"""
+    tickers = [f"T{i:03d}" for i in range(200)] + ["AAPL", "MSFT"]
+    shards = [shard_for(ticker, 4) for ticker in tickers]
+    assert set(shards) == {0, 1, 2, 3}
+    assert (shard_for("AAPL", 4), shard_for("MSFT", 4)) == (0, 3)
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    code = (f"import sys; sys.path.insert(0, {root!r}); from agents.sharding import shard_for; "
+            f"print([shard_for(t, 4) for t in {tickers!r}])")
+    for seed in ["1", "2"]:
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                env={**os.environ, "PYTHONHASHSEED": seed}).stdout
+        assert output.strip() == str(shards)
+
+
+def test_stale_warm_ticker_refetches_month(monkeypatch):
+    """Тикер, простоявший дольше хвоста, загружается за месяц; свежий - только хвост"""
+    today = pd.Timestamp.now().normalize()
+    sharding._worker_state.clear()
+    sharding._worker_state["bars"] = {
+        "FRESH": make_ohlcv(20, end=today - pd.Timedelta(days=1)),
+        "STALE": make_ohlcv(20, end=today - pd.Timedelta(days=12)),
+    }
+    requests = {}
+
+    def fake_download(tickers, period, **kwargs):
+        requests[period] = list(tickers)
+        return pd.DataFrame()
+
+    monkeypatch.setattr(yf, "download", fake_download)
+    sharding._fetch_bars(["FRESH", "STALE", "NEW"], "1d")
+    sharding._worker_state.clear()
+
+    assert requests == {"1mo": ["STALE", "NEW"], sharding.TAIL_PERIOD: ["FRESH"]}
+
+
+def test_sharded_cycle_collects_worker_decisions(tmp_path, monkeypatch):
+    """Шарды покрывают все тикеры, процессы получают флаг online, решения попадают в историю родителя"""
+    monkeypatch.chdir(tmp_path)
+    model_path = str(tmp_path / "model.pkl")
+    save_online_model(make_ohlcv(), model_path)
+    tickers = ["AAA", "BBB", "CCC"]
+    bars = {ticker: make_ohlcv(40, seed=i) for i, ticker in enumerate(tickers)}
+
+    decision_agent = DecisionMakingAgent(model_path, online=True, checkpoint_every=0, verbose=False)
+    with ShardedCoordinator(tickers, n_shards=2, use_db=False, verbose=False,
+                            decision_agent=decision_agent) as coordinator:
+        result = coordinator.run_cycle(bars)
+        online_flags = [executor.submit(_worker_online).result() for executor in coordinator.executors]
+        shards = coordinator.partition()
+
+    assert sorted(sum(shards, [])) == tickers
+    assert all(shard_for(ticker, 2) == k for k, shard in enumerate(shards) for ticker in shard)
+    assert result["status"] == "success"
+    assert online_flags == [True, True]
+    history = decision_agent.get_decision_history()
+    assert sorted(history["ticker"]) == tickers
+
+
+def _worker_online() -> bool:
+    return sharding._worker_state["decision_agent"].online
+
+
+def test_sharded_online_checkpoints_only_in_parent(tmp_path, monkeypatch):
+    """Процессы не пишут чекпоинты; родитель выбирает модель шарда, сохраняет ее и раздает всем"""
+    monkeypatch.chdir(tmp_path)
+    model_path = str(tmp_path / "model.pkl")
+    save_online_model(make_ohlcv(), model_path)
+    tickers = ["AAA", "BBB", "CCC"]
+    history = {ticker: make_ohlcv(60, seed=i) for i, ticker in enumerate(tickers)}
+    registry = ModelRegistry(str(tmp_path / "registry"))
+    default_entries = len(ModelRegistry().list_entries())
+
+    decision_agent = DecisionMakingAgent(model_path, online=True, checkpoint_every=2, registry=registry,
+                                         verbose=False)
+    with ShardedCoordinator(tickers, n_shards=2, use_db=False, verbose=False,
+                            decision_agent=decision_agent) as coordinator:
+        for end in range(40, 45):
+            result = coordinator.run_cycle({ticker: bars.iloc[:end] for ticker, bars in history.items()})
+            assert result["status"] == "success"
+        shard_updates = [executor.submit(_worker_model_updates).result() for executor in coordinator.executors]
+
+    # 4 цикла с разметкой по 3 обновления: синхронизация после каждого цикла
+    entries = registry.list_entries(kind="online_checkpoint")
+    assert len(entries) == 4
+    assert entries["metrics"].iloc[0]["n_updates"] == 3 and decision_agent.online_updates == 12
+    assert len(set(shard_updates)) == 1
+    assert joblib.load(model_path).n_updates == shard_updates[0]
+    assert len(ModelRegistry().list_entries()) == default_entries
+
+
+def _worker_model_updates() -> int:
+    return sharding._worker_state["decision_agent"].model.n_updates
+
+
+def test_latency_recorder_percentiles(tmp_path):
+    """Процентили считаются по последним window замерам каждой пары (этап, тикер); счетчики не попадают"""
+    recorder = LatencyRecorder(window=100)
+    for i in range(300):
+        recorder.record("AAPL", {"fetch": float(i), "decision": 1.0, "n_batches": 3})
+    recorder.record("MSFT", {"fetch": 5.0})
+
+    summary = recorder.summary().set_index(["stage", "ticker"])
+    assert sorted(summary.index) == [("decision", "AAPL"), ("fetch", "AAPL"), ("fetch", "MSFT")]
+    fetch = summary.loc[("fetch", "AAPL")]
+    last = np.arange(200, 300, dtype=np.float64)
+    assert fetch["count"] == 100 and fetch["max_ms"] == 299.0
+    np.testing.assert_allclose(fetch[["p50_ms", "p95_ms", "p99_ms"]].to_numpy(dtype=np.float64),
+                               np.percentile(last, [50, 95, 99]))
+    assert recorder.summary("MSFT")["p99_ms"].tolist() == [5.0]
+
+    recorder.export_csv(str(tmp_path / "latency.csv"))
+    exported = pd.read_csv(tmp_path / "latency.csv")
+    assert len(exported) == 100 and exported["n_batches"].iloc[-2] == 3
+    recorder.reset()
+    assert recorder.summary().empty
+
+
+def test_communication_log_ring_and_jsonl_writer(tmp_path):
+    """В памяти - последние maxlen легких записей; на диск после flush попадают все"""
+    path = str(tmp_path / "log.jsonl")
+    log = CommunicationLog(maxlen=10, writer=JsonlLogWriter(path, batch_size=7, flush_interval=0.05))
+    for i in range(25):
+        log.log("MarketAgent", "DecisionAgent", {"type": "market_update", "ticker": f"T{i}",
+                                                 "current_price": float(i), "data": {"prices": [1, 2]}})
+    assert len(log) == 10 and log.to_list()[0]["ticker"] == "T15"
+    assert "data" not in log.to_list()[-1]
+
+    log.writer.flush()
+    with open(path, encoding="utf-8") as f:
+        written = [json.loads(line) for line in f]
+    assert [entry["ticker"] for entry in written] == [f"T{i}" for i in range(25)]
+    assert log.writer.written == 25 and log.writer.dropped == 0
+    log.close()
+    assert not log.writer._thread.is_alive()
+
+
+class BlockedWriter(LogWriter):
+    """Писатель, ожидающий разрешения на запись каждого пакета"""
+
+    def __init__(self, **kwargs):
+        self.release = threading.Event()
+        self.batches = []
+        super().__init__(**kwargs)
+
+    def write_batch(self, batch):
+        self.release.wait()
+        self.batches.append(batch)
+
+
+def test_log_writer_drops_when_queue_full():
+    """Медленная запись не блокирует log(): лишние записи отбрасываются и учитываются"""
+    writer = BlockedWriter(batch_size=1, flush_interval=0.01, max_queue=3)
+    log = CommunicationLog(writer=writer)
+    started = time.perf_counter()
+    for i in range(20):
+        log.log("DecisionAgent", "ExecutionAgent", {"type": "trading_decision", "ticker": f"T{i}"})
+    assert time.perf_counter() - started < 1.0
+    assert writer.dropped > 0 and len(log) == 20
+
+    writer.release.set()
+    log.close()
+    assert writer.written + writer.dropped == 20
+    assert writer.written == sum(len(batch) for batch in writer.batches)
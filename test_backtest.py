@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Тесты бэктеста: векторизованные правила совпадают с правилами агентов, перебор параметров,
+Monte Carlo траектории
+"""
+import sys
+import os
+
+# Добавляем корневую директорию в путь
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import LinearRegression
+
+from agents.decision_agent import ACTION_NAMES, DecisionMakingAgent
+from agents.execution_agent import ExecutionAgent
+from backtest.engine import max_drawdown, simulate_policy
+from backtest.monte_carlo import WARMUP_BARS, generate_paths, panel_features, run_monte_carlo
+from backtest.sweep import grid_to_columns, sweep_signals
+from models.train_model import build_feature_matrix
+
+
+def test_decide_batch_matches_decide(tmp_path):
+    """Векторизованное решение совпадает с поэлементным decide, включая пороги уверенности"""
+    agent = DecisionMakingAgent(str(tmp_path / "missing.pkl"), verbose=False)
+    rng = np.random.default_rng(0)
+    current = rng.uniform(0.5, 200, 2000)
+    current[:10] = 0.0
+    predicted = current * (1 + rng.normal(0, 0.04, 2000))
+    confidence = rng.choice([0.3, 0.5, 0.7, 0.81, 0.9], 2000)
+
+    actions = agent.decide_batch(current, predicted, confidence)
+    expected = [agent.decide(c, p, confidence=conf) for c, p, conf in zip(current, predicted, confidence)]
+    assert [ACTION_NAMES[int(a)] for a in actions] == expected
+    assert set(expected) == {"BUY", "SELL", "HOLD"}
+
+
+def test_simulate_policy_matches_execution_agent(tmp_path):
+    """Симуляция политики дает те же баланс, позицию и сделки, что ExecutionAgent по тем же сигналам"""
+    rng = np.random.default_rng(1)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, 300)))
+    actions = rng.choice([1, 0, -1], 300, p=[0.3, 0.4, 0.3]).astype(np.int8)
+    state = simulate_policy(close, actions, 10000.0, trade_percentage=0.2, sell_fraction=0.5)
+
+    agent = ExecutionAgent(1, 10000.0, data_dir=str(tmp_path), use_db=False,
+                           trade_percentage=0.2, sell_fraction=0.5)
+    for t, (price, action) in enumerate(zip(close, actions)):
+        result = agent.execute_trade({"type": "trading_decision", "ticker": "TEST",
+                                      "decision": ACTION_NAMES[int(action)], "current_price": float(price)})
+        shares = agent.portfolio.get("TEST", {}).get("shares", 0)
+        assert abs(state["balance"][t, 0] - agent.balance) < 1e-6
+        assert state["shares"][t, 0] == shares
+        traded = result.get("shares", 0) if result["status"] == "success" else 0
+        assert state["traded"][t, 0] == (traded if result.get("action") == "BUY" else -traded)
+
+
+def test_sweep_matches_single_runs(tmp_path):
+    """Блочный перебор комбинаций дает те же метрики, что отдельный прогон каждой комбинации"""
+    agent = DecisionMakingAgent(str(tmp_path / "missing.pkl"), verbose=False)
+    rng = np.random.default_rng(2)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, 250)))
+    predicted = close * (1 + rng.normal(0, 0.03, 250))
+    confidence = rng.choice([0.3, 0.7, 0.9], 250)
+    combos = grid_to_columns({"threshold": [0.01, 0.02], "min_abs_move": [0.0, 0.01],
+                              "sell_fraction": [0.5, 1.0]})
+    assert len(combos) == 8 and (combos["trade_percentage"] == 0.1).all()
+
+    results = sweep_signals(close, predicted, confidence, combos, agent, chunk_size=3)
+    for i, combo in combos.iterrows():
+        actions = agent.decide_batch(close, predicted, confidence, threshold=combo["threshold"],
+                                     low_confidence_multiplier=combo["low_confidence_multiplier"],
+                                     high_confidence_multiplier=combo["high_confidence_multiplier"],
+                                     min_abs_move=combo["min_abs_move"])
+        state = simulate_policy(close, actions, 10000.0, combo["trade_percentage"], combo["sell_fraction"])
+        assert results.loc[i, "final_equity"] == pytest.approx(state["equity"][-1, 0])
+        assert results.loc[i, "max_drawdown_pct"] == pytest.approx(max_drawdown(state["equity"])[0] * 100)
+        assert results.loc[i, "n_trades"] == np.count_nonzero(state["traded"])
+
+    with pytest.raises(ValueError):
+        grid_to_columns({"stop_loss": [0.1]})
+
+
+def make_ohlcv(n: int = 300, seed: int = 0) -> pd.DataFrame:
+    """Синтетические дневные OHLCV бары (случайное блуждание)"""
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0.0005, 0.015, n)))
+    return pd.DataFrame({
+        "Open": close * (1 + rng.normal(0, 0.005, n)),
+        "High": close * (1 + rng.uniform(0, 0.02, n)),
+        "Low": close * (1 - rng.uniform(0, 0.02, n)),
+        "Close": close,
+        "Volume": rng.integers(1_000_000, 5_000_000, n).astype(float)
+    }, index=pd.bdate_range(end="2024-06-28", periods=n))
+
+
+def test_generate_paths_bootstraps_history():
+    """Траектории формы (horizon, n_paths) из исторических доходностей; один seed - одни траектории"""
+    df = make_ohlcv()
+    paths = generate_paths(df, 50, horizon=40, block_size=5, rng=np.random.default_rng(0))
+    assert all(values.shape == (40, 50) for values in paths.values())
+    returns = paths["Close"][1:] / paths["Close"][:-1] - 1
+    historical = df["Close"].pct_change().to_numpy()[1:]
+    assert np.isin(np.round(returns, 12), np.round(historical, 12)).all()
+    assert (paths["High"] >= paths["Close"]).all() and (paths["Low"] <= paths["Close"]).all()
+
+    again = generate_paths(df, 50, horizon=40, block_size=5, rng=np.random.default_rng(0))
+    np.testing.assert_array_equal(again["Close"], paths["Close"])
+    with pytest.raises(ValueError):
+        generate_paths(df, 5, method="garch")
+    with pytest.raises(ValueError):
+        generate_paths(df.iloc[:WARMUP_BARS], 5)
+
+
+def test_panel_features_match_single_path():
+    """Признаки панели траекторий совпадают с build_feature_matrix по каждой траектории отдельно"""
+    df = make_ohlcv()
+    paths = generate_paths(df, 3, horizon=30, rng=np.random.default_rng(1))
+    X = panel_features(df, paths)
+    for j in range(3):
+        path_df = pd.concat([df.iloc[-WARMUP_BARS:].reset_index(drop=True),
+                             pd.DataFrame({column: values[:, j] for column, values in paths.items()})],
+                            ignore_index=True)
+        X_path, _, _, _ = build_feature_matrix(path_df, require_target=False)
+        np.testing.assert_allclose(X[:, j], X_path[-30:], rtol=1e-10)
+
+
+def test_monte_carlo_is_reproducible(tmp_path):
+    """Одинаковый seed дает одинаковые метрики; сводка считается по всем траекториям"""
+    df = make_ohlcv()
+    X, y, _, _ = build_feature_matrix(df)
+    model_path = str(tmp_path / "model.pkl")
+    joblib.dump(LinearRegression().fit(X, y), model_path)
+    agent = DecisionMakingAgent(model_path, verbose=False)
+
+    paths_df, summary = run_monte_carlo("TEST", agent, df=df, n_paths=40, horizon=30, seed=7, path_chunk=15)
+    again, _ = run_monte_carlo("TEST", agent, df=df, n_paths=40, horizon=30, seed=7, path_chunk=15)
+    assert len(paths_df) == summary["n_paths"] == 40
+    pd.testing.assert_frame_equal(paths_df, again)
+    assert summary["prob_loss"] == (paths_df["pnl"] < 0).mean()
+    assert summary["pnl"]["p5"] <= summary["pnl"]["p50"] <= summary["pnl"]["p95"]
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Тесты демона автоторговли: ошибка одной сессии не останавливает остальные,
+ежедневное обслуживание снимков капитала
+"""
+import sys
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+import yfinance as yf
+
+# Добавляем корневую директорию в путь
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from daemon import TradingDaemon
+from database.db_manager import DBManager
+
+
+class LockedDB:
+    """Заглушка БД: запись результатов и прогресса падает, как при заблокированной БД"""
+
+    def __init__(self):
+        self.saved_sessions = []
+
+    def add_cycle_results(self, rows):
+        raise sqlite3.OperationalError("database is locked")
+
+    def record_session_cycle(self, session_id, *args, **kwargs):
+        if session_id == 1:
+            raise sqlite3.OperationalError("database is locked")
+        self.saved_sessions.append(session_id)
+        return True
+
+
+class FakeExecutionAgent:
+    def __init__(self, fail_refresh: bool):
+        self.fail_refresh = fail_refresh
+
+    def refresh(self):
+        if self.fail_refresh:
+            raise sqlite3.OperationalError("database is locked")
+
+
+class FakeCoordinator:
+    def __init__(self, fail_refresh: bool = False):
+        self.execution_agent = FakeExecutionAgent(fail_refresh)
+        self.cycles = 0
+
+    def run_cycle(self):
+        self.cycles += 1
+        return {"status": "success", "tickers": {}, "portfolio": {"portfolio_value": 10000.0}}
+
+    def close(self):
+        pass
+
+
+def add_session(daemon: TradingDaemon, session_id: int, coordinator: FakeCoordinator, due: float):
+    daemon.sessions[session_id] = {
+        "session": {"id": session_id, "user_id": session_id, "tickers": "AAPL",
+                    "interval_seconds": 60, "max_cycles": None},
+        "coordinator": coordinator,
+        "next_due": due,
+        "n_cycles": 0,
+        "saved_cycles": 0
+    }
+
+
+def test_failing_db_does_not_stop_other_sessions():
+    """Ошибки записи в БД и обновления портфеля логируются, цикл переносится, остальные сессии идут"""
+    db = LockedDB()
+    daemon = TradingDaemon(db_manager=db)
+    saving_fails, refresh_fails = FakeCoordinator(), FakeCoordinator(fail_refresh=True)
+    due = time.monotonic()
+    add_session(daemon, 1, saving_fails, due)
+    add_session(daemon, 2, refresh_fails, due)
+
+    daemon.run_due()
+
+    # Цикл выполнен, но прогресс не сохранен - рестарт сессии по n_cycles не срабатывает
+    assert saving_fails.cycles == 1
+    assert daemon.sessions[1]["n_cycles"] == 1 and daemon.sessions[1]["saved_cycles"] == 0
+    # Портфель не обновился - цикл пропущен, ошибка записана в сессию
+    assert refresh_fails.cycles == 0
+    assert daemon.sessions[2]["n_cycles"] == 0 and db.saved_sessions == [2]
+    for session_id in (1, 2):
+        assert daemon.sessions[session_id]["next_due"] == due + 60
+
+
+def test_maintenance_revalues_idle_day_at_close(tmp_path, monkeypatch):
+    """Обслуживание заполняет вчерашний день по ценам закрытия, загруженным для тикеров портфелей"""
+    db = DBManager(str(tmp_path / "test.db"))
+    user_id = db.create_user("trader", "hash")
+    db.create_portfolio(user_id, 10000.0)
+    db.update_holding(user_id, "AAPL", 10, 100.0, 1000.0)
+    now = datetime.now()
+    db.record_equity_snapshot(user_id, 9000.0, 1000.0, 0.0, timestamp=now - timedelta(days=2))
+    requested = []
+
+    def fake_download(tickers, **kwargs):
+        requested.append(list(tickers))
+        return pd.DataFrame({"Close": [118.0, 120.0]},
+                            index=pd.to_datetime([now - timedelta(days=2), now - timedelta(days=1)]).normalize())
+
+    monkeypatch.setattr(yf, "download", fake_download)
+    daemon = TradingDaemon(db_manager=db)
+    daemon.run_maintenance()
+
+    assert requested == [["AAPL"]]
+    assert daemon.maintenance_day == now.strftime("%Y-%m-%d")
+    last_day = db.get_equity_curve(user_id, "day").iloc[-1]
+    assert last_day["bucket"] == (now - timedelta(days=1)).strftime("%Y-%m-%d")
+    assert (last_day["holdings_value"], last_day["equity"], last_day["pnl"]) == (1200.0, 10200.0, 200.0)
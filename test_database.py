@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+Тесты базы данных: миграции, планы запросов и транзакции DBManager
+"""
+import sys
+import os
+import sqlite3
+
+# Добавляем корневую директорию в путь
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from datetime import datetime
+
+import pytest
+
+from agents.execution_agent import ExecutionAgent
+from database.db_manager import DBManager
+from database.migrations import LATEST_VERSION, MIGRATIONS, current_version, migrate
+
+
+# Сделки с известным реализованным P&L по средней цене: 0 / +100 / -190 по дням
+PNL_TRADES = [
+    ("2024-01-01T10:00:00", "AAPL", "BUY", 10, 100.0, 9000.0),
+    ("2024-01-01T11:00:00", "AAPL", "BUY", 10, 120.0, 7800.0),
+    ("2024-01-02T10:00:00", "AAPL", "SELL", 5, 130.0, 8450.0),   # +100 к средней 110
+    ("2024-01-02T12:00:00", "MSFT", "BUY", 4, 50.0, 8250.0),
+    ("2024-01-03T10:00:00", "MSFT", "SELL", 4, 40.0, 8410.0),    # -40
+    ("2024-01-03T11:00:00", "AAPL", "SELL", 15, 100.0, 9910.0),  # -150
+]
+
+
+def make_db(tmp_path) -> DBManager:
+    """БД с пользователем, портфелем, сделками, логом и сессией"""
+    db = DBManager(str(tmp_path / "test.db"))
+    user_id = db.create_user("trader", "hash")
+    db.create_portfolio(user_id, 10000.0)
+    for i in range(20):
+        ticker = "AAPL" if i % 2 else "MSFT"
+        db.record_trade(user_id, ticker, "BUY", 1, 100.0 + i, 100.0 + i, 10000.0 - i, i + 1, 100.0, 100.0 * (i + 1),
+                        timestamp=f"2024-01-{i + 1:02d}T10:00:00")
+    return db
+
+
+def traced_queries(db: DBManager, user_id: int):
+    """Выполняет запросы DBManager и возвращает их SQL (с подставленными параметрами)"""
+    statements = []
+    conn = db.get_connection()
+    conn.set_trace_callback(statements.append)
+    conn.close()
+    try:
+        db.get_user_by_username("trader")
+        db.get_user_by_id(user_id)
+        db.get_portfolio(user_id)
+        db.get_holdings(user_id)
+        db.update_holding(user_id, "AAPL", 5, 100.0, 500.0)
+        db.update_portfolio_balance(user_id, 9000.0)
+        db.get_trade_history(user_id)
+        db.get_trade_history_count(user_id)
+        db.get_trade_history_page(user_id, page_size=5, after=("2024-01-10T10:00:00", 10))
+        db.get_trade_history_page(user_id, page_size=5, ticker="AAPL", start="2024-01-05", end="2024-01-15")
+        db.get_traded_tickers(user_id)
+        db.get_trade_stats(user_id)
+        db.get_daily_trade_summary(user_id)
+        db.get_equity_curve(user_id)
+        db.get_equity_curve(user_id, "hour", start="2024-01-01")
+        db.get_equity_curve(user_id, "minute", start="2024-01-01T10:00:00", end="2024-01-02T10:00:00")
+        db.get_user_ids()
+        db.get_user_ids(with_trades=True)
+        db.get_communication_log(user_id)
+        db.start_trading_session(user_id, ["AAPL"], 10.0)
+        db.get_trading_session(user_id)
+        db.get_active_trading_sessions()
+        db.get_cycle_results(user_id)
+        db.delete_holding(user_id, "MSFT")
+    finally:
+        conn = db.get_connection()
+        conn.set_trace_callback(None)
+        conn.close()
+    return [s for s in statements if s.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE"))]
+
+
+def test_migrations(tmp_path):
+    """Схема создается миграциями до последней версии, повторный запуск ничего не меняет"""
+    db = make_db(tmp_path)
+    conn = db.get_connection()
+    assert current_version(conn) == LATEST_VERSION
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    conn.close()
+    assert {"idx_trade_history_user_time", "idx_trade_history_user_ticker"} <= indexes
+
+    db.init_database()
+    conn = db.get_connection()
+    assert conn.execute("SELECT COUNT(*) FROM schema_version").fetchone()[0] == LATEST_VERSION
+    conn.close()
+
+
+def test_migrations_upgrade_baseline_database(tmp_path):
+    """БД со схемой до миграций (без schema_version) обновляется на месте без потери данных"""
+    path = str(tmp_path / "baseline.db")
+    conn = sqlite3.connect(path)
+    # Исходные четыре таблицы - те же CREATE TABLE IF NOT EXISTS, что и в первой миграции
+    for statement in MIGRATIONS[0][2]:
+        conn.execute(statement)
+    conn.execute("INSERT INTO users (id, username, password_hash) VALUES (1, 'trader', 'hash')")
+    conn.execute("INSERT INTO portfolios (user_id, balance) VALUES (1, 9910.0)")
+    conn.execute("INSERT INTO holdings (user_id, ticker, shares, avg_price, total_cost) "
+                 "VALUES (1, 'TSLA', 3, 10.0, 30.0)")
+    conn.executemany(
+        "INSERT INTO trade_history (user_id, timestamp, ticker, action, shares, price, total, balance_after) "
+        "VALUES (1, ?, ?, ?, ?, ?, ?, ?)",
+        [(ts, ticker, action, shares, price, shares * price, balance)
+         for ts, ticker, action, shares, price, balance in PNL_TRADES]
+    )
+    conn.commit()
+    conn.close()
+
+    db = DBManager(path)
+    assert db.get_user_by_username("trader")["id"] == 1
+    assert [h["ticker"] for h in db.get_holdings(1)] == ["TSLA"]
+    assert db.get_trade_history_count(1) == len(PNL_TRADES)
+    portfolio = db.get_portfolio(1)
+    assert (portfolio["balance"], portfolio["initial_balance"]) == (9910.0, 10000.0)
+    assert round(db.get_trade_stats(1)["realized_pnl"], 6) == -90.0
+
+    conn = db.get_connection()
+    try:
+        assert current_version(conn) == LATEST_VERSION
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert {"idx_trade_history_user_time", "idx_trade_history_user_day", "idx_trading_sessions_status"} <= indexes
+        # Повторный запуск ничего не применяет и не меняет
+        assert migrate(conn) == []
+    finally:
+        conn.close()
+    assert db.get_trade_history_count(1) == len(PNL_TRADES)
+
+
+# Запросы, которые по смыслу читают всю таблицу (список пользователей): допускается только
+# сканирование покрывающего индекса
+FULL_LIST_QUERIES = {"SELECT id FROM users", "SELECT DISTINCT user_id FROM trade_history"}
+
+
+def test_query_plans_use_indexes(tmp_path):
+    """Каждый запрос DBManager с WHERE/ORDER BY идет по индексу, без полного сканирования и сортировки"""
+    db = make_db(tmp_path)
+    user_id = db.get_user_by_username("trader")["id"]
+    queries = traced_queries(db, user_id)
+    assert len(queries) >= 25
+
+    conn = db.get_connection()
+    for query in queries:
+        plan = [row["detail"] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}")]
+        uses_index = any("USING" in step and "INDEX" in step or "PRIMARY KEY" in step for step in plan)
+        assert uses_index, f"No index used: {query}\n{plan}"
+        scans = [step for step in plan if step.startswith("SCAN")]
+        if query.strip() in FULL_LIST_QUERIES:
+            scans = [step for step in scans if "USING COVERING INDEX" not in step]
+        assert not scans, f"Full scan: {query}\n{plan}"
+        assert not any("TEMP B-TREE" in step for step in plan), f"Sort without index: {query}\n{plan}"
+    conn.close()
+
+
+def test_trade_history_pages(tmp_path):
+    """Обход страниц по курсору дает всю историю в порядке от новых к старым, без повторов"""
+    db = make_db(tmp_path)
+    user_id = db.get_user_by_username("trader")["id"]
+    # Сделки с одинаковым временем различаются по id
+    for _ in range(3):
+        db.record_trade(user_id, "AAPL", "SELL", 1, 120.0, 120.0, 10000.0, 0, 0.0, 0.0,
+                        timestamp="2024-01-10T10:00:00")
+
+    def walk(**filters):
+        ids, cursor = [], None
+        while True:
+            page, cursor = db.get_trade_history_page(user_id, page_size=4, after=cursor, **filters)
+            assert len(page) <= 4
+            ids.extend(page["id"].tolist())
+            if cursor is None:
+                return ids
+
+    history = db.get_trade_history(user_id)
+    expected = history.sort_values(["timestamp", "id"], ascending=False)
+    assert walk() == expected["id"].tolist()
+
+    filtered = expected[(expected["ticker"] == "AAPL") & (expected["timestamp"] >= "2024-01-05")
+                        & (expected["timestamp"] < "2024-01-15")]
+    assert walk(ticker="AAPL", start="2024-01-05", end="2024-01-15") == filtered["id"].tolist()
+    assert db.get_traded_tickers(user_id) == ["AAPL", "MSFT"]
+
+
+def test_trade_stats_and_daily_summary(tmp_path):
+    """Агрегаты по сделкам считаются в SQLite; реализованный P&L - по средней цене позиции"""
+    db = DBManager(str(tmp_path / "test.db"))
+    user_id = db.create_user("trader", "hash")
+    db.create_portfolio(user_id, 10000.0)
+    # Холдинг после сделки - как его ведет ExecutionAgent (стоимость уменьшается пропорционально)
+    positions = {}
+    for timestamp, ticker, action, shares, price, balance in PNL_TRADES:
+        held, cost = positions.get(ticker, (0, 0.0))
+        if action == "BUY":
+            held, cost = held + shares, cost + shares * price
+        else:
+            held, cost = held - shares, cost * (held - shares) / held
+        positions[ticker] = (held, cost)
+        db.record_trade(user_id, ticker, action, shares, price, shares * price, balance, held,
+                        cost / held if held else 0.0, cost, timestamp=timestamp)
+
+    stats = db.get_trade_stats(user_id)
+    assert (stats["total_trades"], stats["buy_count"], stats["sell_count"]) == (6, 3, 3)
+    assert stats["buy_total"] == 1000.0 + 1200.0 + 200.0
+    assert stats["sell_total"] == 650.0 + 160.0 + 1500.0
+    assert stats["first_trade_at"] == "2024-01-01T10:00:00"
+    assert abs(stats["realized_pnl"] - (100.0 - 40.0 - 150.0)) < 1e-9
+
+    daily = db.get_daily_trade_summary(user_id)
+    assert daily["day"].tolist() == ["2024-01-01", "2024-01-02", "2024-01-03"]
+    assert daily["trades"].tolist() == [2, 2, 2]
+    assert daily["balance"].tolist() == [7800.0, 8250.0, 9910.0]
+    assert [round(x, 9) for x in daily["realized_pnl"]] == [0.0, 100.0, -190.0]
+
+    empty = db.get_trade_stats(db.create_user("other", "hash"))
+    assert (empty["total_trades"], empty["realized_pnl"]) == (0, 0.0)
+
+
+def test_equity_snapshots(tmp_path):
+    """Снимки капитала сворачиваются в минуту/час/день, старые удаляются, пустые дни заполняются"""
+    db = DBManager(str(tmp_path / "test.db"))
+    user_id = db.create_user("trader", "hash")
+    for minute, holdings_value in [(0, 0.0), (0, 500.0), (30, 200.0), (90, 300.0)]:
+        ts = datetime(2024, 1, 1, 10 + minute // 60, minute % 60, 15)
+        db.record_equity_snapshot(user_id, 10000.0, holdings_value, holdings_value, timestamp=ts)
+
+    minutes = db.get_equity_curve(user_id, "minute")
+    assert minutes["bucket"].tolist() == ["2024-01-01T10:00:00", "2024-01-01T10:30:00", "2024-01-01T11:30:00"]
+    hours = db.get_equity_curve(user_id, "hour")
+    assert hours["equity"].tolist() == [10200.0, 10300.0]
+    assert (hours["equity_high"].iloc[0], hours["equity_low"].iloc[0]) == (10500.0, 10000.0)
+    day = db.get_equity_curve(user_id, "day")
+    assert day[["bucket", "equity", "pnl"]].values.tolist() == [["2024-01-01", 10300.0, 300.0]]
+
+    assert db.carry_forward_equity_snapshots("2024-01-02") == 1
+    assert db.carry_forward_equity_snapshots("2024-01-02") == 0
+    assert db.get_equity_curve(user_id, "day")["equity"].tolist() == [10300.0, 10300.0]
+
+    # Минутные снимки старше 2 дней удаляются, часовые и дневные остаются
+    assert db.prune_equity_snapshots(now=datetime(2024, 1, 4)) == 3
+    assert db.get_equity_curve(user_id, "minute").empty
+    assert len(db.get_equity_curve(user_id, "hour")) == 2
+
+
+def test_carry_forward_revalues_holdings(tmp_path):
+    """Пустой день заполняется по ценам закрытия; без цены тикера стоимость переносится как есть"""
+    db = DBManager(str(tmp_path / "test.db"))
+    user_id = db.create_user("trader", "hash")
+    db.create_portfolio(user_id, 10000.0)
+    db.update_holding(user_id, "AAPL", 10, 100.0, 1000.0)
+    db.update_holding(user_id, "MSFT", 5, 200.0, 1000.0)
+    db.record_equity_snapshot(user_id, 8000.0, 2000.0, 0.0, timestamp=datetime(2024, 1, 1, 16, 0))
+    assert db.get_held_tickers() == ["AAPL", "MSFT"]
+
+    assert db.carry_forward_equity_snapshots("2024-01-02", {"AAPL": 110.0}) == 1
+    assert db.carry_forward_equity_snapshots("2024-01-03", {"AAPL": 110.0, "MSFT": 190.0}) == 1
+    curve = db.get_equity_curve(user_id, "day")
+    assert curve[["bucket", "holdings_value", "equity", "pnl"]].values.tolist() == [
+        ["2024-01-01", 2000.0, 10000.0, 0.0],
+        ["2024-01-02", 2000.0, 10000.0, 0.0],
+        ["2024-01-03", 2050.0, 10050.0, 50.0],
+    ]
+
+
+def test_realized_pnl_backfill(tmp_path):
+    """Миграция заполняет realized_pnl существующей истории; импорт пересчитывает его"""
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE schema_version (version INTEGER PRIMARY KEY, name TEXT NOT NULL, "
+                 "applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    for version, name, statements in MIGRATIONS[:6]:
+        for statement in statements:
+            conn.execute(statement)
+        conn.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (version, name))
+    conn.execute("INSERT INTO users (id, username, password_hash) VALUES (1, 'trader', 'hash')")
+    conn.executemany("""
+        INSERT INTO trade_history (user_id, timestamp, ticker, action, shares, price, total, balance_after)
+        VALUES (1, ?, ?, ?, ?, ?, ?, ?)
+    """, [(ts, ticker, action, shares, price, shares * price, balance)
+          for ts, ticker, action, shares, price, balance in PNL_TRADES])
+    conn.commit()
+    conn.close()
+
+    db = DBManager(path)
+    assert abs(db.get_trade_stats(1)["realized_pnl"] - (-90.0)) < 1e-9
+    assert [round(x, 9) for x in db.get_daily_trade_summary(1)["realized_pnl"]] == [0.0, 100.0, -190.0]
+
+    trades = db.get_trade_history(1).to_dict("records")
+    db.import_portfolios([{"user_id": 1, "initial_balance": 10000.0, "balance": 9910.0,
+                           "holdings": {}, "trades": trades}], replace=True)
+    assert abs(db.get_trade_stats(1)["realized_pnl"] - (-90.0)) < 1e-9
+
+
+def test_initial_balance_backfill(tmp_path):
+    """Миграция заполняет стартовый капитал существующих портфелей по первой сделке"""
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE schema_version (version INTEGER PRIMARY KEY, name TEXT NOT NULL, "
+                 "applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    for version, name, statements in MIGRATIONS[:5]:
+        for statement in statements:
+            conn.execute(statement)
+        conn.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (version, name))
+    conn.executemany("INSERT INTO users (id, username, password_hash) VALUES (?, ?, 'hash')",
+                     [(1, "trader"), (2, "idle")])
+    conn.executemany("INSERT INTO portfolios (user_id, balance) VALUES (?, ?)", [(1, 4800.0), (2, 7000.0)])
+    conn.executemany("""
+        INSERT INTO trade_history (user_id, timestamp, ticker, action, shares, price, total, balance_after)
+        VALUES (1, ?, 'AAPL', ?, 10, 100.0, 1000.0, ?)
+    """, [("2024-01-02T10:00:00", "SELL", 4800.0), ("2024-01-01T10:00:00", "BUY", 3800.0)])
+    conn.commit()
+    conn.close()
+
+    db = DBManager(path)
+    assert db.get_portfolio(1)["initial_balance"] == 4800.0
+    assert db.get_portfolio(2)["initial_balance"] == 7000.0
+
+
+def test_reset_and_bulk_import(tmp_path):
+    """Сброс портфеля одной транзакцией; журналы режима без БД переносятся в БД один раз"""
+    from agents.execution_agent import ExecutionAgent
+    from database.bulk_import import migrate_history_files
+
+    db = make_db(tmp_path)
+    user_id = db.get_user_by_username("trader")["id"]
+    assert db.get_holdings(user_id)
+    assert db.reset_portfolio(user_id, 10000.0)
+    assert db.get_holdings(user_id) == []
+    assert db.get_portfolio(user_id)["balance"] == 10000.0
+
+    data_dir = tmp_path / "data"
+    other_id = db.create_user("file_mode", "hash")
+    agent = ExecutionAgent(other_id, data_dir=str(data_dir), use_db=False)
+    for action, price in [("BUY", 100.0), ("BUY", 80.0), ("SELL", 120.0)]:
+        agent.execute_trade({"type": "trading_decision", "ticker": "AAPL", "decision": action,
+                             "current_price": price, "confidence": 0.1})
+    ExecutionAgent(999, data_dir=str(data_dir), use_db=False).execute_trade(
+        {"type": "trading_decision", "ticker": "AAPL", "decision": "BUY", "current_price": 10.0})
+
+    files = {path.name: path.stat().st_mtime_ns for path in data_dir.iterdir()}
+
+    # Пользователя 999 нет в БД - его журнал пропускается
+    stats = migrate_history_files(db, str(data_dir))
+    assert (stats["users"], stats["trades"], stats["skipped"]) == (1, 3, 1)
+    assert db.get_trade_history_count(other_id) == 3
+    assert abs(db.get_portfolio(other_id)["balance"] - agent.balance) < 1e-9
+    holding = db.get_holdings(other_id)[0]
+    assert (holding["shares"], holding["total_cost"]) == (agent.portfolio["AAPL"]["shares"],
+                                                          agent.portfolio["AAPL"]["total_cost"])
+    # Импорт только читает журналы: снимки и новые файлы не создаются
+    assert {path.name: path.stat().st_mtime_ns for path in data_dir.iterdir()} == files
+
+    assert migrate_history_files(db, str(data_dir))["users"] == 0
+    assert db.get_trade_history_count(other_id) == 3
+
+
+def test_record_trade_is_atomic(tmp_path):
+    """Сбой на обновлении баланса откатывает и сделку, и холдинг; агент возвращается к состоянию БД"""
+    db = make_db(tmp_path)
+    user_id = db.get_user_by_username("trader")["id"]
+    with db.connection() as conn:
+        conn.execute("""
+            CREATE TRIGGER fail_balance BEFORE UPDATE OF balance ON portfolios
+            BEGIN SELECT RAISE(ABORT, 'balance update failed'); END
+        """)
+        conn.commit()
+    n_trades = db.get_trade_history_count(user_id)
+    holdings = db.get_holdings(user_id)
+    balance = db.get_portfolio(user_id)["balance"]
+
+    with pytest.raises(sqlite3.IntegrityError):
+        db.record_trade(user_id, "TSLA", "BUY", 2, 50.0, 100.0, balance - 100.0, 2, 50.0, 100.0)
+    assert db.get_trade_history_count(user_id) == n_trades
+    assert db.get_holdings(user_id) == holdings
+
+    agent = ExecutionAgent(user_id, db_manager=db)
+    portfolio = {ticker: dict(holding) for ticker, holding in agent.portfolio.items()}
+    result = agent.execute_trade({"type": "trading_decision", "ticker": "AAPL", "decision": "SELL",
+                                  "current_price": 120.0})
+    assert result["type"] == "error" and "balance update failed" in result["message"]
+    assert agent.balance == balance and agent.portfolio == portfolio
+    assert db.get_trade_history_count(user_id) == n_trades
+    assert db.get_pool_stats()["in_use"] == 0
+
+
+def test_nested_calls_share_outer_transaction(tmp_path):
+    """Вызовы DBManager внутри transaction() фиксируются и откатываются вместе с внешней транзакцией"""
+    db = make_db(tmp_path)
+    user_id = db.get_user_by_username("trader")["id"]
+    db.reset_portfolio(user_id, 100.0)
+
+    try:
+        with db.transaction() as conn:
+            conn.execute("UPDATE portfolios SET balance = 5 WHERE user_id = ?", (user_id,))
+            db.update_holding(user_id, "TSLA", 1, 10.0, 10.0)
+            conn.execute("INSERT INTO holdings (user_id, ticker, shares, avg_price, total_cost) "
+                         "VALUES (?, 'NVDA', 1, 1.0, 1.0)", (user_id,))
+            raise RuntimeError("abort")
+    except RuntimeError:
+        pass
+    assert db.get_portfolio(user_id)["balance"] == 100.0
+    assert db.get_holdings(user_id) == []
+
+    with db.transaction() as conn:
+        conn.execute("UPDATE portfolios SET balance = 5 WHERE user_id = ?", (user_id,))
+        db.update_holding(user_id, "TSLA", 1, 10.0, 10.0)
+    assert db.get_portfolio(user_id)["balance"] == 5.0
+    assert [h["ticker"] for h in db.get_holdings(user_id)] == ["TSLA"]
+    assert db.get_pool_stats()["in_use"] == 0
+
+
+def test_checkout_releases_write_lock_on_error(tmp_path):
+    """Исключение между записью и возвратом соединения не оставляет открытую транзакцию"""
+    db = make_db(tmp_path)
+    user_id = db.get_user_by_username("trader")["id"]
+    try:
+        with db.connection() as conn:
+            conn.execute("UPDATE portfolios SET balance = 1 WHERE user_id = ?", (user_id,))
+            raise RuntimeError("abort")
+    except RuntimeError:
+        pass
+    conn = db.get_connection()
+    assert not conn.in_transaction
+    conn.close()
+    assert db.get_pool_stats()["in_use"] == 0
+
+    # Другое соединение может сразу писать (блокировка WAL снята)
+    other = sqlite3.connect(db.db_path, timeout=0)
+    other.execute("UPDATE portfolios SET balance = 2 WHERE user_id = ?", (user_id,))
+    other.commit()
+    other.close()
+    assert db.get_portfolio(user_id)["balance"] == 2.0
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Тесты моделей: кэш признаков, walk-forward валидация, подбор гиперпараметров,
+онлайн-дообучение, признаки float32
+"""
+import sys
+import os
+from datetime import datetime, timedelta
+
+# Добавляем корневую директорию в путь
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+
+from agents.decision_agent import DecisionMakingAgent
+from models.feature_store import PERIOD_DAYS, WARMUP_DAYS, FeatureStore
+from models.online import CLOSE_INDEX, OnlineRegressor
+from models.registry import ModelRegistry
+from models import train_model
+from models.train_model import build_feature_matrix, check_float32_parity
+from models.tuning import search_hyperparameters
+from models.validation import walk_forward_splits, walk_forward_validate
+
+
+COLUMNS = ["a", "b"]
+
+
+def test_feature_store_appends_tail_and_trims(tmp_path):
+    """Повторная загрузка достраивает только новые строки; окно обрезается по периоду"""
+    dates = pd.bdate_range(end=pd.Timestamp(datetime.utcnow()).normalize(), periods=320).values
+    X_full = np.arange(len(dates) * 2, dtype=np.float64).reshape(-1, 2)
+    y_full = np.arange(len(dates), dtype=np.float64)
+    visible = {"n": len(dates) - 5}
+    starts = []
+
+    def builder(start):
+        starts.append(start)
+        mask = np.arange(len(dates)) < visible["n"]
+        if start is not None:
+            mask &= dates >= np.datetime64(start, "ns")
+        return X_full[mask], y_full[mask], COLUMNS, dates[mask]
+
+    store = FeatureStore(str(tmp_path), max_age=timedelta(0))
+    X, y, columns, cached_dates = store.get("TEST", "1y", 1, builder)
+    assert starts == [None] and columns == COLUMNS
+    # Строки старше периода отрезаются при чтении
+    cutoff = np.datetime64(datetime.utcnow() - timedelta(days=PERIOD_DAYS["1y"]), "ns")
+    assert cached_dates[0] >= cutoff and (dates[:visible["n"]] >= cutoff).sum() == len(y)
+
+    visible["n"] = len(dates)
+    X, y, _, cached_dates = store.get("TEST", "1y", 1, builder)
+    # Кэш устарел: запрошен только хвост с запасом на прогрев, дописаны 5 новых строк
+    last_date = pd.Timestamp(dates[-6]).to_pydatetime()
+    assert starts[1] == last_date - timedelta(days=WARMUP_DAYS)
+    assert store._read_meta(store._entry_dir("TEST", "1y", 1, "float64"))["n_rows"] == len(dates)
+    np.testing.assert_array_equal(X, X_full[-len(y):])
+    np.testing.assert_array_equal(cached_dates, dates[-len(y):])
+
+
+def test_feature_store_schema_version_invalidates(tmp_path):
+    """Новая версия схемы - отдельная запись кэша; другие колонки в старой версии - ошибка"""
+    dates = pd.bdate_range(end="2024-06-28", periods=10).values
+    X, y = np.ones((10, 2)), np.ones(10)
+    store = FeatureStore(str(tmp_path))
+    assert store.append("TEST", "max", 1, X, y, COLUMNS, dates) == 10
+    assert store.append("TEST", "max", 1, X, y, COLUMNS, dates) == 0
+
+    calls = []
+    store.get("TEST", "max", 2, lambda start: calls.append(start) or (X * 2, y, COLUMNS, dates))
+    assert calls == [None]
+    assert store.load("TEST", "max", 2)[0][0, 0] == 2.0
+    assert store.load("TEST", "max", 1)[0][0, 0] == 1.0
+    with pytest.raises(ValueError):
+        store.append("TEST", "max", 1, X, y, ["a", "c"], dates)
+
+
+@pytest.mark.parametrize("mode", ["expanding", "sliding"])
+def test_walk_forward_splits_have_no_look_ahead(mode):
+    """Обучение каждого фолда заканчивается до начала его теста; тесты идут подряд до конца данных"""
+    splits = walk_forward_splits(100, n_splits=4, mode=mode, train_window=30)
+    assert len(splits) == 4
+    for k, (train_start, train_end, test_start, test_end) in enumerate(splits):
+        assert 0 <= train_start < train_end <= test_start < test_end
+        if mode == "expanding":
+            assert train_start == 0
+        else:
+            # Окно фиксированной длины (короче - только у первых фолдов без истории)
+            assert train_end - train_start == min(30, test_start)
+        if k > 0:
+            assert test_start == splits[k - 1][3]
+    assert splits[-1][3] == 100
+    with pytest.raises(ValueError):
+        walk_forward_splits(4, n_splits=5)
+
+
+def make_regression(n: int = 120, seed: int = 0):
+    """Линейная зависимость с небольшим шумом"""
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, 3))
+    return X, X @ np.array([1.0, -2.0, 0.5]) + rng.normal(scale=0.01, size=n)
+
+
+def test_walk_forward_validate_reports_each_fold():
+    """Метрики считаются по каждому фолду на данных после его окна обучения"""
+    X, y = make_regression()
+    folds, summary = walk_forward_validate(X, y, model_type="linear", n_splits=3, n_jobs=1)
+    assert folds["fold"].tolist() == [0, 1, 2]
+    assert (folds["train_end"] <= folds["test_start"]).all()
+    assert summary["mae_mean"] < 0.05
+
+
+def test_successive_halving_survivors():
+    """Каждый раунд оставляет 1/eta кандидатов и дает им в eta раз больше фолдов; фолды не переобучаются"""
+    X, y = make_regression()
+    space = {"fit_intercept": [True, False], "positive": [False, True]}
+    results, summary = search_hyperparameters(X, y, model_type="linear", strategy="grid", space=space,
+                                              n_splits=3, eta=2, min_folds=1, n_jobs=1)
+    assert [(r["n_candidates"], r["n_folds"], r["n_fits"]) for r in summary["rungs"]] == [
+        (4, 1, 4), (2, 2, 2), (1, 3, 1)
+    ]
+    assert (summary["n_fits"], summary["n_fits_full"]) == (7, 12)
+    assert results["n_folds"].tolist() == [3, 2, 1, 1]
+    assert results.iloc[0]["params"] == summary["best_params"]
+
+    _, full = search_hyperparameters(X, y, model_type="linear", strategy="grid", space=space,
+                                     n_splits=3, halving=False, n_jobs=1)
+    assert full["n_fits"] == full["n_fits_full"] == 12
+
+
+def make_price_features(n: int, seed: int = 0):
+    """Признаки с ценой закрытия в колонке CLOSE_INDEX и целью - ценой на 1% выше"""
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, CLOSE_INDEX + 6))
+    X[:, CLOSE_INDEX] = rng.uniform(90, 110, n)
+    return X, X[:, CLOSE_INDEX] * 1.01
+
+
+def test_online_regressor_partial_fit():
+    """partial_fit считает обновления и сдвигает предсказание к новой цели"""
+    X, y = make_price_features(200)
+    model = OnlineRegressor(eta0=0.01).fit(X, y)
+    assert model.n_updates == 200
+    before = np.abs(model.predict(X) - X[:, CLOSE_INDEX] * 1.05).mean()
+    for _ in range(20):
+        model.partial_fit(X, X[:, CLOSE_INDEX] * 1.05)
+    assert model.n_updates == 200 + 20 * 200
+    assert np.abs(model.predict(X) - X[:, CLOSE_INDEX] * 1.05).mean() < before
+
+
+def test_update_online_labels_pending_bar(tmp_path):
+    """Бар размечается ценой следующего бара, повтор того же бара не обучает; чекпоинт - в свой реестр"""
+    X, y = make_price_features(200)
+    model_path = str(tmp_path / "model.pkl")
+    joblib.dump(OnlineRegressor().fit(X, y), model_path)
+    registry = ModelRegistry(str(tmp_path / "registry"))
+    agent = DecisionMakingAgent(model_path, online=True, checkpoint_every=2, registry=registry, verbose=False)
+
+    def bar(i):
+        return {"ticker": "TEST", "bar_time": f"2024-01-{i + 1:02d}", "current_price": float(X[i, CLOSE_INDEX])}
+
+    assert agent.update_online(bar(0), X[:1], 100.0) is None
+    assert agent.pending_bars["TEST"][0] == "2024-01-01"
+    assert agent.update_online(bar(0), X[:1], 100.0) is None
+    update = agent.update_online(bar(1), X[1:2], 101.0)
+    assert (update["bar_time"], update["label"], update["n_updates"]) == ("2024-01-01", bar(1)["current_price"], 1)
+    assert agent.online_abs_errors == [abs(100.0 - bar(1)["current_price"])]
+    assert agent.pending_bars["TEST"][0] == "2024-01-02"
+
+    agent.update_online(bar(2), X[2:3], 102.0)
+    assert len(registry.list_entries(kind="online_checkpoint")) == 1
+    assert joblib.load(model_path).n_updates == 202
+
+
+def make_ohlcv(n: int = 400, seed: int = 0) -> pd.DataFrame:
+    """Синтетические дневные OHLCV бары (случайное блуждание)"""
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0.0005, 0.015, n)))
+    return pd.DataFrame({
+        "Open": close,
+        "High": close * (1 + rng.uniform(0, 0.02, n)),
+        "Low": close * (1 - rng.uniform(0, 0.02, n)),
+        "Close": close,
+        "Volume": rng.integers(1_000_000, 5_000_000, n).astype(float)
+    }, index=pd.bdate_range(end="2024-06-28", periods=n))
+
+
+def test_float32_feature_matrix_parity(monkeypatch):
+    """Матрица float32 вдвое меньше и совпадает с float64 в пределах точности; модели сопоставимы"""
+    df = make_ohlcv()
+    X64, y64, columns, dates64 = build_feature_matrix(df, "float64")
+    X32, y32, _, dates32 = build_feature_matrix(df, "float32")
+    assert X32.dtype == np.float32 and X32.nbytes * 2 == X64.nbytes
+    np.testing.assert_array_equal(dates32, dates64)
+    np.testing.assert_allclose(X32, X64, rtol=1e-4, atol=1e-6)
+    np.testing.assert_allclose(y32, y64, rtol=1e-6)
+
+    # Онлайн-модель и агент решений берут цену из колонки Close матрицы признаков
+    np.testing.assert_array_equal(X64[:, CLOSE_INDEX], df.loc[dates64, "Close"].to_numpy())
+
+    monkeypatch.setattr(train_model, "download_history", lambda ticker, period: df)
+    parity = check_float32_parity("TEST", model_type="linear")
+    assert parity["passed"]
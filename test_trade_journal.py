@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Тесты журнала сделок режима без БД: снимок + хвост дают то же состояние, что полное воспроизведение;
+стоимость позиции после частичной продажи
+"""
+import sys
+import os
+import random
+
+# Добавляем корневую директорию в путь
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from agents.execution_agent import ExecutionAgent
+from agents.trade_journal import TradeJournal
+from database.db_manager import DBManager
+
+
+def run_trades(agent: ExecutionAgent, n: int, seed: int = 0):
+    rng = random.Random(seed)
+    for _ in range(n):
+        agent.execute_trade({
+            "type": "trading_decision",
+            "ticker": rng.choice(["AAPL", "MSFT"]),
+            "decision": rng.choice(["BUY", "BUY", "SELL"]),
+            "current_price": 50 + rng.random() * 100,
+            "confidence": 0.1
+        })
+
+
+def test_restart_from_snapshot_and_tail(tmp_path):
+    """Перезапуск читает снимок и хвост журнала; состояние совпадает с полным воспроизведением"""
+    agent = ExecutionAgent(1, data_dir=str(tmp_path), use_db=False)
+    agent.journal.snapshot_every = 25
+    run_trades(agent, 120)
+    n_trades = len(agent.get_trade_history())
+    assert os.path.exists(agent.journal.snapshot_path)
+    assert 0 < agent.journal.trades_since_snapshot < 25
+
+    restarted = ExecutionAgent(1, data_dir=str(tmp_path), use_db=False)
+    assert restarted.journal.trades_since_snapshot == agent.journal.trades_since_snapshot
+
+    replayed = ExecutionAgent(1, data_dir=str(tmp_path), use_db=False)
+    replayed.balance, replayed.portfolio = replayed.initial_balance, {}
+    replayed._reconstruct_portfolio(replayed.journal.load(use_snapshot=False)[1])
+
+    for other in (restarted, replayed):
+        assert abs(other.balance - agent.balance) < 1e-6
+        assert {t: h["shares"] for t, h in other.portfolio.items()} == \
+               {t: h["shares"] for t, h in agent.portfolio.items()}
+    assert len(restarted.get_trade_history()) == n_trades
+
+
+def test_legacy_csv_and_reset(tmp_path):
+    """Старый CSV (без снимка) воспроизводится целиком; сброс удаляет журнал и снимок"""
+    agent = ExecutionAgent(2, data_dir=str(tmp_path), use_db=False)
+    run_trades(agent, 10, seed=1)
+    agent.get_trade_history().to_csv(agent.history_file, index=False)
+
+    restarted = ExecutionAgent(2, data_dir=str(tmp_path), use_db=False)
+    assert abs(restarted.balance - agent.balance) < 1e-6
+
+    restarted.save_history()
+    restarted.reset_portfolio()
+    assert not os.path.exists(restarted.history_file)
+    assert not os.path.exists(TradeJournal(restarted.history_file).snapshot_path)
+    assert restarted.get_trade_history().empty
+
+
+def trade(agent: ExecutionAgent, decision: str, price: float):
+    return agent.execute_trade({"type": "trading_decision", "ticker": "AAPL", "decision": decision,
+                                "current_price": price})
+
+
+def test_partial_sell_reduces_cost_basis(tmp_path):
+    """Частичная продажа списывает стоимость позиции по средней цене - в памяти, снимке и БД"""
+    agent = ExecutionAgent(3, 1000.0, data_dir=str(tmp_path), use_db=False, trade_percentage=1.0)
+    agent.journal.snapshot_every = 2
+    trade(agent, "BUY", 100.0)
+    trade(agent, "SELL", 150.0)
+    trade(agent, "SELL", 120.0)
+    assert agent.portfolio["AAPL"] == {"shares": 3, "avg_price": 100.0, "total_cost": 300.0}
+    summary = agent.get_portfolio_summary(120.0)
+    assert summary["total_invested"] == 300.0
+    assert summary["holdings"]["AAPL"]["unrealized_pnl"] == 60.0
+
+    restarted = ExecutionAgent(3, 1000.0, data_dir=str(tmp_path), use_db=False)
+    replayed = ExecutionAgent(3, 1000.0, data_dir=str(tmp_path), use_db=False)
+    replayed.balance, replayed.portfolio = replayed.initial_balance, {}
+    replayed._reconstruct_portfolio(replayed.journal.load(use_snapshot=False)[1])
+    for other in (restarted, replayed):
+        assert other.portfolio == agent.portfolio
+
+    db = DBManager(str(tmp_path / "test.db"))
+    user_id = db.create_user("trader", "hash")
+    db.create_portfolio(user_id, 1000.0)
+    db_agent = ExecutionAgent(user_id, 1000.0, db_manager=db, trade_percentage=1.0)
+    trade(db_agent, "BUY", 100.0)
+    trade(db_agent, "SELL", 150.0)
+    trade(db_agent, "SELL", 120.0)
+    holding = db.get_holdings(user_id)[0]
+    assert (holding["shares"], holding["total_cost"]) == (3, 300.0)
+    assert db_agent.portfolio["AAPL"]["total_cost"] == 300.0
+    # История - от новых сделок к старым: 3 акции по 120 и 5 по 150 при средней 100
+    assert db.get_trade_history(user_id)["realized_pnl"].tolist() == [40.0, 250.0, 0.0]
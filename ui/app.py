@@ -5,7 +5,7 @@ import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
-from datetime import datetime
+from datetime import datetime, timedelta
 import sys
 import os
 
@@ -13,11 +13,22 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from agents.coordinator import AgentCoordinator
-from models.train_model import train_model, prepare_training_data
+from agents.portfolio_coordinator import PortfolioCoordinator
+from agents.pipeline import AgentPipeline
+from agents.sharding import ShardedCoordinator
+from models.train_model import train_model, prepare_training_data, check_float32_parity
+from models.tuning import tune_model
+from models.registry import ModelRegistry
+from backtest import Backtester, run_sweep, SWEEP_GRID, run_monte_carlo
+from agents.replay import ReplayFeed, run_replay
+from agents.comm_log import CommunicationLog, SQLiteLogWriter
 from auth.middleware import get_current_user, show_login_page
-from database.db_manager import DBManager
+from database.db_manager import get_db_manager
 import numpy as np
 
+# Сделок на странице истории торгов
+TRADE_PAGE_SIZE = 50
+
 
 # Настройка страницы
 st.set_page_config(
@@ -66,11 +77,18 @@ def init_coordinator(ticker: str, initial_balance: float, force_reinit: bool = F
     if (st.session_state.coordinator is None or 
         st.session_state.coordinator.ticker != ticker or 
         force_reinit):
+        if st.session_state.coordinator is not None:
+            st.session_state.coordinator.close()
+        # Лог коммуникации пишется в БД пакетами в фоне; сообщения целиком - для 10% записей
+        communication_log = CommunicationLog(
+            maxlen=500, writer=SQLiteLogWriter(get_db_manager(), user_id), sample_rate=0.1
+        )
         st.session_state.coordinator = AgentCoordinator(
             ticker=ticker, 
             initial_balance=initial_balance,
             user_id=user_id,
-            use_db=True
+            use_db=True,
+            communication_log=communication_log
         )
         st.session_state.cycle_results = []
         st.session_state.current_ticker = ticker
@@ -78,8 +96,8 @@ def init_coordinator(ticker: str, initial_balance: float, force_reinit: bool = F
 
 # Автоматическая инициализация при входе пользователя
 if st.session_state.user_id and st.session_state.coordinator is None:
-    from database.db_manager import DBManager
-    db_manager = DBManager()
+    from database.db_manager import get_db_manager
+    db_manager = get_db_manager()
     portfolio = db_manager.get_portfolio(st.session_state.user_id)
     current_balance = portfolio['balance'] if portfolio else 10000.0
     
@@ -95,6 +113,10 @@ with st.sidebar:
     st.info(f"👤 Пользователь: **{st.session_state.username}**")
     
     if st.button("🚪 Выйти"):
+        # Останавливаем рабочие процессы и фоновую запись лога координаторов сессии
+        for key in ('portfolio_coordinator', 'coordinator'):
+            if st.session_state.get(key) is not None:
+                st.session_state[key].close()
         # Очищаем session state
         for key in list(st.session_state.keys()):
             del st.session_state[key]
@@ -103,7 +125,7 @@ with st.sidebar:
     st.divider()
     
     # Получаем текущий баланс из БД
-    db_manager = DBManager()
+    db_manager = get_db_manager()
     portfolio = db_manager.get_portfolio(st.session_state.user_id)
     current_balance = portfolio['balance'] if portfolio else 10000.0
     
@@ -141,7 +163,7 @@ with st.sidebar:
     st.subheader("📊 Навигация")
     page = st.radio(
         "Выберите страницу",
-        ["Overview", "Real-time Simulation", "ML Model", "Trade History", "Database Status"]
+        ["Overview", "Real-time Simulation", "ML Model", "Backtest", "Trade History", "Database Status"]
     )
 
 
@@ -152,8 +174,8 @@ if page == "Overview":
     
     # Автоматическая инициализация, если нужно
     if st.session_state.coordinator is None and st.session_state.user_id:
-        from database.db_manager import DBManager
-        db_manager = DBManager()
+        from database.db_manager import get_db_manager
+        db_manager = get_db_manager()
         portfolio = db_manager.get_portfolio(st.session_state.user_id)
         current_balance = portfolio['balance'] if portfolio else 10000.0
         init_coordinator(st.session_state.current_ticker, current_balance)
@@ -398,8 +420,8 @@ elif page == "Real-time Simulation":
     
     # Автоматическая инициализация, если нужно
     if st.session_state.coordinator is None and st.session_state.user_id:
-        from database.db_manager import DBManager
-        db_manager = DBManager()
+        from database.db_manager import get_db_manager
+        db_manager = get_db_manager()
         portfolio = db_manager.get_portfolio(st.session_state.user_id)
         current_balance = portfolio['balance'] if portfolio else 10000.0
         init_coordinator(st.session_state.current_ticker, current_balance)
@@ -411,92 +433,94 @@ elif page == "Real-time Simulation":
     else:
         coordinator = st.session_state.coordinator
         
-        # Автоматическая торговля
+        # Автоматическая торговля: циклы выполняет демон (daemon.py), страница управляет сессией
+        # и показывает сохраненные в БД результаты
         st.subheader("🤖 Автоматическая торговля")
+        session_db = get_db_manager()
+        trading_session = session_db.get_trading_session(st.session_state.user_id)
+        session_active = trading_session is not None and trading_session["status"] == "active"
         auto_trade_col1, auto_trade_col2, auto_trade_col3 = st.columns(3)
         
-        with auto_trade_col1:
-            auto_trade_enabled = st.checkbox("🔄 Автоматическая торговля", 
-                                            value=st.session_state.get('auto_trade', False),
-                                            help="AI будет автоматически делать сделки каждые несколько секунд")
-        
         with auto_trade_col2:
-            if auto_trade_enabled:
-                auto_interval = st.number_input("Интервал (секунды)", min_value=5, max_value=300, 
-                                               value=st.session_state.get('auto_interval', 10),
-                                               step=5)
-                st.session_state.auto_interval = auto_interval
-            else:
-                auto_interval = 10
+            auto_interval = st.number_input("Интервал (секунды)", min_value=5, max_value=3600, 
+                                           value=st.session_state.get('auto_interval', 10),
+                                           step=5, disabled=session_active)
+            st.session_state.auto_interval = auto_interval
         
         with auto_trade_col3:
-            if auto_trade_enabled:
-                max_cycles = st.number_input("Макс. циклов", min_value=1, max_value=1000, 
-                                           value=st.session_state.get('max_cycles', 100),
-                                           step=10)
-                st.session_state.max_cycles = max_cycles
-            else:
-                max_cycles = 100
+            max_cycles = st.number_input("Макс. циклов", min_value=1, max_value=100000, 
+                                       value=st.session_state.get('max_cycles', 100),
+                                       step=10, disabled=session_active)
+            st.session_state.max_cycles = max_cycles
         
-        st.session_state.auto_trade = auto_trade_enabled
+        with auto_trade_col1:
+            session_tickers = [t.strip() for t in st.session_state.get('watchlist', coordinator.ticker).split(",")
+                               if t.strip()]
+            if session_active:
+                if st.button("⏸️ Остановить автоматическую торговлю"):
+                    session_db.set_trading_session_status(st.session_state.user_id, "stopped")
+                    st.rerun()
+            elif st.button("🔄 Запустить автоматическую торговлю",
+                           help="Тикеры берутся из Watchlist; циклы выполняет демон: python daemon.py"):
+                session_db.start_trading_session(st.session_state.user_id, session_tickers,
+                                                 auto_interval, max_cycles)
+                st.rerun()
+        
+        if trading_session is not None:
+            max_text = trading_session["max_cycles"] or "∞"
+            st.caption(f"Сессия: {trading_session['status']} | Тикеры: {trading_session['tickers']} | "
+                       f"Циклов: {trading_session['n_cycles']}/{max_text} | "
+                       f"Последний цикл: {trading_session['last_cycle_at'] or '-'} | "
+                       f"Следующий: {trading_session['next_cycle_at'] or '-'}")
+            if trading_session["last_error"]:
+                st.warning(f"Последняя ошибка: {trading_session['last_error']}")
+            if session_active:
+                # Портфель меняет демон - перечитываем его из БД при каждом обновлении страницы
+                coordinator.execution_agent.refresh()
+                st.info("🤖 Автоматическая торговля активна. Циклы выполняет `python daemon.py`; "
+                        "страница только отображает результаты.")
+                if st.button("🔃 Обновить"):
+                    st.rerun()
+            
+            daemon_results = session_db.get_cycle_results(st.session_state.user_id, limit=20)
+            if not daemon_results.empty:
+                st.dataframe(daemon_results[[
+                    "cycle", "timestamp", "ticker", "status", "action", "current_price",
+                    "predicted_price", "execution_status", "portfolio_value", "duration_ms"
+                ]], width='stretch')
+        
+        # Онлайн-дообучение модели
+        decision_agent = coordinator.decision_agent
+        online_enabled = st.checkbox(
+            "📚 Онлайн-дообучение модели",
+            value=decision_agent.online,
+            disabled=not decision_agent.supports_online_learning(),
+            help="Модель дообучается на каждом новом баре (нужна модель типа online)"
+        )
+        decision_agent.online = online_enabled and decision_agent.supports_online_learning()
+        if decision_agent.online and decision_agent.online_updates > 0:
+            recent_errors = decision_agent.online_abs_errors[-50:]
+            st.caption(f"Обновлений модели: {decision_agent.online_updates} | "
+                       f"MAE последних {len(recent_errors)}: ${np.mean(recent_errors):.2f}")
         
         # Ручное управление
         col1, col2 = st.columns([1, 3])
         
         with col1:
-            if not auto_trade_enabled:
-                if st.button("▶️ Запустить цикл агентов", type="primary"):
-                    with st.spinner("Выполняется цикл агентов..."):
-                        result = coordinator.run_cycle()
-                        st.session_state.cycle_results.append(result)
-                        st.rerun()
-            else:
-                st.info("🤖 Автоматическая торговля активна")
-                if st.button("⏸️ Остановить автоматическую торговлю"):
-                    st.session_state.auto_trade = False
+            if st.button("▶️ Запустить цикл агентов", type="primary", disabled=session_active):
+                with st.spinner("Выполняется цикл агентов..."):
+                    result = coordinator.run_cycle()
+                    st.session_state.cycle_results.append(result)
                     st.rerun()
             
             if st.button("🔄 Сбросить систему"):
+                if session_active:
+                    session_db.set_trading_session_status(st.session_state.user_id, "stopped")
                 coordinator.reset_system()
                 st.session_state.cycle_results = []
-                st.session_state.auto_trade = False
                 st.success("Система сброшена")
                 st.rerun()
         
-        # Автоматический запуск циклов
-        if auto_trade_enabled:
-            if 'auto_cycle_count' not in st.session_state:
-                st.session_state.auto_cycle_count = 0
-            if 'last_auto_cycle_time' not in st.session_state:
-                st.session_state.last_auto_cycle_time = datetime.now()
-            
-            current_time = datetime.now()
-            time_since_last = (current_time - st.session_state.last_auto_cycle_time).total_seconds()
-            
-            if st.session_state.auto_cycle_count < max_cycles:
-                if time_since_last >= auto_interval:
-                    # Время для следующего цикла
-                    with st.spinner(f"🤖 Автоматический цикл {st.session_state.auto_cycle_count + 1}/{max_cycles}..."):
-                        result = coordinator.run_cycle()
-                        st.session_state.cycle_results.append(result)
-                        st.session_state.auto_cycle_count += 1
-                        st.session_state.last_auto_cycle_time = datetime.now()
-                    st.rerun()
-                else:
-                    # Показываем обратный отсчет
-                    remaining = auto_interval - time_since_last
-                    st.info(f"⏳ Следующий цикл через {remaining:.1f} секунд... "
-                           f"(Цикл {st.session_state.auto_cycle_count + 1}/{max_cycles})")
-                    # Автоматически обновляем страницу через оставшееся время
-                    import time
-                    time.sleep(min(1.0, remaining))
-                    st.rerun()
-            else:
-                st.success(f"✅ Выполнено {max_cycles} автоматических циклов")
-                st.session_state.auto_trade = False
-                st.session_state.auto_cycle_count = 0
-                st.session_state.last_auto_cycle_time = None
-        
         st.divider()
         
         # Логи агентов
@@ -583,6 +607,104 @@ elif page == "Real-time Simulation":
             else:
                 st.error(f"Ошибка: {latest_result.get('message', 'Unknown error')}")
         
+        # Watchlist: цикл по нескольким тикерам с общим портфелем
+        st.divider()
+        st.subheader("📋 Watchlist")
+        watchlist_input = st.text_input("Тикеры через запятую", value=st.session_state.get('watchlist', coordinator.ticker),
+                                        help="Все тикеры загружаются одним запросом, решения принимаются одним батчем")
+        watchlist = [t.strip().upper() for t in watchlist_input.split(",") if t.strip()]
+        st.session_state.watchlist = ", ".join(watchlist)
+        
+        watch_col1, watch_col2 = st.columns(2)
+        with watch_col1:
+            use_pipeline = st.checkbox("Асинхронный конвейер", value=False,
+                                       help="Загрузка, решения и исполнение по разным тикерам выполняются одновременно")
+        with watch_col2:
+            n_shards = st.number_input("Рабочих процессов", min_value=1, max_value=max(1, os.cpu_count() or 1),
+                                       value=1, help="Больше 1 - индикаторы и инференс считаются в отдельных процессах")
+        
+        if st.button("▶️ Цикл по watchlist") and watchlist:
+            portfolio_coordinator = st.session_state.get('portfolio_coordinator')
+            current_shards = getattr(portfolio_coordinator, 'n_shards', 1)
+            if (portfolio_coordinator is None or
+                    portfolio_coordinator.execution_agent is not coordinator.execution_agent or
+                    current_shards != n_shards):
+                if isinstance(portfolio_coordinator, ShardedCoordinator):
+                    portfolio_coordinator.close()
+                # Общие агенты решений и исполнения с основным координатором - один портфель
+                if n_shards > 1:
+                    portfolio_coordinator = ShardedCoordinator(
+                        watchlist, n_shards=int(n_shards), user_id=st.session_state.user_id,
+                        decision_agent=coordinator.decision_agent,
+                        execution_agent=coordinator.execution_agent
+                    )
+                else:
+                    portfolio_coordinator = PortfolioCoordinator(
+                        watchlist, user_id=st.session_state.user_id,
+                        decision_agent=coordinator.decision_agent,
+                        execution_agent=coordinator.execution_agent
+                    )
+                st.session_state.portfolio_coordinator = portfolio_coordinator
+            else:
+                portfolio_coordinator.set_watchlist(watchlist)
+            with st.spinner("Цикл по watchlist..."):
+                if use_pipeline and n_shards == 1:
+                    st.session_state.watchlist_result = AgentPipeline(portfolio_coordinator).run_cycle()
+                else:
+                    st.session_state.watchlist_result = portfolio_coordinator.run_cycle()
+        
+        watchlist_result = st.session_state.get('watchlist_result')
+        if watchlist_result:
+            if watchlist_result.get("tickers"):
+                st.dataframe(pd.DataFrame([
+                    {
+                        "Тикер": ticker,
+                        "Цена": f"${r['market_data']['current_price']:.2f}" if r["status"] == "success" else "-",
+                        "Предсказание": f"${r['decision']['predicted_price']:.2f}" if r["status"] == "success" else "-",
+                        "Решение": r["decision"]["action"] if r["status"] == "success" else "-",
+                        "Исполнение": r["execution"]["status"] if r["status"] == "success" else r.get("message")
+                    }
+                    for ticker, r in watchlist_result["tickers"].items()
+                ]), width='stretch')
+                timings = watchlist_result["timings"]
+                st.caption(f"Стоимость портфеля: ${watchlist_result['portfolio']['portfolio_value']:.2f} | " +
+                           ", ".join(f"{name}: {value:.1f} мс" if isinstance(value, float) else f"{name}: {value}"
+                                     for name, value in timings.items()))
+            else:
+                st.error(f"Ошибка: {watchlist_result.get('message', 'Unknown error')}")
+        
+        # Задержки этапов циклов (скользящие окна последних замеров)
+        recorders = [coordinator.latency]
+        if st.session_state.get('portfolio_coordinator') is not None:
+            recorders.append(st.session_state.portfolio_coordinator.latency)
+        latency_df = pd.concat([r.summary() for r in recorders], ignore_index=True)
+        if not latency_df.empty:
+            st.divider()
+            st.subheader("⏱️ Задержки этапов")
+            st.dataframe(latency_df.round(2), width='stretch')
+            
+            lat_col1, lat_col2 = st.columns([2, 1])
+            with lat_col1:
+                stage_key = st.selectbox(
+                    "Гистограмма этапа",
+                    [f"{row.stage} | {row.ticker}" for row in latency_df.itertuples()]
+                )
+                stage, stage_ticker = stage_key.split(" | ")
+                stage_samples = pd.DataFrame({"ms": [
+                    value for r in recorders for value in r.samples.get((stage, stage_ticker), ())
+                ]})
+                st.plotly_chart(px.histogram(stage_samples, x="ms", nbins=30, title=f"{stage} ({stage_ticker}), мс"),
+                                width='stretch')
+            with lat_col2:
+                raw_latency = pd.concat([r.to_dataframe() for r in recorders], ignore_index=True)
+                st.download_button(
+                    "⬇️ Экспорт замеров (CSV)",
+                    raw_latency.to_csv(index=False).encode("utf-8"),
+                    file_name=f"latency_{datetime.now():%Y%m%d_%H%M%S}.csv",
+                    mime="text/csv"
+                )
+                st.caption(f"Циклов в окне: {len(raw_latency)}")
+        
         # Лог коммуникации
         st.divider()
         st.subheader("💬 Лог коммуникации агентов")
@@ -594,11 +716,16 @@ elif page == "Real-time Simulation":
                     "Время": log["timestamp"],
                     "От": log["from"],
                     "К": log["to"],
-                    "Тип сообщения": log["message_type"]
+                    "Тип сообщения": log["message_type"],
+                    "Тикер": log.get("ticker", ""),
+                    "Решение / статус": log.get("decision") or log.get("status", "")
                 }
                 for log in comm_log[-20:]
             ])
             st.dataframe(comm_df, width='stretch')
+            writer = coordinator.communication_log.writer
+            if writer is not None:
+                st.caption(f"Записано в БД: {writer.written}, отброшено: {writer.dropped}")
         else:
             st.info("Лог коммуникации пуст. Запустите цикл агентов.")
 
@@ -612,8 +739,18 @@ elif page == "ML Model":
     
     with col1:
         model_ticker = st.text_input("Тикер для обучения", value="AAPL")
-        model_type = st.selectbox("Тип модели", ["random_forest", "linear"])
+        model_type = st.selectbox("Тип модели", ["random_forest", "linear", "online"],
+                                  help="online - SGD-модель, которую можно дообучать на каждом новом баре")
         period = st.selectbox("Период данных", ["1y", "2y", "5y"], index=1)
+        use_feature_cache = st.checkbox("Использовать кэш признаков", value=True,
+                                        help="Не загружать историю и не пересчитывать признаки заново при повторном обучении")
+        cv_folds = st.number_input("Фолды walk-forward валидации", min_value=0, max_value=20, value=5,
+                                   help="0 - только holdout; фолды обучаются параллельно")
+        cv_mode = st.selectbox("Окно валидации", ["expanding", "sliding"])
+        use_float32 = st.checkbox("float32 признаки", value=False,
+                                  help="Вдвое меньше памяти для матрицы признаков; точность проверяется сравнением с float64")
+        use_tuned_params = st.checkbox("Использовать лучшие параметры из реестра", value=False,
+                                       help="Параметры последнего подбора гиперпараметров для этого тикера и типа модели")
     
     with col2:
         st.markdown("### Инструкции")
@@ -623,13 +760,82 @@ elif page == "ML Model":
         3. Просмотрите метрики и графики
         """)
     
+    # Подбор гиперпараметров
+    with st.expander("🔍 Подбор гиперпараметров"):
+        search_col1, search_col2, search_col3 = st.columns(3)
+        with search_col1:
+            search_strategy = st.selectbox("Стратегия", ["random", "grid"])
+        with search_col2:
+            search_n_iter = st.number_input("Кандидатов (random)", min_value=2, max_value=200, value=20)
+        with search_col3:
+            search_halving = st.checkbox("Successive halving", value=True,
+                                         help="Отсеивать слабых кандидатов на части фолдов")
+        
+        if st.button("🔍 Запустить подбор"):
+            with st.spinner("Подбор гиперпараметров..."):
+                try:
+                    results_df, search_summary = tune_model(
+                        ticker=model_ticker,
+                        model_type=model_type,
+                        period=period,
+                        strategy=search_strategy,
+                        n_iter=int(search_n_iter),
+                        n_splits=max(int(cv_folds), 2),
+                        halving=search_halving
+                    )
+                    st.session_state.search_results = (results_df, search_summary)
+                except Exception as e:
+                    st.error(f"Ошибка при подборе: {str(e)}")
+        
+        if st.session_state.get('search_results'):
+            results_df, search_summary = st.session_state.search_results
+            st.success(f"Лучшие параметры: {search_summary['best_params']} "
+                       f"(MAE ${search_summary['best_mae']:.2f}, "
+                       f"{search_summary['n_fits']}/{search_summary['n_fits_full']} обучений, "
+                       f"{search_summary['wall_time']:.1f} c)")
+            display_results = results_df.copy()
+            display_results['params'] = display_results['params'].astype(str)
+            st.dataframe(display_results, width='stretch')
+    
+    # Проверка точности float32 относительно float64
+    with st.expander("🧮 Проверка паритета float32"):
+        if st.button("🧮 Сравнить float32 и float64"):
+            with st.spinner("Обучение моделей на float32 и float64..."):
+                try:
+                    st.session_state.float32_parity = check_float32_parity(
+                        ticker=model_ticker, model_type=model_type, period=period
+                    )
+                except Exception as e:
+                    st.error(f"Ошибка при проверке: {str(e)}")
+        
+        if st.session_state.get('float32_parity'):
+            parity = st.session_state.float32_parity
+            parity_df = pd.DataFrame([
+                {"Тип": dtype, **parity[dtype]} for dtype in ("float64", "float32")
+            ])
+            st.dataframe(parity_df, width='stretch')
+            if parity['passed']:
+                st.success(f"✅ Паритет соблюден: расхождение MAE {parity['mae_rel_diff']:.2e}")
+            else:
+                st.warning(f"⚠️ Расхождение MAE {parity['mae_rel_diff']:.2e} превышает допуск")
+    
     if st.button("🎓 Обучить модель", type="primary"):
         with st.spinner("Обучение модели..."):
             try:
+                tuned_params = None
+                if use_tuned_params:
+                    best_entry = ModelRegistry().latest("hyperparameter_search", model_ticker, model_type)
+                    tuned_params = best_entry["params"] if best_entry else None
+                
                 model, metrics, test_data = train_model(
                     ticker=model_ticker,
                     model_type=model_type,
-                    period=period
+                    period=period,
+                    use_cache=use_feature_cache,
+                    cv_folds=int(cv_folds),
+                    cv_mode=cv_mode,
+                    params=tuned_params,
+                    dtype="float32" if use_float32 else "float64"
                 )
                 st.session_state.model_metrics = metrics
                 st.session_state.test_data = test_data
@@ -662,6 +868,36 @@ elif page == "ML Model":
             st.metric("Test R²", f"{metrics['test_r2']:.4f}")
             st.metric("Train R²", f"{metrics['train_r2']:.4f}")
         
+        # Walk-forward валидация
+        if metrics.get('cv_summary'):
+            cv_summary = metrics['cv_summary']
+            st.divider()
+            st.subheader("🔁 Walk-forward валидация")
+            
+            col_cv1, col_cv2, col_cv3, col_cv4 = st.columns(4)
+            with col_cv1:
+                st.metric("MAE (среднее)", f"${cv_summary['mae_mean']:.2f}", f"± {cv_summary['mae_std']:.2f}", delta_color="off")
+            with col_cv2:
+                st.metric("RMSE (среднее)", f"${cv_summary['rmse_mean']:.2f}", f"± {cv_summary['rmse_std']:.2f}", delta_color="off")
+            with col_cv3:
+                st.metric("R² (среднее)", f"{cv_summary['r2_mean']:.4f}", f"± {cv_summary['r2_std']:.4f}", delta_color="off")
+            with col_cv4:
+                st.metric("Время (wall-clock)", f"{cv_summary['wall_time']:.2f} c",
+                          f"сумма обучения {cv_summary['fit_time_total']:.2f} c", delta_color="off")
+            
+            folds_df = pd.DataFrame(metrics['cv_folds'])
+            st.dataframe(folds_df.rename(columns={
+                'fold': 'Фолд',
+                'train_start': 'Train от',
+                'train_end': 'Train до',
+                'test_start': 'Test от',
+                'test_end': 'Test до',
+                'mae': 'MAE',
+                'rmse': 'RMSE',
+                'r2': 'R²',
+                'fit_time': 'Время обучения (c)'
+            }), width='stretch')
+        
         # График сравнения
         if 'test_data' in st.session_state:
             test_data = st.session_state.test_data
@@ -831,6 +1067,159 @@ elif page == "ML Model":
                 st.metric("Среднекв. ошибка", f"${np.sqrt(np.mean(errors**2)):.2f}")
 
 
+# Страница Backtest
+elif page == "Backtest":
+    st.title("🧪 Backtest")
+    st.markdown("### Проверка торговой политики агентов на истории")
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        backtest_ticker = st.text_input("Тикер для бэктеста", value=ticker)
+        backtest_period = st.selectbox("Период истории", ["1y", "2y", "5y", "10y", "max"], index=3)
+    with col2:
+        backtest_threshold = st.number_input("Порог решения", min_value=0.001, max_value=0.2,
+                                             value=0.02, step=0.005, format="%.3f")
+        backtest_min_move = st.number_input("Минимальное изменение цены", min_value=0.0, max_value=0.1,
+                                            value=0.01, step=0.005, format="%.3f")
+    with col3:
+        backtest_trade_pct = st.slider("Доля баланса на покупку", 0.01, 1.0, 0.1, 0.01)
+        backtest_sell_fraction = st.slider("Доля акций на продажу", 0.1, 1.0, 0.5, 0.05)
+    
+    if st.button("🧪 Запустить бэктест", type="primary"):
+        with st.spinner("Бэктест..."):
+            try:
+                backtester = Backtester(initial_balance=10000.0,
+                                        trade_percentage=backtest_trade_pct,
+                                        sell_fraction=backtest_sell_fraction)
+                backtester.decision_agent.threshold = backtest_threshold
+                backtester.decision_agent.min_abs_move = backtest_min_move
+                st.session_state.backtest_result = backtester.run(ticker=backtest_ticker, period=backtest_period)
+            except Exception as e:
+                st.error(f"Ошибка при бэктесте: {str(e)}")
+    
+    if st.session_state.get('backtest_result'):
+        result = st.session_state.backtest_result
+        summary = result['summary']
+        
+        col_m1, col_m2, col_m3, col_m4, col_m5 = st.columns(5)
+        with col_m1:
+            st.metric("Итоговый капитал", f"${summary['final_equity']:.2f}",
+                      f"{summary['total_return_pct']:.2f}%")
+        with col_m2:
+            st.metric("Buy & Hold", f"{summary['buy_and_hold_return_pct']:.2f}%")
+        with col_m3:
+            st.metric("Макс. просадка", f"{summary['max_drawdown_pct']:.2f}%")
+        with col_m4:
+            st.metric("Сделок", summary['n_trades'], f"BUY {summary['n_buys']} / SELL {summary['n_sells']}")
+        with col_m5:
+            st.metric("Время расчета", f"{summary['elapsed'] * 1000:.0f} мс")
+        
+        equity_curve = result['equity_curve']
+        fig_equity = go.Figure()
+        fig_equity.add_trace(go.Scatter(x=equity_curve.index, y=equity_curve['equity'],
+                                        mode='lines', name='Стратегия'))
+        fig_equity.add_trace(go.Scatter(
+            x=equity_curve.index,
+            y=equity_curve['close'] / equity_curve['close'].iloc[0] * summary['initial_balance'],
+            mode='lines', name='Buy & Hold', line=dict(dash='dash')
+        ))
+        fig_equity.update_layout(title="Кривая капитала", xaxis_title="Дата", yaxis_title="Капитал ($)",
+                                 height=450)
+        st.plotly_chart(fig_equity, width='stretch')
+        
+        st.markdown("### Сделки")
+        st.dataframe(result['trades'], width='stretch')
+    
+    # Перебор параметров стратегии
+    with st.expander("🎛️ Перебор параметров стратегии"):
+        sweep_tickers = st.text_input("Тикеры через запятую", value=backtest_ticker)
+        sweep_rank_by = st.selectbox("Сортировать по", ["mean_return_pct", "median_return_pct",
+                                                         "worst_return_pct", "mean_drawdown_pct"])
+        st.caption(f"Сетка: {', '.join(f'{k}={v}' for k, v in SWEEP_GRID.items())}")
+        
+        if st.button("🎛️ Запустить перебор"):
+            with st.spinner("Перебор параметров..."):
+                try:
+                    tickers = [t.strip().upper() for t in sweep_tickers.split(",") if t.strip()]
+                    ranked, _, sweep_summary = run_sweep(tickers, period=backtest_period, rank_by=sweep_rank_by)
+                    st.session_state.sweep_results = (ranked, sweep_summary)
+                except Exception as e:
+                    st.error(f"Ошибка при переборе: {str(e)}")
+        
+        if st.session_state.get('sweep_results'):
+            ranked, sweep_summary = st.session_state.sweep_results
+            st.success(f"Лучшие параметры: {sweep_summary['best_params']} "
+                       f"({sweep_summary['n_backtests']} бэктестов, {sweep_summary['wall_time']:.1f} c)")
+            st.dataframe(ranked.head(50), width='stretch')
+    
+    # Monte Carlo стресс-тест
+    with st.expander("🎲 Monte Carlo стресс-тест"):
+        mc_col1, mc_col2, mc_col3 = st.columns(3)
+        with mc_col1:
+            mc_method = st.selectbox("Траектории", ["bootstrap", "gbm"],
+                                     help="bootstrap - исторические доходности, gbm - геометрическое броуновское движение")
+        with mc_col2:
+            mc_n_paths = st.number_input("Количество траекторий", min_value=100, max_value=20000, value=1000, step=100)
+        with mc_col3:
+            mc_horizon = st.number_input("Горизонт (дней)", min_value=20, max_value=1260, value=252)
+        
+        if st.button("🎲 Запустить симуляцию"):
+            with st.spinner("Симуляция траекторий..."):
+                try:
+                    st.session_state.monte_carlo_results = run_monte_carlo(
+                        ticker=backtest_ticker, period=backtest_period, n_paths=int(mc_n_paths),
+                        horizon=int(mc_horizon), method=mc_method,
+                        trade_percentage=backtest_trade_pct, sell_fraction=backtest_sell_fraction,
+                        n_shards=max(1, min(4, os.cpu_count() or 1))
+                    )
+                except Exception as e:
+                    st.error(f"Ошибка при симуляции: {str(e)}")
+        
+        if st.session_state.get('monte_carlo_results'):
+            paths_df, mc_summary = st.session_state.monte_carlo_results
+            col_mc1, col_mc2, col_mc3 = st.columns(3)
+            with col_mc1:
+                st.metric("Медианный P&L", f"${mc_summary['pnl']['p50']:.2f}",
+                          f"5%: ${mc_summary['pnl']['p5']:.2f}")
+            with col_mc2:
+                st.metric("Вероятность убытка", f"{mc_summary['prob_loss']:.1%}")
+            with col_mc3:
+                st.metric("Медианная просадка", f"{mc_summary['max_drawdown_pct']['p50']:.2f}%",
+                          f"5%: {mc_summary['max_drawdown_pct']['p5']:.2f}%")
+            st.plotly_chart(px.histogram(paths_df, x="pnl", nbins=60, title="Распределение итогового P&L"),
+                            width='stretch')
+            st.dataframe(pd.DataFrame({k: mc_summary[k] for k in ["pnl", "max_drawdown_pct", "n_trades"]}),
+                         width='stretch')
+    
+    # Воспроизведение истории через реальных агентов
+    with st.expander("⏩ Воспроизведение через агентов"):
+        st.caption("Бары истории проходят через Market → Decision → Execution агентов "
+                   "без ожидания реального времени; сделки пишутся во временную БД.")
+        replay_bars = st.number_input("Количество баров", min_value=10, max_value=5000, value=250)
+        
+        if st.button("⏩ Запустить воспроизведение"):
+            with st.spinner("Воспроизведение баров..."):
+                try:
+                    feed = ReplayFeed.from_history(backtest_ticker, backtest_period, max_bars=int(replay_bars))
+                    st.session_state.replay_summary = run_replay(feed, ticker=backtest_ticker)
+                except Exception as e:
+                    st.error(f"Ошибка при воспроизведении: {str(e)}")
+        
+        if st.session_state.get('replay_summary'):
+            replay_summary = st.session_state.replay_summary
+            col_r1, col_r2, col_r3, col_r4 = st.columns(4)
+            with col_r1:
+                st.metric("Циклов", replay_summary['n_cycles'])
+            with col_r2:
+                st.metric("Циклов/с", f"{replay_summary['cycles_per_sec']:.1f}")
+            with col_r3:
+                st.metric("Сделок", replay_summary['n_trades'], f"ошибок: {replay_summary['n_errors']}")
+            with col_r4:
+                st.metric("P&L", f"${replay_summary['portfolio']['pnl']:.2f}",
+                          f"{replay_summary['portfolio']['pnl_pct']:.2f}%")
+            st.dataframe(replay_summary['trade_history'], width='stretch')
+
+
 # Страница Trade History
 elif page == "Trade History":
     st.title("📜 Trade History")
@@ -838,8 +1227,8 @@ elif page == "Trade History":
     
     # Автоматическая инициализация, если нужно
     if st.session_state.coordinator is None and st.session_state.user_id:
-        from database.db_manager import DBManager
-        db_manager = DBManager()
+        from database.db_manager import get_db_manager
+        db_manager = get_db_manager()
         portfolio = db_manager.get_portfolio(st.session_state.user_id)
         current_balance = portfolio['balance'] if portfolio else 10000.0
         init_coordinator(st.session_state.current_ticker, current_balance)
@@ -851,135 +1240,158 @@ elif page == "Trade History":
     else:
         coordinator = st.session_state.coordinator
         
-        # История торгов
-        trade_history = coordinator.get_trade_history()
+        db_manager = get_db_manager()
+        user_id = st.session_state.user_id
         
-        if not trade_history.empty:
+        if db_manager.get_trade_history_count(user_id) > 0:
             st.subheader("📋 Таблица сделок")
             
-            # Форматируем данные для отображения
-            display_df = trade_history.copy()
-            if 'timestamp' in display_df.columns:
+            # Фильтры; из БД читается только видимая страница (курсор по времени и id сделки)
+            filter_col1, filter_col2, filter_col3 = st.columns(3)
+            with filter_col1:
+                ticker_filter = st.selectbox("Тикер", ["Все"] + db_manager.get_traded_tickers(user_id))
+            with filter_col2:
+                date_from = st.date_input("С даты", value=None)
+            with filter_col3:
+                date_to = st.date_input("По дату", value=None)
+            
+            page_filters = (ticker_filter, date_from, date_to)
+            if st.session_state.get('trade_page_filters') != page_filters:
+                st.session_state.trade_page_filters = page_filters
+                # Курсоры начала просмотренных страниц (None - первая страница)
+                st.session_state.trade_page_cursors = [None]
+            page_cursors = st.session_state.trade_page_cursors
+            
+            page_df, next_cursor = db_manager.get_trade_history_page(
+                user_id, page_size=TRADE_PAGE_SIZE, after=page_cursors[-1],
+                ticker=None if ticker_filter == "Все" else ticker_filter,
+                start=date_from.isoformat() if date_from else None,
+                end=(date_to + timedelta(days=1)).isoformat() if date_to else None
+            )
+            
+            if page_df.empty:
+                st.info("Нет сделок по выбранным фильтрам")
+            else:
+                display_df = page_df.drop(columns=['id', 'user_id'])
                 display_df['timestamp'] = pd.to_datetime(display_df['timestamp'])
+                display_df['confidence'] = display_df['confidence'] * 100
+                
+                # Переименовываем колонки для удобства
+                display_df = display_df.rename(columns={
+                    'timestamp': 'Время',
+                    'ticker': 'Тикер',
+                    'action': 'Действие',
+                    'shares': 'Акций',
+                    'price': 'Цена',
+                    'total': 'Сумма',
+                    'balance_after': 'Баланс после',
+                    'confidence': 'Уверенность',
+                    'realized_pnl': 'Реализованный P&L'
+                })
+                
+                # Числа форматируются при отрисовке, без преобразования в строки
+                st.dataframe(display_df, width='stretch', hide_index=True, column_config={
+                    'Цена': st.column_config.NumberColumn(format="$%.2f"),
+                    'Сумма': st.column_config.NumberColumn(format="$%.2f"),
+                    'Баланс после': st.column_config.NumberColumn(format="$%.2f"),
+                    'Реализованный P&L': st.column_config.NumberColumn(format="$%.2f"),
+                    'Уверенность': st.column_config.NumberColumn(format="%.2f%%")
+                })
             
-            # Переименовываем колонки для удобства
-            display_df = display_df.rename(columns={
-                'timestamp': 'Время',
-                'ticker': 'Тикер',
-                'action': 'Действие',
-                'shares': 'Акций',
-                'price': 'Цена',
-                'total': 'Сумма',
-                'balance_after': 'Баланс после',
-                'confidence': 'Уверенность'
-            })
-            
-            # Форматируем числовые значения
-            if 'Цена' in display_df.columns:
-                display_df['Цена'] = display_df['Цена'].apply(lambda x: f"${x:.2f}")
-            if 'Сумма' in display_df.columns:
-                display_df['Сумма'] = display_df['Сумма'].apply(lambda x: f"${x:.2f}")
-            if 'Баланс после' in display_df.columns:
-                display_df['Баланс после'] = display_df['Баланс после'].apply(lambda x: f"${x:.2f}")
-            if 'Уверенность' in display_df.columns:
-                display_df['Уверенность'] = display_df['Уверенность'].apply(lambda x: f"{x*100:.2f}%")
-            
-            st.dataframe(display_df, use_container_width=True)
+            nav_col1, nav_col2, nav_col3 = st.columns([1, 2, 1])
+            with nav_col1:
+                if st.button("⬅️ Назад", disabled=len(page_cursors) == 1):
+                    page_cursors.pop()
+                    st.rerun()
+            with nav_col2:
+                st.caption(f"Страница {len(page_cursors)}")
+            with nav_col3:
+                if st.button("Далее ➡️", disabled=next_cursor is None):
+                    page_cursors.append(next_cursor)
+                    st.rerun()
             
             st.divider()
             
-            # График P&L
+            # График P&L по дневным агрегатам из БД (история сделок целиком не загружается)
             st.subheader("💰 P&L График")
             
-            # Вычисляем кумулятивный P&L
-            if 'timestamp' in trade_history.columns and 'action' in trade_history.columns:
-                trade_history['timestamp'] = pd.to_datetime(trade_history['timestamp'])
-                trade_history = trade_history.sort_values('timestamp')
-                
-                # Вычисляем P&L для каждой сделки
-                # Получаем начальный баланс из БД
-                db_manager = DBManager()
-                portfolio = db_manager.get_portfolio(st.session_state.user_id)
-                initial_balance = portfolio['balance'] if portfolio else 10000.0
+            daily = db_manager.get_daily_trade_summary(user_id)
+            if not daily.empty:
+                daily['day'] = pd.to_datetime(daily['day'])
+                # Кумулятивный реализованный P&L; начальная точка - 0 за день до первой сделки
+                days = pd.concat([pd.Series([daily['day'].iloc[0] - pd.Timedelta(days=1)]), daily['day']],
+                                 ignore_index=True)
+                cumulative_pnl = pd.concat([pd.Series([0.0]), daily['realized_pnl'].cumsum()], ignore_index=True)
                 
-                # Вычисляем начальный баланс из истории (первая сделка)
-                if len(trade_history) > 0:
-                    first_trade = trade_history.iloc[0]
-                    if first_trade['action'] == 'BUY':
-                        # Если первая сделка - покупка, начальный баланс = balance_after + total
-                        initial_balance = first_trade['balance_after'] + first_trade['total']
-                    else:
-                        # Если первая сделка - продажа, начальный баланс = balance_after - total
-                        initial_balance = first_trade['balance_after'] - first_trade['total']
+                fig_pnl = go.Figure()
+                fig_pnl.add_trace(go.Scatter(
+                    x=days,
+                    y=cumulative_pnl,
+                    mode='lines+markers',
+                    name='Cumulative P&L',
+                    line=dict(color='green' if cumulative_pnl.iloc[-1] >= 0 else 'red', width=2),
+                    marker=dict(size=8)
+                ))
                 
-                cumulative_pnl = [0]
-                cumulative_balance = [initial_balance]
+                fig_pnl.add_hline(y=0, line_dash="dash", line_color="gray", 
+                                 annotation_text="Break-even")
                 
-                for idx, row in trade_history.iterrows():
-                    if row['action'] == 'BUY':
-                        # При покупке P&L не меняется сразу
-                        cumulative_pnl.append(cumulative_pnl[-1])
-                        cumulative_balance.append(row['balance_after'])
-                    elif row['action'] == 'SELL':
-                        # При продаже вычисляем прибыль
-                        # Упрощенный расчет
-                        cumulative_balance.append(row['balance_after'])
-                        cumulative_pnl.append(cumulative_balance[-1] - initial_balance)
+                fig_pnl.update_layout(
+                    title="Кумулятивный реализованный P&L",
+                    xaxis_title="Дата",
+                    yaxis_title="P&L ($)",
+                    hovermode='x unified',
+                    height=500
+                )
                 
-                # Создаем график
-                if len(cumulative_pnl) > 1:
-                    fig_pnl = go.Figure()
-                    
-                    timestamps = trade_history['timestamp'].tolist()
-                    if len(timestamps) == len(cumulative_pnl) - 1:
-                        timestamps = [timestamps[0] - pd.Timedelta(days=1)] + timestamps
-                    
-                    fig_pnl.add_trace(go.Scatter(
-                        x=timestamps[:len(cumulative_pnl)],
-                        y=cumulative_pnl,
-                        mode='lines+markers',
-                        name='Cumulative P&L',
-                        line=dict(color='green' if cumulative_pnl[-1] >= 0 else 'red', width=2),
-                        marker=dict(size=8)
-                    ))
-                    
-                    fig_pnl.add_hline(y=0, line_dash="dash", line_color="gray", 
-                                     annotation_text="Break-even")
-                    
-                    fig_pnl.update_layout(
-                        title="Кумулятивный P&L",
-                        xaxis_title="Дата",
-                        yaxis_title="P&L ($)",
-                        hovermode='x unified',
-                        height=500
-                    )
-                    
-                    st.plotly_chart(fig_pnl, width='stretch')
+                st.plotly_chart(fig_pnl, width='stretch')
+            
+            # Кривая капитала с переоценкой позиций (снимки из equity_snapshots)
+            st.subheader("📈 Кривая капитала")
+            granularity = st.radio("Интервал", ["day", "hour", "minute"], horizontal=True,
+                                   format_func={"day": "День", "hour": "Час", "minute": "Минута"}.get)
+            equity_curve = db_manager.get_equity_curve(user_id, granularity)
+            if equity_curve.empty:
+                st.info("Снимков капитала пока нет: они сохраняются после каждого цикла агентов")
+            else:
+                equity_curve['bucket'] = pd.to_datetime(equity_curve['bucket'])
+                fig_equity = go.Figure()
+                fig_equity.add_trace(go.Scatter(
+                    x=equity_curve['bucket'], y=equity_curve['equity'],
+                    mode='lines', name='Капитал', line=dict(color='blue', width=2)
+                ))
+                fig_equity.add_trace(go.Scatter(
+                    x=equity_curve['bucket'], y=equity_curve['cash'],
+                    mode='lines', name='Свободные средства', line=dict(color='gray', dash='dot')
+                ))
+                fig_equity.update_layout(
+                    xaxis_title="Дата",
+                    yaxis_title="$",
+                    hovermode='x unified',
+                    height=400
+                )
+                st.plotly_chart(fig_equity, width='stretch')
             
             # Статистика
             st.divider()
             st.subheader("📊 Статистика торгов")
             
-            col1, col2, col3, col4 = st.columns(4)
-            
-            buy_count = len(trade_history[trade_history['action'] == 'BUY']) if 'action' in trade_history.columns else 0
-            sell_count = len(trade_history[trade_history['action'] == 'SELL']) if 'action' in trade_history.columns else 0
+            trade_stats = db_manager.get_trade_stats(user_id)
+            col1, col2, col3, col4, col5 = st.columns(5)
             
             with col1:
-                st.metric("Всего сделок", len(trade_history))
+                st.metric("Всего сделок", trade_stats['total_trades'])
             with col2:
-                st.metric("Покупок", buy_count)
+                st.metric("Покупок", trade_stats['buy_count'])
             with col3:
-                st.metric("Продаж", sell_count)
+                st.metric("Продаж", trade_stats['sell_count'])
             with col4:
+                st.metric("Реализованный P&L", f"${trade_stats['realized_pnl']:.2f}")
+            with col5:
                 current_price = coordinator.market_agent.get_latest_price() or 0
                 portfolio_summary = coordinator.execution_agent.get_portfolio_summary(current_price)
-                # Получаем начальный баланс из БД
-                db_manager = DBManager()
-                portfolio = db_manager.get_portfolio(st.session_state.user_id)
-                initial_balance = portfolio['balance'] if portfolio else 10000.0
-                current_pnl = portfolio_summary['portfolio_value'] - initial_balance
-                st.metric("Текущий P&L", f"${current_pnl:.2f}")
+                # P&L относительно стартового капитала из портфеля
+                st.metric("Текущий P&L", f"${portfolio_summary['pnl']:.2f}")
         else:
             st.info("История торгов пуста. Запустите симуляцию для начала торговли.")
 
@@ -989,11 +1401,11 @@ elif page == "Database Status":
     st.title("🗄️ Database Status")
     st.markdown("### Информация о подключении к базе данных")
     
-    from database.db_manager import DBManager
+    from database.db_manager import get_db_manager
     import sqlite3
     import os
     
-    db = DBManager()
+    db = get_db_manager()
     
     # Информация о подключении
     col1, col2 = st.columns(2)
@@ -1014,22 +1426,27 @@ elif page == "Database Status":
     with col2:
         st.subheader("🔌 Статус подключения")
         try:
-            conn = db.get_connection()
-            cursor = conn.cursor()
-            
-            # Проверяем версию SQLite
-            cursor.execute("SELECT sqlite_version()")
-            sqlite_version = cursor.fetchone()[0]
-            st.success("✅ Подключение активно")
-            st.info(f"**SQLite версия:** {sqlite_version}")
-            
-            # Проверяем, можем ли мы выполнять запросы
-            cursor.execute("SELECT 1")
-            test_result = cursor.fetchone()
-            if test_result:
-                st.success("✅ Запросы выполняются успешно")
+            with db.connection() as conn:
+                cursor = conn.cursor()
+                
+                # Проверяем версию SQLite
+                cursor.execute("SELECT sqlite_version()")
+                sqlite_version = cursor.fetchone()[0]
+                cursor.execute("PRAGMA journal_mode")
+                journal_mode = cursor.fetchone()[0]
+                st.success("✅ Подключение активно")
+                st.info(f"**SQLite версия:** {sqlite_version} | **Журнал:** {journal_mode}")
+                
+                # Проверяем, можем ли мы выполнять запросы
+                cursor.execute("SELECT 1")
+                test_result = cursor.fetchone()
+                if test_result:
+                    st.success("✅ Запросы выполняются успешно")
             
-            conn.close()
+            pool_stats = db.get_pool_stats()
+            st.caption(f"Пул соединений: открыто {pool_stats['open_connections']}, "
+                       f"занято {pool_stats['in_use']}, выдач {pool_stats['checkouts']}, "
+                       f"повторных {pool_stats['reused']}, вложенных {pool_stats['nested']}")
         except Exception as e:
             st.error(f"❌ Ошибка подключения: {str(e)}")
             st.code(str(e), language="text")
@@ -1040,73 +1457,71 @@ elif page == "Database Status":
     st.subheader("📊 Таблицы в базе данных")
     
     try:
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        # Получаем список таблиц
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")
-        tables = cursor.fetchall()
-        
-        if tables:
-            # Создаем DataFrame со статистикой
-            table_stats = []
-            for table in tables:
-                table_name = table[0]
-                cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-                count = cursor.fetchone()[0]
-                
-                # Получаем структуру таблицы
-                cursor.execute(f"PRAGMA table_info({table_name})")
-                columns = cursor.fetchall()
-                
-                table_stats.append({
-                    "Таблица": table_name,
-                    "Записей": count,
-                    "Колонок": len(columns)
-                })
-            
-            stats_df = pd.DataFrame(table_stats)
-            st.dataframe(stats_df, use_container_width=True)
+        with db.connection() as conn:
+            cursor = conn.cursor()
             
-            st.divider()
+            # Получаем список таблиц
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")
+            tables = cursor.fetchall()
             
-            # Детальная информация по таблицам
-            for table in tables:
-                table_name = table[0]
-                with st.expander(f"📋 Детали таблицы: {table_name}"):
-                    # Показываем структуру
+            if tables:
+                # Создаем DataFrame со статистикой
+                table_stats = []
+                for table in tables:
+                    table_name = table[0]
+                    cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
+                    count = cursor.fetchone()[0]
+                    
+                    # Получаем структуру таблицы
                     cursor.execute(f"PRAGMA table_info({table_name})")
                     columns = cursor.fetchall()
                     
-                    st.write("**Структура:**")
-                    cols_df = pd.DataFrame([
-                        {
-                            "Колонка": col[1],
-                            "Тип": col[2],
-                            "NOT NULL": "Да" if col[3] else "Нет",
-                            "По умолчанию": col[4] or "-"
-                        }
-                        for col in columns
-                    ])
-                    st.dataframe(cols_df, use_container_width=True)
-                    
-                    # Показываем примеры данных (первые 5 записей)
-                    cursor.execute(f"SELECT * FROM {table_name} LIMIT 5")
-                    rows = cursor.fetchall()
-                    
-                    if rows:
-                        st.write("**Примеры данных (первые 5 записей):**")
-                        # Преобразуем в DataFrame
-                        data = [dict(row) for row in rows]
-                        # Скрываем пароли для безопасности
-                        if data and 'password_hash' in data[0]:
-                            for d in data:
-                                d['password_hash'] = '***скрыто***'
-                        st.dataframe(pd.DataFrame(data), width='stretch')
-                    else:
-                        st.info("Таблица пуста")
-        
-        conn.close()
+                    table_stats.append({
+                        "Таблица": table_name,
+                        "Записей": count,
+                        "Колонок": len(columns)
+                    })
+                
+                stats_df = pd.DataFrame(table_stats)
+                st.dataframe(stats_df, use_container_width=True)
+                
+                st.divider()
+                
+                # Детальная информация по таблицам
+                for table in tables:
+                    table_name = table[0]
+                    with st.expander(f"📋 Детали таблицы: {table_name}"):
+                        # Показываем структуру
+                        cursor.execute(f"PRAGMA table_info({table_name})")
+                        columns = cursor.fetchall()
+                        
+                        st.write("**Структура:**")
+                        cols_df = pd.DataFrame([
+                            {
+                                "Колонка": col[1],
+                                "Тип": col[2],
+                                "NOT NULL": "Да" if col[3] else "Нет",
+                                "По умолчанию": col[4] or "-"
+                            }
+                            for col in columns
+                        ])
+                        st.dataframe(cols_df, use_container_width=True)
+                        
+                        # Показываем примеры данных (первые 5 записей)
+                        cursor.execute(f"SELECT * FROM {table_name} LIMIT 5")
+                        rows = cursor.fetchall()
+                        
+                        if rows:
+                            st.write("**Примеры данных (первые 5 записей):**")
+                            # Преобразуем в DataFrame
+                            data = [dict(row) for row in rows]
+                            # Скрываем пароли для безопасности
+                            if data and 'password_hash' in data[0]:
+                                for d in data:
+                                    d['password_hash'] = '***скрыто***'
+                            st.dataframe(pd.DataFrame(data), width='stretch')
+                        else:
+                            st.info("Таблица пуста")
         
     except Exception as e:
         st.error(f"Ошибка при получении информации: {str(e)}")
@@ -1118,51 +1533,49 @@ elif page == "Database Status":
     st.subheader("👥 Статистика")
     
     try:
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        # Количество пользователей
-        cursor.execute("SELECT COUNT(*) FROM users")
-        user_count = cursor.fetchone()[0]
-        
-        # Количество портфелей
-        cursor.execute("SELECT COUNT(*) FROM portfolios")
-        portfolio_count = cursor.fetchone()[0]
-        
-        # Общий баланс всех портфелей
-        cursor.execute("SELECT SUM(balance) FROM portfolios")
-        total_balance = cursor.fetchone()[0] or 0
-        
-        # Количество сделок
-        cursor.execute("SELECT COUNT(*) FROM trade_history")
-        trade_count = cursor.fetchone()[0]
-        
-        # Количество холдингов
-        cursor.execute("SELECT COUNT(*) FROM holdings")
-        holdings_count = cursor.fetchone()[0]
-        
-        col1, col2, col3, col4, col5 = st.columns(5)
-        
-        with col1:
-            st.metric("👥 Пользователей", user_count)
-        with col2:
-            st.metric("💰 Портфелей", portfolio_count)
-        with col3:
-            st.metric("💵 Общий баланс", f"${total_balance:,.2f}")
-        with col4:
-            st.metric("📈 Сделок", trade_count)
-        with col5:
-            st.metric("📊 Холдингов", holdings_count)
-        
-        # Показываем пользователей (без паролей)
-        if user_count > 0:
-            st.subheader("📋 Список пользователей")
-            cursor.execute("SELECT id, username, email, created_at FROM users ORDER BY created_at DESC")
-            users = cursor.fetchall()
-            users_df = pd.DataFrame([dict(u) for u in users])
-            st.dataframe(users_df, use_container_width=True)
-        
-        conn.close()
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            
+            # Количество пользователей
+            cursor.execute("SELECT COUNT(*) FROM users")
+            user_count = cursor.fetchone()[0]
+            
+            # Количество портфелей
+            cursor.execute("SELECT COUNT(*) FROM portfolios")
+            portfolio_count = cursor.fetchone()[0]
+            
+            # Общий баланс всех портфелей
+            cursor.execute("SELECT SUM(balance) FROM portfolios")
+            total_balance = cursor.fetchone()[0] or 0
+            
+            # Количество сделок
+            cursor.execute("SELECT COUNT(*) FROM trade_history")
+            trade_count = cursor.fetchone()[0]
+            
+            # Количество холдингов
+            cursor.execute("SELECT COUNT(*) FROM holdings")
+            holdings_count = cursor.fetchone()[0]
+            
+            col1, col2, col3, col4, col5 = st.columns(5)
+            
+            with col1:
+                st.metric("👥 Пользователей", user_count)
+            with col2:
+                st.metric("💰 Портфелей", portfolio_count)
+            with col3:
+                st.metric("💵 Общий баланс", f"${total_balance:,.2f}")
+            with col4:
+                st.metric("📈 Сделок", trade_count)
+            with col5:
+                st.metric("📊 Холдингов", holdings_count)
+            
+            # Показываем пользователей (без паролей)
+            if user_count > 0:
+                st.subheader("📋 Список пользователей")
+                cursor.execute("SELECT id, username, email, created_at FROM users ORDER BY created_at DESC")
+                users = cursor.fetchall()
+                users_df = pd.DataFrame([dict(u) for u in users])
+                st.dataframe(users_df, use_container_width=True)
         
     except Exception as e:
         st.error(f"Ошибка при получении статистики: {str(e)}")
@@ -1187,21 +1600,20 @@ elif page == "Database Status":
                 if not sql_query.strip().upper().startswith('SELECT'):
                     st.error("Разрешены только SELECT запросы для безопасности")
                 else:
-                    conn = db.get_connection()
-                    cursor = conn.cursor()
-                    cursor.execute(sql_query)
-                    results = cursor.fetchall()
-                    
-                    if results:
-                        df = pd.DataFrame([dict(row) for row in results])
-                        # Скрываем пароли
-                        if 'password_hash' in df.columns:
-                            df['password_hash'] = '***скрыто***'
-                        st.dataframe(df, width='stretch')
-                        st.success(f"✅ Найдено записей: {len(results)}")
-                    else:
-                        st.info("Запрос выполнен, но результатов нет")
-                    conn.close()
+                    with db.connection() as conn:
+                        cursor = conn.cursor()
+                        cursor.execute(sql_query)
+                        results = cursor.fetchall()
+                        
+                        if results:
+                            df = pd.DataFrame([dict(row) for row in results])
+                            # Скрываем пароли
+                            if 'password_hash' in df.columns:
+                                df['password_hash'] = '***скрыто***'
+                            st.dataframe(df, width='stretch')
+                            st.success(f"✅ Найдено записей: {len(results)}")
+                        else:
+                            st.info("Запрос выполнен, но результатов нет")
             except Exception as e:
                 st.error(f"Ошибка выполнения запроса: {str(e)}")
                 st.code(str(e), language="text")
@@ -1218,7 +1630,7 @@ elif page == "Database Status":
     
     # Показываем портфель текущего пользователя
     try:
-        db_manager = DBManager()
+        db_manager = get_db_manager()
         portfolio = db_manager.get_portfolio(st.session_state.user_id)
         if portfolio:
             st.success(f"✅ Ваш портфель найден. Баланс: ${portfolio['balance']:.2f}")